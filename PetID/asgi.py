@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The ``events`` service in docker-compose.yml runs this application under
+uvicorn to serve long-lived async views such as the owner sighting stream
+(/core/events/), while web1/web2 keep serving regular pages through WSGI.
 """
 
 import os
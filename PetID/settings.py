@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -29,7 +30,8 @@ SECRET_KEY = config("SECRET_KEY")
 DEBUG = config("DEBUG", cast=bool)
 
 ALLOWED_HOSTS = config("ALLOWED_HOSTS", default="localhost,127.0.0.1").split(",")
-CSRF_TRUSTED_ORIGINS = config("CSRF_TRUSTED_ORIGINS", default="").split(",") if config("CSRF_TRUSTED_ORIGINS", default="") else []
+_csrf_trusted_origins = config("CSRF_TRUSTED_ORIGINS", default="")
+CSRF_TRUSTED_ORIGINS = _csrf_trusted_origins.split(",") if _csrf_trusted_origins else []
 
 
 # Application definition
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
     'core',
 ]
@@ -62,13 +65,19 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # compile แต่ละ template ครั้งเดียวต่อ process (core.warmup โหลดไว้ล่วงหน้า)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -87,11 +96,31 @@ DATABASES = {
         'PASSWORD': config("DB_PASSWORD"),
         'HOST': config("DB_HOST"),
         'PORT': config("DB_PORT"),
+        # เก็บ connection ไว้ใช้ซ้ำข้าม request แทนการเปิดใหม่ทุกครั้ง
+        'CONN_MAX_AGE': config("DB_CONN_MAX_AGE", default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 AUTH_USER_MODEL = "core.User"
 
+# Cache
+# ใช้ Redis เมื่อกำหนด REDIS_URL เพื่อให้ web1/web2 เห็น cache เดียวกัน
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -136,11 +165,67 @@ MEDIA_URL = config("MEDIA_URL", default='/media/')
 # MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_ROOT = config("MEDIA_ROOT", default=os.path.join(BASE_DIR, "media"))
 
+# Media storage: "local" keeps avatars and generated assets under MEDIA_ROOT
+# (shared media_volume); "s3" uses an S3-compatible bucket such as MinIO
+# with time-limited signed URLs (core.storage_s3)
+MEDIA_STORAGE = config("MEDIA_STORAGE", default="local")
+if MEDIA_STORAGE == "s3":
+    S3_OPTIONS = {
+        "bucket_name": config("S3_BUCKET", default="petid-media"),
+        "endpoint_url": config("S3_ENDPOINT_URL", default=None),
+        "public_endpoint_url": config("S3_PUBLIC_ENDPOINT_URL", default=None),
+        "access_key": config("S3_ACCESS_KEY", default=None),
+        "secret_key": config("S3_SECRET_KEY", default=None),
+        "region_name": config("S3_REGION", default="us-east-1"),
+        "addressing_style": "path",
+        "signature_version": "s3v4",
+        "default_acl": None,
+        "querystring_auth": True,
+        "querystring_expire": config("S3_URL_EXPIRY", default=3600, cast=int),
+    }
+    AVATAR_STORAGE = {"BACKEND": "core.storage_s3.S3ContentHashStorage", "OPTIONS": S3_OPTIONS}
+    ASSET_STORAGE = {"BACKEND": "core.storage_s3.SignedS3Storage", "OPTIONS": {**S3_OPTIONS, "location": "assets"}}
+elif MEDIA_STORAGE == "local":
+    AVATAR_STORAGE = {"BACKEND": "core.storage.ContentHashStorage"}
+    ASSET_STORAGE = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": os.path.join(MEDIA_ROOT, "assets"), "base_url": f"{MEDIA_URL}assets/"},
+    }
+else:
+    raise ImproperlyConfigured(f"MEDIA_STORAGE must be 'local' or 's3', not {MEDIA_STORAGE!r}")
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    # collectstatic ตั้งชื่อไฟล์ตาม hash ของเนื้อหา (cache ได้ถาวร) และสร้าง .gz/.br ให้ nginx
+    "staticfiles": {
+        "BACKEND": "core.staticfiles.CompressedManifestStaticFilesStorage",
+    },
+    # avatar เก็บแบบ content-addressed (core.storage) ไม่ซ้ำไฟล์เดิม
+    "avatars": AVATAR_STORAGE,
+    # ไฟล์ที่ระบบสร้างเอง เช่น QR code
+    "assets": ASSET_STORAGE,
+}
+# blob ที่ไม่มีใครอ้างถึงจะถูกลบได้หลังจากไม่ถูกเขียนมานานกว่านี้ (วินาที)
+MEDIA_BLOB_GRACE_SECONDS = 60 * 60
+
 # File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10 MB
+# multipart upload ที่ใหญ่กว่านี้จะถูกเขียนลง temp file แทนการเก็บไว้ใน RAM ของ worker
+FILE_UPLOAD_MAX_MEMORY_SIZE = config("FILE_UPLOAD_MAX_MEMORY_SIZE", default=2_621_440, cast=int)  # 2.5 MB
 FILE_UPLOAD_PERMISSIONS = 0o644
 MEDIA_ROOT_PERMISSIONS = 0o755
 
+# Chunked, resumable avatar uploads (core.uploads)
+# ต้องเป็น directory ที่ทุก web worker เห็นร่วมกัน และไม่ถูก serve เป็น media
+CHUNKED_UPLOAD_DIR = config("CHUNKED_UPLOAD_DIR", default=os.path.join(BASE_DIR, "uploads_tmp"))
+CHUNKED_UPLOAD_CHUNK_SIZE = 1024 * 1024  # size of each part sent by the browser
+CHUNKED_UPLOAD_BUFFER_SIZE = config("CHUNKED_UPLOAD_BUFFER_SIZE", default=64 * 1024, cast=int)  # bytes held in memory per read
+CHUNKED_UPLOAD_MAX_SIZE = 20 * 1024 * 1024  # 20 MB
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60  # seconds before an unfinished upload is discarded
+CHUNKED_UPLOAD_WORKERS = config("CHUNKED_UPLOAD_WORKERS", default=2, cast=int)
+AVATAR_MAX_DIMENSION = 1024  # processed avatars are downscaled to fit this box
+
 EMAIL_BACKEND = config("EMAIL_BACKEND")
 EMAIL_HOST = config("EMAIL_HOST")
 EMAIL_PORT = config("EMAIL_PORT", cast=int)
@@ -149,6 +234,79 @@ EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL")
 
+# Live sighting stream (Server-Sent Events, served by PetID.asgi)
+# ต้องเป็น cache ที่ทุก process เห็นร่วมกัน (Redis): LocMem ไม่ส่ง event ข้าม worker
+SIGHTING_CACHE_ALIAS = 'default'
+SIGHTING_EVENT_TTL = 60 * 60  # seconds an event stays replayable via Last-Event-ID
+SIGHTING_POLL_INTERVAL = config("SIGHTING_POLL_INTERVAL", default=1.0, cast=float)
+SIGHTING_HEARTBEAT = 15  # seconds between keep-alive comments
+SIGHTING_RETRY_MS = 5000
+SIGHTING_QUEUE_SIZE = 100
+
+# Medical record audit log (core.audit): flush by size or age, per worker
+AUDIT_BUFFER_SIZE = config("AUDIT_BUFFER_SIZE", default=100, cast=int)
+AUDIT_FLUSH_INTERVAL = config("AUDIT_FLUSH_INTERVAL", default=5.0, cast=float)
+
+# Per-pet card fragments on the dashboards ({% cache %}, keyed by pet id and
+# updated_at). Signed S3 avatar URLs inside a card must outlive the cached copy.
+PET_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+if MEDIA_STORAGE == "s3":
+    PET_CARD_CACHE_TIMEOUT = min(PET_CARD_CACHE_TIMEOUT, S3_OPTIONS["querystring_expire"] // 2)
+
+# Static pet card snapshots (core.cards): pet_card.html pre-rendered per pet
+# for nginx to serve, with PetCardView as the fallback. Re-rendered at least
+# every PET_CARD_CACHE_TIMEOUT by render_pet_cards (SCHEDULED_COMMANDS).
+PET_CARD_SNAPSHOTS = config("PET_CARD_SNAPSHOTS", default=False, cast=bool)
+PET_CARD_SNAPSHOT_DIR = config("PET_CARD_SNAPSHOT_DIR", default=os.path.join(BASE_DIR, "cards"))
+
+# "Found an animal" photo matching (core.phash): max pHash Hamming distance
+# (of 64 bits) for a lost pet to count as a candidate, and how many to show
+PHASH_MATCH_DISTANCE = config("PHASH_MATCH_DISTANCE", default=12, cast=int)
+PHASH_MATCH_LIMIT = 5
+FOUND_PHOTO_MAX_SIZE = 10 * 1024 * 1024  # 10 MB
+
+# Admin changelists of tables larger than this (Postgres estimate) show an
+# estimated total instead of running COUNT(*) (core.pagination)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = config("ADMIN_ESTIMATED_COUNT_THRESHOLD", default=100_000, cast=int)
+
+# Follow-up reminders (core.reminders, send_reminders): owners are emailed
+# REMINDER_LEAD_DAYS before a record's follow_up_on; reminders more than
+# REMINDER_MAX_AGE_DAYS overdue (e.g. the scheduler was down) are not sent.
+REMINDER_LEAD_DAYS = config("REMINDER_LEAD_DAYS", default=2, cast=int)
+REMINDER_MAX_AGE_DAYS = config("REMINDER_MAX_AGE_DAYS", default=7, cast=int)
+REMINDER_BATCH_SIZE = config("REMINDER_BATCH_SIZE", default=500, cast=int)
+
+# Change-event outbox (core.outbox, consume_outbox): events are read in
+# batches of OUTBOX_BATCH_SIZE and pruned OUTBOX_RETENTION_DAYS after they were
+# written, read or not.
+OUTBOX_BATCH_SIZE = config("OUTBOX_BATCH_SIZE", default=500, cast=int)
+OUTBOX_POLL_INTERVAL = config("OUTBOX_POLL_INTERVAL", default=1.0, cast=float)
+OUTBOX_RETENTION_DAYS = config("OUTBOX_RETENTION_DAYS", default=7, cast=int)
+
+# TrueType fonts embedded in the medical history PDF (core.pdf); they need Thai
+# and Latin glyphs. Without them the PDF falls back to Helvetica, which prints
+# Thai as "?". The Dockerfile installs fonts-tlwg-laksaman-ttf.
+PDF_FONT = config("PDF_FONT", default="/usr/share/fonts/truetype/tlwg/Laksaman.ttf")
+PDF_BOLD_FONT = config("PDF_BOLD_FONT", default="/usr/share/fonts/truetype/tlwg/Laksaman-Bold.ttf")
+
+# Periodic maintenance run by the scheduler service (run_scheduler):
+# (command, arguments, interval in seconds). Every command here is safe to run
+# again after a failure or on more than one host.
+SCHEDULED_COMMANDS = [
+    ("send_reminders", [], 60 * 60),
+    ("process_uploads", [], 15 * 60),
+    ("gc_media_blobs", [], 6 * 60 * 60),
+    ("prune_outbox", [], 24 * 60 * 60),
+    ("manage_partitions", [], 24 * 60 * 60),
+]
+if PET_CARD_SNAPSHOTS:
+    # snapshot ที่เก่าที่สุดมีอายุไม่เกิน PET_CARD_CACHE_TIMEOUT + รอบนี้ = 3/4 ของอายุ signed URL บน S3
+    SCHEDULED_COMMANDS.append(("render_pet_cards", [], PET_CARD_CACHE_TIMEOUT // 2))
+
+# Prime URL resolvers, templates and the DB connection in each gunicorn
+# worker before it accepts traffic (core.warmup, gunicorn.conf.py)
+WARMUP_ON_START = config("WARMUP_ON_START", default=True, cast=bool)
+
 AUTHENTICATION_BACKENDS = ["core.backends.EmailBackend", "django.contrib.auth.backends.ModelBackend"]
 
 # CORS Settings for ngrok and media files
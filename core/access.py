@@ -0,0 +1,69 @@
+"""
+Doctor-to-pet access grants.
+
+Access checks read a per-doctor set of pet ids from the shared cache instead
+of loading ``doctor.pets.all()`` on every request. Every write path goes
+through ``bulk_update_access`` (or fires ``m2m_changed``, see core.signals),
+which invalidates the affected doctors once after commit and records the
+change in the outbox (core.outbox).
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Doctor
+from .outbox import ACCESS_GRANTED, ACCESS_REVOKED, emit_access_change
+
+ACCESS_CACHE_TIMEOUT = 60 * 15
+
+
+def _cache_key(doctor_id):
+    return f"access:doctor:{doctor_id}:pets"
+
+
+def doctor_pet_ids(doctor_id):
+    """Return the frozenset of pet ids ``doctor_id`` has been granted."""
+    key = _cache_key(doctor_id)
+    pet_ids = cache.get(key)
+    if pet_ids is None:
+        pet_ids = frozenset(
+            Doctor.pets.through.objects.filter(doctor_id=doctor_id).values_list('pet_id', flat=True)
+        )
+        cache.set(key, pet_ids, ACCESS_CACHE_TIMEOUT)
+    return pet_ids
+
+
+def doctor_has_access(doctor, pet_id):
+    return pet_id in doctor_pet_ids(doctor.pk)
+
+
+def invalidate_access_cache(doctor_ids):
+    cache.delete_many([_cache_key(doctor_id) for doctor_id in set(doctor_ids)])
+
+
+def bulk_update_access(pet_ids, grant=(), revoke=()):
+    """Grant and/or revoke access for every (pet, doctor) pair in one transaction.
+
+    Grants are a single ``bulk_create(ignore_conflicts=True)`` on the through
+    table and revocations a single DELETE. Returns ``(granted, revoked)``,
+    where ``granted`` counts the pairs requested (existing pairs are skipped
+    by the database). One outbox event per pet lists the doctors requested.
+    """
+    Through = Doctor.pets.through
+    pet_ids = set(pet_ids)
+    grant = set(grant)
+    revoke = set(revoke) - grant
+    granted = revoked = 0
+
+    with transaction.atomic():
+        if pet_ids and grant:
+            rows = [Through(doctor_id=doctor_id, pet_id=pet_id) for doctor_id in grant for pet_id in pet_ids]
+            Through.objects.bulk_create(rows, ignore_conflicts=True, batch_size=1000)
+            granted = len(rows)
+            emit_access_change(ACCESS_GRANTED, pet_ids, grant)
+        if pet_ids and revoke:
+            revoked, _ = Through.objects.filter(doctor_id__in=revoke, pet_id__in=pet_ids).delete()
+            if revoked:
+                emit_access_change(ACCESS_REVOKED, pet_ids, revoke)
+        transaction.on_commit(lambda: invalidate_access_cache(grant | revoke))
+
+    return granted, revoked
@@ -1,7 +1,41 @@
 from django.contrib import admin
-from .models import User, Pet, Doctor, MedicalRecord
+from django.db.models import Q
+from .models import User, Pet, Doctor, MedicalRecord, PetFacetCount
+from .pagination import EstimatedCountPaginator
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows.
+
+    No COUNT(*) of the whole table per page (estimated total, and no
+    "x of y selected" count), and FK columns come from a join instead of a
+    query per row (``list_select_related``).
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class SpeciesListFilter(admin.SimpleListFilter):
+    # ตัวเลือกมาจากตารางสรุป (core.facets) แทน SELECT DISTINCT ทั้งตาราง pet
+    title = "species"
+    parameter_name = "species"
+    max_choices = 30
+
+    def lookups(self, request, model_admin):
+        species = (
+            PetFacetCount.objects.exclude(species="").filter(count__gt=0)
+            .values_list("species", flat=True).distinct().order_by("species")[:self.max_choices]
+        )
+        return [(value, value) for value in species]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(species_normalized=self.value())
+        return queryset
+
+
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     fieldsets = (
@@ -13,6 +47,63 @@ class UserAdmin(BaseUserAdmin):
         (None, {"classes": ("wide",), "fields": ("email","password1","password2","role")}),
     )
     list_display = ("email","first_name","last_name","role","is_staff")
+    list_filter = ("role", "is_staff", "is_active")
+    # ตรงกับ trigram index ของ UPPER(email/first_name/last_name); User ไม่มี username
+    search_fields = ("email", "first_name", "last_name")
     ordering = ("email",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Pet)
+class PetAdmin(LargeTableAdmin):
+    list_display = ("name", "species", "breed", "owner", "is_lost", "updated_at")
+    list_select_related = ("owner",)
+    list_filter = ("is_lost", SpeciesListFilter)
+    search_fields = ("name",)
+    search_help_text = "Pet name, exact QR slug or exact owner email"
+    autocomplete_fields = ("owner",)
+    readonly_fields = ("created_at", "updated_at")
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # owner อยู่ใน subquery: เงื่อนไขทั้งหมดอยู่บนตาราง pet จึงใช้ index ได้ทุกตัว (BitmapOr)
+        owners = User.objects.filter(email__iexact=search_term).values("id")
+        return queryset.filter(
+            Q(name__icontains=search_term) | Q(qr_slug=search_term) | Q(owner__in=owners)
+        ), False
+
+
+@admin.register(Doctor)
+class DoctorAdmin(LargeTableAdmin):
+    list_display = ("__str__", "user", "clinic")
+    list_select_related = ("user",)
+    search_fields = ("clinic",)
+    search_help_text = "Doctor name, email or clinic"
+    autocomplete_fields = ("user", "pets")
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
+
+@admin.register(MedicalRecord)
+class MedicalRecordAdmin(LargeTableAdmin):
+    list_display = ("diagnosis", "pet", "doctor", "date")
+    # Doctor.__str__ อ่าน user
+    list_select_related = ("pet", "doctor__user")
+    # ช่วงวันที่ให้ Postgres ตัด partition รายปีที่ไม่เกี่ยวทิ้ง
+    list_filter = ("date",)
+    search_fields = ("pet__name",)
+    search_help_text = "Pet name or exact QR slug"
+    autocomplete_fields = ("pet", "doctor")
 
-admin.site.register([Pet, Doctor, MedicalRecord])
\ No newline at end of file
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        pets = Pet.objects.filter(Q(name__icontains=search_term) | Q(qr_slug=search_term)).values("id")
+        return queryset.filter(pet__in=pets), False
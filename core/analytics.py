@@ -0,0 +1,185 @@
+"""
+Clinic analytics for doctors.
+
+Three rollup tables are kept up to date from every medical record create,
+edit and delete (core.signals), so the analytics page never scans
+``MedicalRecord``:
+
+* ``DoctorVisitMonth``: records per doctor and month.
+* ``DoctorDiagnosisCount``: records per doctor and normalized diagnosis.
+* ``DoctorPatient``: one row per (doctor, pet) with records, carrying the
+  pet's species and ``is_lost`` flag (updated when the pet changes), so
+  patients per species and lost patients are counted over the doctor's own
+  rows only.
+
+Counts are adjusted with upserts, as in core.facets. Decrements of
+``DoctorPatient`` are plain UPDATEs: when a pet is deleted its rows may
+already be gone by the time the cascaded record deletes are signalled.
+``rebuild_doctor_analytics`` recomputes the tables if they drift (for example
+after records were changed with raw SQL or ``QuerySet.update``).
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import DoctorDiagnosisCount, DoctorPatient, DoctorVisitMonth, normalize_facet
+
+MONTH_UPSERT_SQL = """
+    INSERT INTO core_doctorvisitmonth (doctor_id, month, visits)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (doctor_id, month)
+    DO UPDATE SET visits = core_doctorvisitmonth.visits + EXCLUDED.visits
+"""
+
+DIAGNOSIS_UPSERT_SQL = """
+    INSERT INTO core_doctordiagnosiscount (doctor_id, diagnosis, visits)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (doctor_id, diagnosis)
+    DO UPDATE SET visits = core_doctordiagnosiscount.visits + EXCLUDED.visits
+"""
+
+# species/is_lost อ่านจากแถว pet ตอนเพิ่ม ไม่พึ่งค่าใน instance ที่อาจเก่า
+PATIENT_UPSERT_SQL = """
+    INSERT INTO core_doctorpatient (doctor_id, pet_id, species, is_lost, visits)
+    SELECT %s, id, species_normalized, is_lost, %s FROM core_pet WHERE id = %s
+    ON CONFLICT (doctor_id, pet_id)
+    DO UPDATE SET visits = core_doctorpatient.visits + EXCLUDED.visits
+"""
+
+PATIENT_DECREMENT_SQL = """
+    UPDATE core_doctorpatient SET visits = visits + %s WHERE doctor_id = %s AND pet_id = %s
+"""
+
+REBUILD_SQL = [
+    """
+    INSERT INTO core_doctorvisitmonth (doctor_id, month, visits)
+    SELECT doctor_id, date_trunc('month', date)::date, count(*)
+    FROM core_medicalrecord WHERE doctor_id IS NOT NULL
+    GROUP BY 1, 2
+    """,
+    # เหมือน normalize_facet: ตัดช่องว่างหัวท้าย ช่องว่างซ้อนเหลือหนึ่ง ตัวพิมพ์เล็ก
+    r"""
+    INSERT INTO core_doctordiagnosiscount (doctor_id, diagnosis, visits)
+    SELECT doctor_id, lower(regexp_replace(btrim(diagnosis), '\s+', ' ', 'g')), count(*)
+    FROM core_medicalrecord WHERE doctor_id IS NOT NULL
+    GROUP BY 1, 2
+    """,
+    """
+    INSERT INTO core_doctorpatient (doctor_id, pet_id, species, is_lost, visits)
+    SELECT r.doctor_id, r.pet_id, p.species_normalized, p.is_lost, count(*)
+    FROM core_medicalrecord r JOIN core_pet p ON p.id = r.pet_id
+    WHERE r.doctor_id IS NOT NULL
+    GROUP BY r.doctor_id, r.pet_id, p.species_normalized, p.is_lost
+    """,
+]
+
+ROLLUP_TABLES = ("core_doctorvisitmonth", "core_doctordiagnosiscount", "core_doctorpatient")
+
+
+def rollup_key(doctor_id, pet_id, date, diagnosis):
+    """What a record contributes to the rollups, or None if it has no doctor."""
+    if doctor_id is None or date is None:
+        return None
+    return (doctor_id, pet_id, date.replace(day=1), normalize_facet(diagnosis))
+
+
+def record_key(record):
+    return rollup_key(record.doctor_id, record.pet_id, record.date, record.diagnosis)
+
+
+def adjust_record_counts(previous, current):
+    """Move one record's contribution from ``previous`` to ``current`` (either may be None)."""
+    if previous == current:
+        return
+    months, diagnoses, patients = {}, {}, {}
+    for key, delta in ((previous, -1), (current, 1)):
+        if key is None:
+            continue
+        doctor_id, pet_id, month, diagnosis = key
+        for counts, k in ((months, (doctor_id, month)), (diagnoses, (doctor_id, diagnosis)),
+                          (patients, (doctor_id, pet_id))):
+            counts[k] = counts.get(k, 0) + delta
+
+    # เรียง key ให้ transaction ที่แก้หลายแถวพร้อมกันล็อกตามลำดับเดียวกัน (กัน deadlock)
+    with connection.cursor() as cursor:
+        for sql, counts in ((MONTH_UPSERT_SQL, months), (DIAGNOSIS_UPSERT_SQL, diagnoses)):
+            rows = sorted((*k, delta) for k, delta in counts.items() if delta)
+            if rows:
+                cursor.executemany(sql, rows)
+        for (doctor_id, pet_id), delta in sorted(patients.items()):
+            if delta > 0:
+                cursor.execute(PATIENT_UPSERT_SQL, [doctor_id, delta, pet_id])
+            elif delta < 0:
+                cursor.execute(PATIENT_DECREMENT_SQL, [delta, doctor_id, pet_id])
+                DoctorPatient.objects.filter(doctor_id=doctor_id, pet_id=pet_id, visits__lte=0).delete()
+
+
+def pet_changed(pet):
+    """Copy ``pet``'s species and lost flag onto its DoctorPatient rows."""
+    DoctorPatient.objects.filter(pet=pet).exclude(species=pet.species_normalized, is_lost=pet.is_lost).update(
+        species=pet.species_normalized, is_lost=pet.is_lost,
+    )
+
+
+def _month_start(day, months_back):
+    index = day.year * 12 + day.month - 1 - months_back
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def total_visits(doctor):
+    return DoctorVisitMonth.objects.filter(doctor=doctor).aggregate(n=Sum("visits"))["n"] or 0
+
+
+def doctor_analytics(doctor, months=12, top=10):
+    """Analytics of ``doctor`` read from the rollup tables only."""
+    this_month = timezone.localdate().replace(day=1)
+    first = _month_start(this_month, months - 1)
+    by_month = dict(
+        DoctorVisitMonth.objects.filter(doctor=doctor, month__gte=first).values_list("month", "visits")
+    )
+    visits_per_month = [
+        {"month": month.isoformat(), "visits": by_month.get(month, 0)}
+        for month in (_month_start(this_month, i) for i in reversed(range(months)))
+    ]
+
+    diagnoses = (
+        DoctorDiagnosisCount.objects.filter(doctor=doctor, visits__gt=0)
+        .order_by("-visits", "diagnosis")[:top]
+    )
+    species = (
+        DoctorPatient.objects.filter(doctor=doctor)
+        .values("species")
+        .annotate(patients=Count("id"), lost=Count("id", filter=Q(is_lost=True)))
+        .order_by("-patients", "species")
+    )
+    species = [
+        {"species": row["species"], "patients": row["patients"], "lost": row["lost"]}
+        for row in species
+    ]
+    return {
+        "total_visits": total_visits(doctor),
+        "visits_per_month": visits_per_month,
+        "top_diagnoses": [{"diagnosis": d.diagnosis, "visits": d.visits} for d in diagnoses],
+        "patients_per_species": species,
+        "patients": sum(row["patients"] for row in species),
+        "lost_patients": sum(row["lost"] for row in species),
+    }
+
+
+def rebuild_doctor_analytics():
+    """Recompute the rollup tables from the medical records."""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # upsert จาก signal ต้องรอจนเขียนตารางใหม่เสร็จ
+            cursor.execute(f"LOCK TABLE {', '.join(ROLLUP_TABLES)} IN EXCLUSIVE MODE")
+            for table in ROLLUP_TABLES:
+                cursor.execute(f"DELETE FROM {table}")
+            for sql in REBUILD_SQL:
+                cursor.execute(sql)
+    return {
+        "months": DoctorVisitMonth.objects.count(),
+        "diagnoses": DoctorDiagnosisCount.objects.count(),
+        "patients": DoctorPatient.objects.count(),
+    }
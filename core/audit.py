@@ -0,0 +1,112 @@
+"""
+Buffered audit trail of medical record access.
+
+Views call ``record_access``; events are kept in a per-worker buffer and
+written with a single ``bulk_create`` once ``AUDIT_BUFFER_SIZE`` events have
+accumulated or the oldest event is ``AUDIT_FLUSH_INTERVAL`` seconds old, so a
+page view never waits on its own audit INSERT. A background timer flushes idle
+workers and ``atexit`` flushes whatever is left on shutdown.
+"""
+import atexit
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import RecordAccessLog
+
+
+class AuditBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # เรียกใหม่หลัง fork (gunicorn preload) เพื่อไม่ให้ worker ใช้ buffer/thread ของ master
+        self._pid = os.getpid()
+        self._events = []
+        self._oldest = None
+        self._timer = None
+
+    def add(self, event):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._events.append(event)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            batch = self._take_if_due()
+            if not batch and self._timer is None:
+                self._start_timer()
+        if batch:
+            self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._write(batch)
+
+    def _take_if_due(self):
+        if len(self._events) >= settings.AUDIT_BUFFER_SIZE:
+            return self._take()
+        if self._oldest is not None and time.monotonic() - self._oldest >= settings.AUDIT_FLUSH_INTERVAL:
+            return self._take()
+        return []
+
+    def _take(self):
+        batch, self._events, self._oldest = self._events, [], None
+        return batch
+
+    def _start_timer(self):
+        self._timer = threading.Timer(settings.AUDIT_FLUSH_INTERVAL, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            batch = self._take()
+        if batch:
+            try:
+                self._write(batch)
+            finally:
+                # thread นี้มี DB connection ของตัวเอง ปิดทิ้งเมื่อเขียนเสร็จ
+                connection.close()
+
+    @staticmethod
+    def _write(batch):
+        try:
+            RecordAccessLog.objects.bulk_create(batch, batch_size=settings.AUDIT_BUFFER_SIZE)
+        except Exception as e:
+            print(f"Audit log flush error ({len(batch)} events dropped): {e}")
+
+
+buffer = AuditBuffer()
+atexit.register(buffer.flush)
+
+
+def record_access(user, pet_id, action, record_id=None):
+    """Queue an audit event for ``user`` touching ``pet_id``'s medical records."""
+    buffer.add(RecordAccessLog(
+        user_id=user.pk if user.is_authenticated else None,
+        pet_id=pet_id,
+        record_id=record_id,
+        action=action,
+    ))
+
+
+def accesses_for_pet(pet_id, start, end):
+    """Audit events for ``pet_id`` with ``start <= accessed_at < end``, newest first.
+
+    The time range lets Postgres prune to the matching monthly partitions and
+    then use the (pet, accessed_at) index inside each one.
+    """
+    return (
+        RecordAccessLog.objects
+        .filter(pet_id=pet_id, accessed_at__gte=start, accessed_at__lt=end)
+        .select_related('user')
+        .order_by('-accessed_at')
+    )
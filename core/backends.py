@@ -1,15 +1,104 @@
+"""
+Authentication backends.
+
+``EmailBackend`` logs users in by email. It also caches each user's full
+permission set in the shared cache, so ``PermissionRequiredMixin`` checks no
+longer query ``auth_permission`` on every request.
+
+Cache keys carry the user's role, superuser flag and two version stamps.
+One is per user, bumped when the user's groups or direct permissions change.
+The other is global, bumped when any group's permissions change (core.signals). A bump
+makes the old entries unreachable; they simply expire.
+"""
+import uuid
+
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
 
 User = get_user_model()
 
+PERMISSION_CACHE_TIMEOUT = 60 * 60
+GLOBAL_PERMISSION_VERSION_KEY = "perms:version"
+
+ROLE_GROUPS = {
+    "OWNER": "Owner",
+    "DOCTOR": "Doctor",
+}
+
+
+def _user_version_key(user_id):
+    return f"perms:user:{user_id}:version"
+
+
+def permission_cache_key(user):
+    versions = cache.get_many([GLOBAL_PERMISSION_VERSION_KEY, _user_version_key(user.pk)])
+    global_version = versions.get(GLOBAL_PERMISSION_VERSION_KEY) or bump_permission_version()
+    user_version = versions.get(_user_version_key(user.pk)) or bump_permission_version([user.pk])
+    # superuser ได้ทุก permission: ถ้าถอดสิทธิ์แล้วต้องไม่ใช้ชุดเดิมที่ cache ไว้
+    return f"perms:{global_version}:{user.pk}:{user.role}:{int(user.is_superuser)}:{user_version}"
+
+
+def bump_permission_version(user_ids=None):
+    """Invalidate cached permissions of ``user_ids``, or of everyone if None.
+
+    Returns the new version stamp (the last one when several users are given).
+    """
+    # ใช้ค่าสุ่มแทนตัวนับ: ถ้า key หายจาก cache จะไม่ย้อนกลับไปใช้ version เก่าที่ยังค้างอยู่
+    version = uuid.uuid4().hex[:12]
+    if user_ids is None:
+        cache.set(GLOBAL_PERMISSION_VERSION_KEY, version, None)
+    else:
+        cache.set_many({_user_version_key(user_id): version for user_id in set(user_ids)}, None)
+    return version
+
+
+def sync_role_group(user):
+    """Make ``user`` a member of exactly the group for its role.
+
+    Nothing is written when the membership is already correct, which is the
+    case on almost every login.
+    """
+    group_name = ROLE_GROUPS.get(user.role)
+    if group_name is None:
+        return
+    if list(user.groups.values_list("name", flat=True)) == [group_name]:
+        return
+    group, _ = Group.objects.get_or_create(name=group_name)
+    user.groups.set([group])
+
+
 class EmailBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
         # username here will be email from the login form
+        if username is None or password is None:
+            return None
+        email = username.strip()
         try:
-            user = User.objects.get(email__iexact=username)
+            user = User.objects.get(email__iexact=email)
+        except User.MultipleObjectsReturned:
+            # บัญชีเก่าที่ email ต่างกันแค่ตัวพิมพ์ (migration 0007 ไม่ได้แปลง): ต้องพิมพ์ให้ตรงทุกตัว
+            user = User.objects.filter(email=email).first()
         except User.DoesNotExist:
+            user = None
+        if user is None:
+            # hash รหัสผ่านทิ้งไป ให้ใช้เวลาเท่ากับกรณีเจอ user (กันการเดา email จากเวลาตอบ)
+            User().set_password(password)
             return None
         if user.check_password(password):
             return user
         return None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return super().get_all_permissions(user_obj, obj)
+        # ModelBackend ใช้ attribute เดียวกันนี้ จึงไม่ query ซ้ำเมื่อเรียกผ่าน backend ถัดไป
+        if not hasattr(user_obj, "_perm_cache"):
+            key = permission_cache_key(user_obj)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, PERMISSION_CACHE_TIMEOUT)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,119 @@
+"""
+Static snapshots of the public pet card.
+
+QR scans are the busiest path. With ``PET_CARD_SNAPSHOTS`` enabled each
+pet's ``pet_card.html`` is rendered to ``PET_CARD_SNAPSHOT_DIR/<qr_slug>.html``
+and nginx serves that file directly, falling back to ``PetCardView`` when
+there is none (nginx/nginx.conf).
+
+A snapshot is re-rendered on a background thread after the pet (including its
+avatar and ``is_lost``) or its owner's contact details change, and removed
+when the pet is deleted (core.signals). ``Pet.card_rendered_at`` records when
+it was last rendered. ``render_pet_cards`` re-renders snapshots older than the
+pet's ``updated_at`` or than ``PET_CARD_CACHE_TIMEOUT`` (signed S3 avatar URLs
+expire); the scheduler runs it every ``PET_CARD_CACHE_TIMEOUT / 2``
+(SCHEDULED_COMMANDS), so snapshots are replaced before their URLs expire.
+"""
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Lock
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .utils import pet_card_url
+
+_executor = None
+_executor_lock = Lock()
+
+
+def snapshot_path(qr_slug):
+    return os.path.join(settings.PET_CARD_SNAPSHOT_DIR, f"{qr_slug}.html")
+
+
+def stale_pets():
+    """Pets whose snapshot is missing, older than the pet, or about to expire."""
+    from .models import Pet
+
+    cutoff = timezone.now() - timedelta(seconds=settings.PET_CARD_CACHE_TIMEOUT)
+    return Pet.objects.filter(
+        Q(card_rendered_at__isnull=True)
+        | Q(card_rendered_at__lt=F("updated_at"))
+        | Q(card_rendered_at__lt=cutoff)
+    )
+
+
+def scan_request(qr_slug):
+    """A GET of the card as a QR scan makes it, on the public host (``NGROK_DOMAIN``)."""
+    from django.test import RequestFactory
+
+    url = urlsplit(pet_card_url(qr_slug))
+    return RequestFactory().get(url.path, HTTP_HOST=url.netloc, secure=url.scheme == "https")
+
+
+def render_snapshot(pet_id):
+    """Write the snapshot of one pet. Returns False if the pet no longer exists."""
+    from .models import Pet
+
+    # ใช้เวลาก่อน render: ถ้า pet ถูกแก้ระหว่างนี้ updated_at จะใหม่กว่า แล้วถูก render ซ้ำรอบหน้า
+    started = timezone.now()
+    pet = Pet.objects.select_related("owner").filter(pk=pet_id).first()
+    if pet is None:
+        return False
+    # template อ่าน host จาก request (เช่น ngrok-skip-browser-warning ของรูป) จึงจำลอง request ของคนสแกน
+    html = render_to_string("pet_card.html", {"pet": pet}, request=scan_request(pet.qr_slug))
+
+    os.makedirs(settings.PET_CARD_SNAPSHOT_DIR, exist_ok=True)
+    # เขียนลง temp file แล้ว rename ทับ nginx จะไม่เห็นไฟล์ที่เขียนไม่ครบ
+    fd, tmp_path = tempfile.mkstemp(dir=settings.PET_CARD_SNAPSHOT_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, snapshot_path(pet.qr_slug))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    Pet.objects.filter(pk=pet.pk).update(card_rendered_at=started)
+    return True
+
+
+def delete_snapshot(qr_slug):
+    try:
+        os.remove(snapshot_path(qr_slug))
+    except FileNotFoundError:
+        pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pet-card")
+        return _executor
+
+
+def schedule_render(pet_ids):
+    if not settings.PET_CARD_SNAPSHOTS:
+        return
+    pet_ids = list(pet_ids)
+    if pet_ids:
+        transaction.on_commit(lambda: _get_executor().submit(_render_in_thread, pet_ids))
+
+
+def _render_in_thread(pet_ids):
+    close_old_connections()
+    try:
+        for pet_id in pet_ids:
+            try:
+                render_snapshot(pet_id)
+            except Exception as e:
+                print(f"Error rendering pet card {pet_id}: {e}")
+    finally:
+        connection.close()
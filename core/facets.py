@@ -0,0 +1,101 @@
+"""
+Faceted pet search.
+
+``Pet`` keeps normalized copies of species, breed and color
+(``*_normalized``, set in ``Pet.save``), so "Dog", " dog" and "DOG" are one
+facet value and filters can use plain btree indexes.
+
+``PetFacetCount`` holds the number of pets per (species, breed, color)
+combination. core.signals adjusts it on every Pet save and delete with an
+upsert, so facet counts over all pets are sums over this small table rather
+than a GROUP BY over the pet table. Searches over a user's own pets, or
+narrowed by a name query, count the matching pets directly; those sets are
+already small. ``rebuild_pet_facets`` recomputes the table if it drifts (for
+example after raw SQL updates).
+"""
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from .models import Pet, PetFacetCount
+
+FACETS = Pet.FACET_FIELDS
+
+UPSERT_SQL = """
+    INSERT INTO core_petfacetcount (species, breed, color, count)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (species, breed, color)
+    DO UPDATE SET count = core_petfacetcount.count + EXCLUDED.count
+"""
+
+
+def facet_key(pet):
+    return tuple(getattr(pet, f"{facet}_normalized") for facet in FACETS)
+
+
+def adjust_facet_counts(deltas):
+    """Apply ``{(species, breed, color): delta}`` to PetFacetCount."""
+    rows = [(*key, delta) for key, delta in deltas.items() if delta]
+    if not rows:
+        return
+    # เรียง key เพื่อให้ transaction ที่แก้หลายแถวพร้อมกันล็อกตามลำดับเดียวกัน (กัน deadlock)
+    rows.sort()
+    with connection.cursor() as cursor:
+        cursor.executemany(UPSERT_SQL, rows)
+
+
+def summary_facet_counts(filters, limit):
+    """Facet counts over all pets, from PetFacetCount.
+
+    Each facet is counted with the filters on the *other* facets applied, so
+    the sidebar still lists the alternatives to the selected value.
+    """
+    counts = {}
+    for facet in FACETS:
+        rows = (
+            PetFacetCount.objects.filter(**{k: v for k, v in filters.items() if k != facet})
+            .exclude(**{facet: ""})
+            .values(facet)
+            .annotate(n=Sum("count"))
+            .filter(n__gt=0)
+            .order_by("-n", facet)[:limit]
+        )
+        counts[facet] = [{"value": row[facet], "count": row["n"]} for row in rows]
+    return counts
+
+
+def queryset_facet_counts(pets, filters, limit):
+    """Facet counts over ``pets`` (a queryset not yet filtered by facet)."""
+    counts = {}
+    for facet in FACETS:
+        column = f"{facet}_normalized"
+        rows = (
+            pets.filter(**{f"{k}_normalized": v for k, v in filters.items() if k != facet})
+            .exclude(**{column: ""})
+            .values(column)
+            .annotate(n=Count("pk"))
+            .order_by("-n", column)[:limit]
+        )
+        counts[facet] = [{"value": row[column], "count": row["n"]} for row in rows]
+    return counts
+
+
+def rebuild_facet_counts():
+    """Recompute PetFacetCount from the pet table. Returns the number of rows."""
+    rows = (
+        Pet.objects.values(*(f"{facet}_normalized" for facet in FACETS))
+        .annotate(n=Count("pk"))
+        .order_by()
+    )
+    with transaction.atomic():
+        # upsert จาก signal ของ Pet ต้องรอจนเขียนตารางใหม่เสร็จ
+        with connection.cursor() as cursor:
+            cursor.execute("LOCK TABLE core_petfacetcount IN EXCLUSIVE MODE")
+        PetFacetCount.objects.all().delete()
+        objs = PetFacetCount.objects.bulk_create(
+            [
+                PetFacetCount(**{facet: row[f"{facet}_normalized"] for facet in FACETS}, count=row["n"])
+                for row in rows.iterator()
+            ],
+            batch_size=1000,
+        )
+    return len(objs)
@@ -1,22 +1,33 @@
 from django import forms
 from django.forms import ModelForm
-from .models import Pet, MedicalRecord, User
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import Pet, MedicalRecord, User, ChunkedUpload
+
+# Tailwind classes ที่ widget หลายตัวใช้ร่วมกัน
+INPUT_CLASS = "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"
+LARGE_INPUT_CLASS = "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200"
+FILE_INPUT_CLASS = "mt-1 block w-full text-sm text-gray-500 file:mr-4 file:py-2 file:px-4 file:rounded-lg file:border-0 file:text-sm file:font-semibold file:bg-blue-50 file:text-blue-700 hover:file:bg-blue-100"
 
 class RegistrationForm(ModelForm):
-    password1 = forms.CharField(label="Password", widget=forms.PasswordInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}))
-    password2 = forms.CharField(label="Confirm Password", widget=forms.PasswordInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}))
+    password1 = forms.CharField(label="Password", widget=forms.PasswordInput(attrs={"class": INPUT_CLASS}))
+    password2 = forms.CharField(label="Confirm Password", widget=forms.PasswordInput(attrs={"class": INPUT_CLASS}))
 
     class Meta:
         model = User
         fields = ["first_name","last_name","email","role","phone_number"]
         widgets = {
-            "first_name": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "last_name": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "email": forms.EmailInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "role": forms.Select(choices=User.ROLE_CHOICES, attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "phone_number": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
+            "first_name": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "last_name": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "email": forms.EmailInput(attrs={"class": INPUT_CLASS}),
+            "role": forms.Select(choices=User.ROLE_CHOICES, attrs={"class": INPUT_CLASS}),
+            "phone_number": forms.TextInput(attrs={"class": INPUT_CLASS}),
         }
 
+    def clean_email(self):
+        return self.cleaned_data["email"].strip().lower()
+
     def clean_password1(self):
         # valid passsword strength
         p1 = self.cleaned_data.get("password1")
@@ -44,18 +55,43 @@ class RegistrationForm(ModelForm):
 
 class LoginForm(forms.Form):
     email = forms.EmailField(label="Email")
-    password = forms.CharField(label="Password", widget=forms.PasswordInput(attrs={"autocomplete": "current-password", "class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}))
+    password = forms.CharField(label="Password", widget=forms.PasswordInput(attrs={"autocomplete": "current-password", "class": INPUT_CLASS}))
+
+class ChunkedAvatarMixin(forms.Form):
+    """Lets a pet form take its avatar from a finished chunked upload (core.uploads)."""
+    upload_token = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+
+    def clean(self):
+        cleaned_data = super().clean()
+        token = cleaned_data.get("upload_token")
+        if not token:
+            return cleaned_data
+        upload = ChunkedUpload.objects.filter(token=token, user=self.user).first()
+        if upload is None or upload.status == "FAILED":
+            self.add_error("upload_token", upload.error if upload else "Upload not found, please upload the photo again")
+        elif upload.status != "READY":
+            self.add_error("upload_token", "The photo is still being processed, please wait a moment")
+        elif upload.updated_at < timezone.now() - timedelta(seconds=settings.MEDIA_BLOB_GRACE_SECONDS):
+            # blob ที่ยังไม่มีใครอ้างถึงอาจถูก gc_media_blobs ลบไปแล้ว
+            self.add_error("upload_token", "Upload expired, please upload the photo again")
+        else:
+            cleaned_data["avatar"] = upload.result
+        return cleaned_data
 
-class PetForm(ModelForm):
+class PetForm(ChunkedAvatarMixin, ModelForm):
     class Meta:
         model = Pet
         fields = ["name","species","breed","color","birth_date","avatar"]
         widgets = {
-            "name": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "species": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "breed": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "color": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "birth_date": forms.DateInput(attrs={"type": "date", "class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
+            "name": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "species": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "breed": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "color": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "birth_date": forms.DateInput(attrs={"type": "date", "class": INPUT_CLASS}),
             "avatar": forms.ClearableFileInput(attrs={"class": "mt-1 block w-full"}),
         }
 
@@ -69,64 +105,74 @@ class PetForm(ModelForm):
 class MedicalRecordForm(ModelForm):
     class Meta:
         model = MedicalRecord
-        fields = ["diagnosis","treatment","prescription","notes"]
+        fields = ["diagnosis","treatment","prescription","notes","follow_up_on"]
         widgets = {
-            "diagnosis": forms.TextInput(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2"}),
-            "treatment": forms.Textarea(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2", "rows": 3}),
-            "prescription": forms.Textarea(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2", "rows": 3}),
-            "notes": forms.Textarea(attrs={"class": "mt-1 block w-full border border-gray-300 rounded-md shadow-sm p-2", "rows": 3}),
+            "diagnosis": forms.TextInput(attrs={"class": INPUT_CLASS}),
+            "treatment": forms.Textarea(attrs={"class": INPUT_CLASS, "rows": 3}),
+            "prescription": forms.Textarea(attrs={"class": INPUT_CLASS, "rows": 3}),
+            "notes": forms.Textarea(attrs={"class": INPUT_CLASS, "rows": 3}),
+            "follow_up_on": forms.DateInput(attrs={"type": "date", "class": INPUT_CLASS}),
         }
 
+    def save(self, commit=True):
+        # เลื่อนนัดแล้วต้องเตือนใหม่
+        if "follow_up_on" in self.changed_data:
+            self.instance.reminder_sent_at = None
+        return super().save(commit=commit)
+
 class UserProfileForm(ModelForm):
     class Meta:
         model = User
         fields = ["first_name", "last_name", "email", "phone_number"]
         widgets = {
             "first_name": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter your first name"
             }),
             "last_name": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter your last name"
             }),
             "email": forms.EmailInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter your email address"
             }),
             "phone_number": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter your phone number"
             }),
         }
 
-class PetEditForm(ModelForm):
+    def clean_email(self):
+        return self.cleaned_data["email"].strip().lower()
+
+class PetEditForm(ChunkedAvatarMixin, ModelForm):
     class Meta:
         model = Pet
         fields = ["name", "species", "breed", "color", "birth_date", "avatar"]
         widgets = {
             "name": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter pet's name"
             }),
             "species": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "e.g., Dog, Cat, Bird"
             }),
             "breed": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter breed"
             }),
             "color": forms.TextInput(attrs={
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200",
+                "class": LARGE_INPUT_CLASS,
                 "placeholder": "Enter color"
             }),
             "birth_date": forms.DateInput(attrs={
                 "type": "date",
-                "class": "mt-1 block w-full border border-gray-300 rounded-lg shadow-sm px-4 py-3 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition duration-200"
+                "class": LARGE_INPUT_CLASS
             }),
             "avatar": forms.ClearableFileInput(attrs={
-                "class": "mt-1 block w-full text-sm text-gray-500 file:mr-4 file:py-2 file:px-4 file:rounded-lg file:border-0 file:text-sm file:font-semibold file:bg-blue-50 file:text-blue-700 hover:file:bg-blue-100"
+                "class": FILE_INPUT_CLASS
             }),
         }
 
@@ -136,3 +182,16 @@ class PetEditForm(ModelForm):
         if b and b > date.today():
             raise forms.ValidationError("Birthday cannot be in the future")
         return b
+
+class FoundAnimalForm(forms.Form):
+    photo = forms.ImageField(widget=forms.FileInput(attrs={
+        "class": FILE_INPUT_CLASS,
+        "accept": "image/*",
+        "capture": "environment",
+    }))
+
+    def clean_photo(self):
+        photo = self.cleaned_data["photo"]
+        if photo.size > settings.FOUND_PHOTO_MAX_SIZE:
+            raise forms.ValidationError("The photo is too large (max 10 MB)")
+        return photo
@@ -0,0 +1,65 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.access import bulk_update_access
+from core.models import Doctor, Pet, User
+
+
+class Command(BaseCommand):
+    help = "Grant or revoke doctor access for a set of pets in one transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["grant", "revoke"])
+        parser.add_argument("--pet", dest="pets", action="append", default=[], help="Pet id (repeatable)")
+        parser.add_argument("--owner", dest="owners", action="append", default=[],
+                            help="Owner email; selects all of the owner's pets (repeatable)")
+        parser.add_argument("--doctor", dest="doctors", action="append", default=[],
+                            help="Doctor id or email (repeatable)")
+
+    def handle(self, *args, **options):
+        pet_ids = self._pet_ids(options["pets"], options["owners"])
+        doctor_ids = self._doctor_ids(options["doctors"])
+        if not pet_ids:
+            raise CommandError("No pets selected; use --pet or --owner.")
+        if not doctor_ids:
+            raise CommandError("No doctors selected; use --doctor.")
+
+        if options["action"] == "grant":
+            granted, _ = bulk_update_access(pet_ids, grant=doctor_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f"Granted {len(doctor_ids)} doctor(s) on {len(pet_ids)} pet(s) ({granted} pairs requested)."
+            ))
+        else:
+            _, revoked = bulk_update_access(pet_ids, revoke=doctor_ids)
+            self.stdout.write(self.style.SUCCESS(f"Revoked {revoked} access grant(s)."))
+
+    def _pet_ids(self, pets, owners):
+        try:
+            requested = [uuid.UUID(value) for value in pets]
+        except ValueError as e:
+            raise CommandError(f"Invalid pet id: {e}")
+        pet_ids = set(Pet.objects.filter(id__in=requested).values_list("id", flat=True))
+        missing = set(requested) - pet_ids
+        if missing:
+            raise CommandError(f"Unknown pet id(s): {', '.join(str(pk) for pk in missing)}")
+        if owners:
+            # email ถูกเก็บเป็นตัวพิมพ์เล็ก (User.save)
+            owners = {email.strip().lower() for email in owners}
+            missing = owners - set(User.objects.filter(email__in=owners).values_list("email", flat=True))
+            if missing:
+                raise CommandError(f"Unknown owner(s): {', '.join(sorted(missing))}")
+            pet_ids.update(Pet.objects.filter(owner__email__in=owners).values_list("id", flat=True))
+        return pet_ids
+
+    def _doctor_ids(self, doctors):
+        doctors = [value.strip() for value in doctors]
+        ids = {int(value) for value in doctors if value.isdigit()}
+        emails = {value.lower() for value in doctors if not value.isdigit()}
+        found = Doctor.objects.filter(id__in=ids) | Doctor.objects.filter(user__email__in=emails)
+        rows = list(found.values_list("id", "user__email"))
+        # หมอคนเดียวกันอาจถูกระบุทั้งด้วย id และ email: เทียบทีละตัวที่ขอ ไม่ใช่นับจำนวน
+        missing = (ids - {pk for pk, _ in rows}) | (emails - {email for _, email in rows})
+        if missing:
+            raise CommandError(f"Unknown doctor(s): {', '.join(sorted(map(str, missing)))}")
+        return {pk for pk, _ in rows}
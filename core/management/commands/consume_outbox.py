@@ -0,0 +1,61 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from core.outbox import drain, prune_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Pass change events from the outbox to a handler in batches, keeping the "
+        "consumer's checkpoint. Without --handler events are written to stdout as JSON lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("consumer", help="Checkpoint name; each consumer reads every event once")
+        parser.add_argument("--handler", help="Dotted path of a callable taking a list of ChangeEvent")
+        parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument("--follow", action="store_true", help="Keep polling for new events")
+        parser.add_argument("--poll-interval", type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Seconds between polls with --follow")
+        parser.add_argument("--prune", action="store_true",
+                            help="Delete events older than OUTBOX_RETENTION_DAYS first")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if options["handler"]:
+            try:
+                handler = import_string(options["handler"])
+            except ImportError as e:
+                raise CommandError(f"Cannot import handler {options['handler']!r}: {e}")
+        else:
+            handler = self.write_events
+
+        if options["prune"]:
+            pruned = prune_events(timedelta(days=settings.OUTBOX_RETENTION_DAYS))
+            self.stderr.write(f"Pruned {pruned} event(s).")
+
+        total = drain(options["consumer"], handler, options["batch_size"])
+        while options["follow"]:
+            time.sleep(options["poll_interval"])
+            total += drain(options["consumer"], handler, options["batch_size"])
+
+        # stdout อาจถูก pipe ไปให้โปรแกรมอื่น สรุปผลจึงเขียนลง stderr
+        self.stderr.write(self.style.SUCCESS(f"Consumed {total} event(s) as {options['consumer']!r}."))
+
+    def write_events(self, events):
+        for event in events:
+            self.stdout.write(json.dumps({
+                "id": event.id,
+                "txid": event.txid,
+                "created_at": event.created_at.isoformat(),
+                "topic": event.topic,
+                "key": event.key,
+                "payload": event.payload,
+            }))
+        self.stdout.flush()
@@ -0,0 +1,88 @@
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Pet
+from core.storage import asset_storage, avatar_storage
+
+
+def walk(storage, path=""):
+    dirs, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name) if path else name
+    for name in dirs:
+        yield from walk(storage, posixpath.join(path, name) if path else name)
+
+
+def copy_file(source, dest, name):
+    if not source.exists(name):
+        return "missing"
+    if dest.exists(name):
+        return "skipped"
+    with source.open(name) as content:
+        # avatar storage ตั้งชื่อตาม hash: ต้องเก็บชื่อเดิมไว้ เพราะ Pet.avatar อ้างถึงชื่อนี้
+        saved = getattr(dest, "save_as", dest.save)(name, content)
+    if saved != name:
+        raise RuntimeError(f"stored as {saved}")
+    return "copied"
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy existing media from MEDIA_ROOT into the configured avatar and asset storages, "
+        "e.g. after switching MEDIA_STORAGE to s3. Files already present are skipped, so it "
+        "is safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default=settings.MEDIA_ROOT,
+                            help="Media directory to copy from (default: MEDIA_ROOT)")
+        parser.add_argument("--workers", type=int, default=8, help="Number of files copied in parallel")
+        parser.add_argument("--dry-run", action="store_true", help="Only list what would be copied")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be >= 1")
+
+        avatar_source = FileSystemStorage(location=options["source"])
+        asset_source = FileSystemStorage(location=os.path.join(options["source"], "assets"))
+        avatar_dest, asset_dest = avatar_storage(), asset_storage()
+        for source, dest in ((avatar_source, avatar_dest), (asset_source, asset_dest)):
+            if isinstance(dest, FileSystemStorage) and os.path.abspath(dest.location) == os.path.abspath(source.location):
+                raise CommandError(f"{source.location} is already the configured storage; nothing to copy")
+
+        # avatar: คัดลอกเฉพาะไฟล์ที่ Pet ยังอ้างถึง (blob ที่ไม่มีใครใช้ gc_media_blobs จะลบอยู่แล้ว)
+        jobs = [
+            (avatar_source, avatar_dest, name)
+            for name in Pet.objects.exclude(avatar="").values_list("avatar", flat=True).distinct().iterator()
+        ]
+        if os.path.isdir(asset_source.location):
+            jobs += [(asset_source, asset_dest, name) for name in walk(asset_source)]
+
+        if options["dry_run"]:
+            for _, _, name in jobs:
+                self.stdout.write(name)
+            self.stdout.write(f"{len(jobs)} file(s) to check.")
+            return
+
+        counts = {"copied": 0, "skipped": 0, "missing": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = {pool.submit(copy_file, *job): job[2] for job in jobs}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = "failed"
+                    self.stderr.write(f"{name}: {e}")
+                if result == "missing":
+                    self.stderr.write(f"{name}: not found in {options['source']}")
+                counts[result] += 1
+
+        summary = ", ".join(f"{count} {result}" for result, count in counts.items())
+        style = self.style.ERROR if counts["failed"] else self.style.SUCCESS
+        self.stdout.write(style(f"Media copy finished: {summary}."))
@@ -0,0 +1,41 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import MediaBlob
+from core.storage import BLOB_PREFIX, avatar_storage, delete_blob_if_unreferenced
+
+
+class Command(BaseCommand):
+    help = "Delete content-addressed avatar blobs that are no longer referenced by any pet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace", type=int, default=settings.MEDIA_BLOB_GRACE_SECONDS,
+                            help="Only delete blobs not written for this many seconds")
+
+    def handle(self, *args, **options):
+        grace = timedelta(seconds=options["grace"])
+        cutoff = timezone.now() - grace
+
+        deleted = 0
+        orphans = MediaBlob.objects.filter(refcount=0, last_written_at__lt=cutoff).values_list("name", flat=True)
+        for name in orphans.iterator(chunk_size=500):
+            if delete_blob_if_unreferenced(name, grace):
+                deleted += 1
+
+        # ไฟล์ชั่วคราวที่ค้างจาก upload ที่ล้มเหลวกลางทาง (เฉพาะ storage บน filesystem)
+        storage = avatar_storage()
+        tmp_dir = storage.path(f"{BLOB_PREFIX}tmp") if isinstance(storage, FileSystemStorage) else None
+        stale = 0
+        if tmp_dir and os.path.isdir(tmp_dir):
+            for entry in os.scandir(tmp_dir):
+                if entry.is_file() and entry.stat().st_mtime < time.time() - grace.total_seconds():
+                    os.remove(entry.path)
+                    stale += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} unreferenced blob(s) and {stale} stale temp file(s)."))
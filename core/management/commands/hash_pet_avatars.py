@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Pet
+from core.phash import avatar_hashes, bump_lost_index_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute perceptual hashes of pet avatars that have none yet (e.g. avatars "
+        "uploaded before photo matching existed, or whose background hashing was lost "
+        "with a restarted worker). Use --all to recompute every hash."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute hashes of all avatars")
+
+    def handle(self, *args, **options):
+        pets = Pet.objects.exclude(avatar="").exclude(avatar__isnull=True)
+        if not options["all"]:
+            pets = pets.filter(avatar_phash__isnull=True)
+
+        hashed = failed = 0
+        for pet in pets.only("pk", "avatar").iterator():
+            try:
+                phash, dhash = avatar_hashes(pet.avatar)
+            except (OSError, ValueError) as e:
+                print(f"Error hashing avatar of pet {pet.pk}: {e}")
+                failed += 1
+                continue
+            Pet.objects.filter(pk=pet.pk).update(avatar_phash=phash, avatar_dhash=dhash)
+            hashed += 1
+
+        if hashed:
+            bump_lost_index_version()
+        self.stdout.write(self.style.SUCCESS(f"Hashed {hashed} avatar(s), {failed} failed."))
@@ -0,0 +1,45 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.partitions import PARTITIONED_TABLES, detach_partitions_before, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming partitions for the partitioned core tables and optionally "
+        "detach old ones for archival. Run daily (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--table", choices=sorted(PARTITIONED_TABLES), help="Only maintain this table")
+        parser.add_argument("--ahead", type=int, default=3,
+                            help="Number of future periods (months or years) to create (default: 3)")
+        parser.add_argument("--detach-before", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                            help="Detach partitions that end on or before this date (requires --table); "
+                                 "their rows no longer show in the app, e.g. the medical history page and PDF")
+
+    def handle(self, *args, **options):
+        if options["ahead"] < 0:
+            raise CommandError("--ahead must be >= 0")
+        if options["detach_before"] and not options["table"]:
+            raise CommandError("--detach-before requires --table")
+        specs = [PARTITIONED_TABLES[options["table"]]] if options["table"] else PARTITIONED_TABLES.values()
+        today = datetime.date.today()
+
+        for spec in specs:
+            end = spec.period_start(today)
+            for _ in range(options["ahead"]):
+                end = spec.next_start(end)
+            created = ensure_partitions(spec, today, end)
+            if created:
+                self.stdout.write(self.style.SUCCESS(f"{spec.table}: created {', '.join(created)}"))
+            else:
+                self.stdout.write(f"{spec.table}: up to date")
+
+            if options["detach_before"]:
+                detached = detach_partitions_before(spec, options["detach_before"])
+                if detached:
+                    self.stdout.write(self.style.WARNING(
+                        f"{spec.table}: detached {', '.join(detached)} (kept as standalone archive tables)"
+                    ))
@@ -0,0 +1,50 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import ChunkedUpload
+from core.uploads import part_path, process_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Process chunked avatar uploads left unprocessed by a restarted worker and "
+        "discard expired uploads. Run periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--expiry", type=int, default=settings.CHUNKED_UPLOAD_EXPIRY,
+                            help="Discard uploads not touched for this many seconds")
+
+    def handle(self, *args, **options):
+        processed = 0
+        pending = ChunkedUpload.objects.filter(status="PROCESSING").values_list("token", flat=True)
+        for token in list(pending):
+            if process_upload(token):
+                processed += 1
+
+        cutoff = timezone.now() - timedelta(seconds=options["expiry"])
+        expired = 0
+        for upload in ChunkedUpload.objects.filter(updated_at__lt=cutoff).exclude(status="PROCESSING"):
+            path = part_path(upload)
+            if os.path.exists(path):
+                os.remove(path)
+            upload.delete()
+            expired += 1
+
+        # ไฟล์ .part ที่ไม่มีแถวใน DB แล้ว (เช่น user ถูกลบ)
+        orphaned = 0
+        if os.path.isdir(settings.CHUNKED_UPLOAD_DIR):
+            for entry in os.scandir(settings.CHUNKED_UPLOAD_DIR):
+                if entry.is_file() and entry.stat().st_mtime < time.time() - options["expiry"]:
+                    os.remove(entry.path)
+                    orphaned += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} upload(s), discarded {expired} expired upload(s) "
+            f"and {orphaned} orphaned temp file(s)."
+        ))
@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# สิ่งที่ worker ต้อง import ก่อนรับ request แรก: settings, app ทั้งหมด, URLconf (รวม views)
+BOOT_SCRIPT = """
+import django, importlib
+django.setup()
+importlib.import_module({urlconf!r})
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+"""
+
+
+def parse_importtime(output):
+    """Parse ``-X importtime`` output into (module, self_us, cumulative_us) rows."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what a fresh worker imports at boot (python -X importtime) and list the "
+        "slowest modules, to find candidates for lazy imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=25, help="Number of modules to show (default: 25)")
+        parser.add_argument("--sort", choices=["self", "cumulative"], default="cumulative",
+                            help="Sort by time spent in the module itself or including its imports")
+        parser.add_argument("--prefix", help="Only show modules starting with this prefix (e.g. core)")
+
+    def handle(self, *args, **options):
+        script = BOOT_SCRIPT.format(urlconf=settings.ROOT_URLCONF)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Boot failed:\n{result.stderr[-2000:]}")
+
+        rows = parse_importtime(result.stderr)
+        total_us = sum(row[1] for row in rows)
+        if options["prefix"]:
+            rows = [row for row in rows if row[0] == options["prefix"] or row[0].startswith(options["prefix"] + ".")]
+        key = 1 if options["sort"] == "self" else 2
+        rows.sort(key=lambda row: row[key], reverse=True)
+
+        self.stdout.write(f"{'module':<50} {'self ms':>9} {'cumul. ms':>10}")
+        for name, self_us, cumulative_us in rows[:options["top"]]:
+            self.stdout.write(f"{name:<50} {self_us / 1000:9.1f} {cumulative_us / 1000:10.1f}")
+        self.stdout.write(self.style.SUCCESS(f"Total import time at boot: {total_us / 1000:.1f} ms"))
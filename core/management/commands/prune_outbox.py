@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.outbox import prune_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete outbox change events older than OUTBOX_RETENTION_DAYS, whether or not "
+        "every consumer has read them. Run daily (e.g. from run_scheduler)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.OUTBOX_RETENTION_DAYS,
+                            help="Keep events written within this many days")
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days must be >= 0")
+        pruned = prune_events(timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"Pruned {pruned} event(s)."))
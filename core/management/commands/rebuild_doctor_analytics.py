@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.analytics import rebuild_doctor_analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the doctor analytics rollups (visits per month, diagnoses, patients) "
+        "from the medical records. Only needed if records were changed without going "
+        "through MedicalRecord.save/delete."
+    )
+
+    def handle(self, *args, **options):
+        rows = rebuild_doctor_analytics()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rows['months']} month, {rows['diagnoses']} diagnosis and "
+            f"{rows['patients']} patient row(s)."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.facets import rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-species/breed/color pet counts (PetFacetCount) from the pet "
+        "table. Only needed if pets were changed without going through Pet.save/delete."
+    )
+
+    def handle(self, *args, **options):
+        rows = rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} facet count row(s)."))
@@ -0,0 +1,49 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cards import delete_snapshot, render_snapshot, stale_pets
+from core.models import Pet
+
+
+class Command(BaseCommand):
+    help = (
+        "Render static pet card snapshots that are missing or out of date and remove "
+        "snapshots of deleted pets. Run periodically (e.g. from cron) and after deploys."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Re-render every pet, e.g. after a template or CSS change")
+
+    def handle(self, *args, **options):
+        if not settings.PET_CARD_SNAPSHOTS:
+            raise CommandError("PET_CARD_SNAPSHOTS is disabled")
+
+        pets = Pet.objects.all() if options["all"] else stale_pets()
+        rendered = 0
+        for pet_id in pets.values_list("pk", flat=True).iterator():
+            try:
+                if render_snapshot(pet_id):
+                    rendered += 1
+            except Exception as e:
+                print(f"Error rendering pet card {pet_id}: {e}")
+
+        # snapshot ที่ไม่มี pet แล้ว (ลบตอน worker ไม่ได้ทำงาน) และ temp file ที่ค้างจาก render ที่ล้มเหลว
+        removed = 0
+        if os.path.isdir(settings.PET_CARD_SNAPSHOT_DIR):
+            slugs = set(Pet.objects.values_list("qr_slug", flat=True))
+            for entry in os.scandir(settings.PET_CARD_SNAPSHOT_DIR):
+                slug, ext = os.path.splitext(entry.name)
+                if ext == ".html" and slug not in slugs:
+                    delete_snapshot(slug)
+                    removed += 1
+                elif ext == ".tmp" and entry.stat().st_mtime < time.time() - 60 * 60:
+                    os.remove(entry.path)
+                    removed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} pet card(s), removed {removed} stale file(s)."
+        ))
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the periodic maintenance commands in SCHEDULED_COMMANDS, each at its own "
+        "interval, until stopped (the scheduler service in docker-compose.yml)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Run every scheduled command once and exit (e.g. from cron)")
+
+    def handle(self, *args, **options):
+        # ทุกคำสั่งรันทันทีตอนเริ่ม แล้วรอบถัดไปตาม interval ของแต่ละคำสั่ง
+        due = [0.0] * len(settings.SCHEDULED_COMMANDS)
+        while True:
+            for i, (name, arguments, interval) in enumerate(settings.SCHEDULED_COMMANDS):
+                if due[i] > time.monotonic():
+                    continue
+                due[i] = time.monotonic() + interval
+                self.run(name, arguments)
+            if options["once"]:
+                return
+            time.sleep(max(0, min(due) - time.monotonic()))
+
+    def run(self, name, arguments):
+        # connection ที่ค้างระหว่างรอ (เช่น DB restart) ปิดก่อน แล้วเปิดใหม่ตอน query แรก
+        close_old_connections()
+        started = time.monotonic()
+        try:
+            call_command(name, *arguments, stdout=self.stdout, stderr=self.stderr)
+        except Exception as e:
+            # คำสั่งเดียวล้มเหลวไม่หยุดคำสั่งอื่น: รอบหน้าลองใหม่ตาม interval
+            print(f"Error running scheduled command {name}: {e}")
+            return
+        self.stderr.write(f"{name} finished in {time.monotonic() - started:.1f}s.")
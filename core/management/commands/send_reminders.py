@@ -0,0 +1,31 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.reminders import send_due_reminders
+
+
+class Command(BaseCommand):
+    help = (
+        "Email owners a digest of their pets' upcoming follow-up visits. "
+        "Run periodically (e.g. hourly from cron); safe to run on several hosts at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.REMINDER_BATCH_SIZE,
+                            help="Records claimed (and locked) per transaction")
+        parser.add_argument("--date", help="Treat this day (YYYY-MM-DD) as today")
+
+    def handle(self, *args, **options):
+        today = None
+        if options["date"]:
+            try:
+                today = datetime.date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError(f"Invalid --date {options['date']!r}, expected YYYY-MM-DD")
+
+        emails, reminded = send_due_reminders(today=today, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {emails} reminder email(s) covering {reminded} follow-up(s)."
+        ))
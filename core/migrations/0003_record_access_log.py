@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# ตาราง partition ตามเดือนของ accessed_at; PK ต้องรวม partition key
+# (ใช้ bigserial แทน identity เพราะ Postgres 15 ไม่รองรับ identity บน partitioned table)
+CREATE_PARTITIONED_TABLE = """
+CREATE TABLE core_recordaccesslog (
+    id bigserial NOT NULL,
+    accessed_at timestamp with time zone NOT NULL,
+    record_id bigint NULL,
+    action varchar(10) NOT NULL,
+    pet_id uuid NOT NULL,
+    user_id bigint NULL,
+    PRIMARY KEY (id, accessed_at)
+) PARTITION BY RANGE (accessed_at);
+CREATE TABLE core_recordaccesslog_default PARTITION OF core_recordaccesslog DEFAULT;
+CREATE INDEX core_accesslog_pet_at_idx ON core_recordaccesslog (pet_id, accessed_at);
+CREATE INDEX core_accesslog_user_at_idx ON core_recordaccesslog (user_id, accessed_at);
+"""
+
+DROP_PARTITIONED_TABLE = "DROP TABLE core_recordaccesslog CASCADE;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_doctor_search'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='RecordAccessLog',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('accessed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                        ('record_id', models.BigIntegerField(null=True)),
+                        ('action', models.CharField(choices=[('VIEW', 'VIEW'), ('CREATE', 'CREATE'), ('UPDATE', 'UPDATE'), ('DELETE', 'DELETE')], max_length=10)),
+                        ('pet', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.pet')),
+                        ('user', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'indexes': [models.Index(fields=['pet', 'accessed_at'], name='core_accesslog_pet_at_idx'), models.Index(fields=['user', 'accessed_at'], name='core_accesslog_user_at_idx')],
+                    },
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(CREATE_PARTITIONED_TABLE, DROP_PARTITIONED_TABLE),
+            ],
+        ),
+    ]
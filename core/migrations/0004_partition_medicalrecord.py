@@ -0,0 +1,121 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# เปลี่ยน core_medicalrecord เป็นตาราง partition รายปีตาม date
+# PK ต้องรวม partition key และใช้ bigserial แทน identity (Postgres 15 ไม่รองรับ
+# identity บน partitioned table); ชื่อ index/constraint คงเดิมตามที่ Django สร้างไว้
+PARTITION_SQL = """
+ALTER TABLE core_medicalrecord RENAME TO core_medicalrecord_unpartitioned;
+ALTER INDEX core_medicalrecord_pkey RENAME TO core_medicalrecord_unpartitioned_pkey;
+ALTER SEQUENCE core_medicalrecord_id_seq RENAME TO core_medicalrecord_unpartitioned_id_seq;
+DROP INDEX core_medicalrecord_doctor_id_49cf86dd;
+DROP INDEX core_medicalrecord_pet_id_6ecaf81d;
+
+CREATE TABLE core_medicalrecord (
+    id bigserial NOT NULL,
+    diagnosis varchar(255) NOT NULL,
+    treatment text NOT NULL,
+    prescription text NULL,
+    notes text NULL,
+    date date NOT NULL,
+    doctor_id bigint NULL,
+    pet_id uuid NOT NULL,
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+CREATE TABLE core_medicalrecord_default PARTITION OF core_medicalrecord DEFAULT;
+CREATE INDEX core_medicalrecord_doctor_id_49cf86dd ON core_medicalrecord (doctor_id);
+CREATE INDEX core_medicalrecord_pet_id_6ecaf81d ON core_medicalrecord (pet_id);
+
+DO $$
+DECLARE y int;
+BEGIN
+    FOR y IN
+        SELECT DISTINCT extract(year FROM date)::int FROM core_medicalrecord_unpartitioned
+        UNION SELECT extract(year FROM current_date)::int
+        UNION SELECT extract(year FROM current_date)::int + 1
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF core_medicalrecord FOR VALUES FROM (%L) TO (%L)',
+            'core_medicalrecord_p' || y, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO core_medicalrecord (id, diagnosis, treatment, prescription, notes, date, doctor_id, pet_id)
+    SELECT id, diagnosis, treatment, prescription, notes, date, doctor_id, pet_id
+    FROM core_medicalrecord_unpartitioned;
+SELECT setval(
+    pg_get_serial_sequence('core_medicalrecord', 'id'),
+    COALESCE((SELECT max(id) FROM core_medicalrecord), 0) + 1,
+    false
+);
+-- เพิ่ม FK หลัง copy ข้อมูล เพื่อไม่ให้มี deferred trigger ค้างใน transaction ของ migration
+ALTER TABLE core_medicalrecord
+    ADD CONSTRAINT core_medicalrecord_doctor_id_49cf86dd_fk_core_doctor_id
+    FOREIGN KEY (doctor_id) REFERENCES core_doctor (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE core_medicalrecord
+    ADD CONSTRAINT core_medicalrecord_pet_id_6ecaf81d_fk_core_pet_id
+    FOREIGN KEY (pet_id) REFERENCES core_pet (id) DEFERRABLE INITIALLY DEFERRED;
+DROP TABLE core_medicalrecord_unpartitioned;
+"""
+
+# กลับเป็นตารางธรรมดา (partition ที่ถูก detach ไปแล้วจะไม่ถูกนำกลับมา)
+UNPARTITION_SQL = """
+ALTER TABLE core_medicalrecord RENAME TO core_medicalrecord_partitioned;
+ALTER INDEX core_medicalrecord_pkey RENAME TO core_medicalrecord_partitioned_pkey;
+ALTER SEQUENCE core_medicalrecord_id_seq RENAME TO core_medicalrecord_partitioned_id_seq;
+DROP INDEX core_medicalrecord_doctor_id_49cf86dd;
+DROP INDEX core_medicalrecord_pet_id_6ecaf81d;
+
+CREATE TABLE core_medicalrecord (
+    id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    diagnosis varchar(255) NOT NULL,
+    treatment text NOT NULL,
+    prescription text NULL,
+    notes text NULL,
+    date date NOT NULL,
+    doctor_id bigint NULL,
+    pet_id uuid NOT NULL
+);
+CREATE INDEX core_medicalrecord_doctor_id_49cf86dd ON core_medicalrecord (doctor_id);
+CREATE INDEX core_medicalrecord_pet_id_6ecaf81d ON core_medicalrecord (pet_id);
+
+INSERT INTO core_medicalrecord (id, diagnosis, treatment, prescription, notes, date, doctor_id, pet_id)
+    SELECT id, diagnosis, treatment, prescription, notes, date, doctor_id, pet_id
+    FROM core_medicalrecord_partitioned;
+SELECT setval(
+    pg_get_serial_sequence('core_medicalrecord', 'id'),
+    COALESCE((SELECT max(id) FROM core_medicalrecord), 0) + 1,
+    false
+);
+ALTER TABLE core_medicalrecord
+    ADD CONSTRAINT core_medicalrecord_doctor_id_49cf86dd_fk_core_doctor_id
+    FOREIGN KEY (doctor_id) REFERENCES core_doctor (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE core_medicalrecord
+    ADD CONSTRAINT core_medicalrecord_pet_id_6ecaf81d_fk_core_pet_id
+    FOREIGN KEY (pet_id) REFERENCES core_pet (id) DEFERRABLE INITIALLY DEFERRED;
+DROP TABLE core_medicalrecord_partitioned CASCADE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_record_access_log'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+        migrations.AlterField(
+            model_name='medicalrecord',
+            name='pet',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='medical_records', to='core.pet'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['pet', '-date'], name='core_medrec_pet_date_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:51
+
+import core.storage
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_partition_medicalrecord'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pet',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.avatar_storage, upload_to='pets/avatars/'),
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('last_written_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('refcount', 0)), fields=['last_written_at'], name='core_mediablob_orphan_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:01
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def lowercase_emails(apps, schema_editor):
+    # บัญชีที่ email ต่างกันแค่ตัวพิมพ์เล็ก/ใหญ่จะถูกข้ามไว้ ไม่อย่างนั้นจะชน unique constraint
+    schema_editor.execute(
+        """
+        UPDATE core_user u SET email = LOWER(u.email)
+        WHERE u.email <> LOWER(u.email)
+          AND NOT EXISTS (
+              SELECT 1 FROM core_user other
+              WHERE other.id <> u.id AND LOWER(other.email) = LOWER(u.email)
+          )
+        """
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0006_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='core_user_email_upper_idx'),
+        ),
+    ]
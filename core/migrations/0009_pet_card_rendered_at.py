@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_pet_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='card_rendered_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
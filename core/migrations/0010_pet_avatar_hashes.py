@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_pet_card_rendered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='avatar_dhash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='pet',
+            name='avatar_phash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:13
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# เหมือน core.models.normalize_facet: ตัดช่องว่างหัวท้าย ยุบช่องว่างซ้อน และเป็นตัวพิมพ์เล็ก
+NORMALIZE = "lower(btrim(regexp_replace(coalesce({0}, ''), '\\s+', ' ', 'g')))"
+
+BACKFILL_NORMALIZED = (
+    "UPDATE core_pet SET species_normalized = {}, breed_normalized = {}, color_normalized = {}".format(
+        NORMALIZE.format("species"), NORMALIZE.format("breed"), NORMALIZE.format("color")
+    )
+)
+
+BACKFILL_COUNTS = """
+    INSERT INTO core_petfacetcount (species, breed, color, count)
+    SELECT species_normalized, breed_normalized, color_normalized, count(*)
+    FROM core_pet
+    GROUP BY species_normalized, breed_normalized, color_normalized
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_pet_avatar_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PetFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('species', models.CharField(blank=True, default='', max_length=50)),
+                ('breed', models.CharField(blank=True, default='', max_length=100)),
+                ('color', models.CharField(blank=True, default='', max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pet',
+            name='breed_normalized',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='pet',
+            name='color_normalized',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='pet',
+            name='species_normalized',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        # เติมค่าก่อนสร้าง index จะได้ไม่ต้องอัปเดต index ทีละแถว
+        migrations.RunSQL(BACKFILL_NORMALIZED, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['species_normalized'], name='core_pet_species_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['breed_normalized'], name='core_pet_breed_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['color_normalized'], name='core_pet_color_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='core_pet_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('breed_normalized'), name='gin_trgm_ops'), name='core_pet_breed_norm_trgm'),
+        ),
+        migrations.AddConstraint(
+            model_name='petfacetcount',
+            constraint=models.UniqueConstraint(fields=('species', 'breed', 'color'), name='core_petfacetcount_unique'),
+        ),
+        migrations.RunSQL(BACKFILL_COUNTS, "DELETE FROM core_petfacetcount"),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_pet_facets'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctor',
+            name='user',
+            field=models.OneToOneField(limit_choices_to={'role': 'DOCTOR'}, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
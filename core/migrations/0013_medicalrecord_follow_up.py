@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_doctor_user_role_choices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='follow_up_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(condition=models.Q(('follow_up_on__isnull', False), ('reminder_sent_at__isnull', True)), fields=['follow_up_on', 'id'], name='core_medrec_follow_up_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_medicalrecord_follow_up'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recordaccesslog',
+            name='action',
+            field=models.CharField(choices=[('VIEW', 'VIEW'), ('CREATE', 'CREATE'), ('UPDATE', 'UPDATE'), ('DELETE', 'DELETE'), ('EXPORT', 'EXPORT')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# นับจาก medical record ที่มีอยู่ (เหมือน core.analytics.rebuild_doctor_analytics)
+BACKFILL_SQL = r"""
+    INSERT INTO core_doctorvisitmonth (doctor_id, month, visits)
+    SELECT doctor_id, date_trunc('month', date)::date, count(*)
+    FROM core_medicalrecord WHERE doctor_id IS NOT NULL
+    GROUP BY 1, 2;
+
+    INSERT INTO core_doctordiagnosiscount (doctor_id, diagnosis, visits)
+    SELECT doctor_id, lower(regexp_replace(btrim(diagnosis), '\s+', ' ', 'g')), count(*)
+    FROM core_medicalrecord WHERE doctor_id IS NOT NULL
+    GROUP BY 1, 2;
+
+    INSERT INTO core_doctorpatient (doctor_id, pet_id, species, is_lost, visits)
+    SELECT r.doctor_id, r.pet_id, p.species_normalized, p.is_lost, count(*)
+    FROM core_medicalrecord r JOIN core_pet p ON p.id = r.pet_id
+    WHERE r.doctor_id IS NOT NULL
+    GROUP BY r.doctor_id, r.pet_id, p.species_normalized, p.is_lost;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_record_access_export'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDiagnosisCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('diagnosis', models.CharField(max_length=255)),
+                ('visits', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', '-visits'], name='core_doctordiag_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'diagnosis'), name='core_doctordiagnosiscount_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DoctorPatient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('species', models.CharField(blank=True, default='', max_length=50)),
+                ('is_lost', models.BooleanField(default=False)),
+                ('visits', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.doctor')),
+                ('pet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.pet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'pet'), name='core_doctorpatient_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DoctorVisitMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('visits', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.doctor')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'month'), name='core_doctorvisitmonth_unique')],
+            },
+        ),
+        migrations.RunSQL(
+            BACKFILL_SQL,
+            "DELETE FROM core_doctorvisitmonth; DELETE FROM core_doctordiagnosiscount; DELETE FROM core_doctorpatient;",
+        ),
+    ]
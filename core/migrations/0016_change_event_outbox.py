@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_doctor_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxCheckpoint',
+            fields=[
+                ('consumer', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('txid', models.BigIntegerField(default=0)),
+                ('event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('txid', models.BigIntegerField(db_default=models.Func(output_field=models.BigIntegerField(), template='pg_current_xact_id()::text::bigint'), editable=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('topic', models.CharField(max_length=50)),
+                ('key', models.CharField(blank=True, default='', max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['txid', 'id'], name='core_changeevent_pos_idx')],
+            },
+        ),
+    ]
@@ -1,10 +1,16 @@
+import datetime
 import uuid
 
 from django.db import models
+from django.utils import timezone
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .storage import avatar_storage
+
 # Create your models here.
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -37,9 +43,25 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []
     objects = UserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # trigram index สำหรับค้นหาหมอ (icontains -> UPPER(col) LIKE UPPER(%s))
+            GinIndex(OpClass(Upper("first_name"), name="gin_trgm_ops"), name="core_user_first_name_trgm"),
+            GinIndex(OpClass(Upper("last_name"), name="gin_trgm_ops"), name="core_user_last_name_trgm"),
+            GinIndex(OpClass(Upper("email"), name="gin_trgm_ops"), name="core_user_email_trgm"),
+            # login ใช้ email__iexact -> UPPER(email) = UPPER(%s)
+            models.Index(Upper("email"), name="core_user_email_upper_idx"),
+        ]
+
     def __str__(self):
         return f"{self.email} ({self.role})"
 
+    def save(self, *args, **kwargs):
+        # เก็บ email เป็นตัวพิมพ์เล็กเสมอ
+        if self.email:
+            self.email = self.email.strip().lower()
+        super().save(*args, **kwargs)
+
 class Pet(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="pets")
@@ -48,24 +70,291 @@ class Pet(models.Model):
     breed = models.CharField(max_length=100, blank=True, null=True)
     color = models.CharField(max_length=50, blank=True, null=True)
     birth_date = models.DateField(blank=True, null=True)
-    avatar = models.ImageField(upload_to="pets/avatars/", blank=True, null=True)
+    avatar = models.ImageField(upload_to="pets/avatars/", storage=avatar_storage, blank=True, null=True)
     qr_slug = models.CharField(max_length=128, unique=True) # สำหรับเก็บข้อมูล QR code
     is_lost = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # เปลี่ยนทุกครั้งที่ save; ใช้เป็น version ของ fragment cache บน dashboard
+    updated_at = models.DateTimeField(auto_now=True)
+    # เวลาที่ render snapshot ของ pet_card ล่าสุด (core.cards)
+    card_rendered_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # perceptual hash ของ avatar (core.phash) ใช้จับคู่รูปสัตว์ที่มีคนพบกับสัตว์ที่หาย
+    avatar_phash = models.BigIntegerField(null=True, blank=True, editable=False)
+    avatar_dhash = models.BigIntegerField(null=True, blank=True, editable=False)
+    # species/breed/color แบบ normalize สำหรับค้นหาและ facet (core.facets) ตั้งค่าใน save()
+    species_normalized = models.CharField(max_length=50, blank=True, default="", editable=False)
+    breed_normalized = models.CharField(max_length=100, blank=True, default="", editable=False)
+    color_normalized = models.CharField(max_length=50, blank=True, default="", editable=False)
+
+    FACET_FIELDS = ("species", "breed", "color")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["species_normalized"], name="core_pet_species_norm_idx"),
+            models.Index(fields=["breed_normalized"], name="core_pet_breed_norm_idx"),
+            models.Index(fields=["color_normalized"], name="core_pet_color_norm_idx"),
+            # ค้นหาด้วย q (icontains -> UPPER(col) LIKE UPPER(%s))
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="core_pet_name_trgm"),
+            GinIndex(OpClass(Upper("breed_normalized"), name="gin_trgm_ops"), name="core_pet_breed_norm_trgm"),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.species})"
 
+    def save(self, *args, **kwargs):
+        for field in self.FACET_FIELDS:
+            setattr(self, f"{field}_normalized", normalize_facet(getattr(self, field)))
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {
+                *update_fields,
+                *(f"{field}_normalized" for field in self.FACET_FIELDS if field in update_fields),
+            }
+        super().save(*args, **kwargs)
+
+def normalize_facet(value):
+    """Lowercase, trimmed, single-spaced form of a facet value ("" for None)."""
+    return " ".join((value or "").split()).lower()
+
+class PetFacetCount(models.Model):
+    """Number of pets per normalized (species, breed, color); maintained by core.signals."""
+    species = models.CharField(max_length=50, blank=True, default="")
+    breed = models.CharField(max_length=100, blank=True, default="")
+    color = models.CharField(max_length=50, blank=True, default="")
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["species", "breed", "color"], name="core_petfacetcount_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.species}/{self.breed}/{self.color}: {self.count}"
+
+class MediaBlob(models.Model):
+    """Reference count for a content-addressed file in core.storage.ContentHashStorage."""
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+    last_written_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["last_written_at"], condition=models.Q(refcount=0), name="core_mediablob_orphan_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+class DoctorQuerySet(models.QuerySet):
+    def search(self, query):
+        """Doctors matching every word of ``query`` by name, email or clinic."""
+        doctors = self
+        # ค้นหา user ใน subquery แยก เพื่อให้ Postgres ใช้ trigram index ของ UPPER(field) ได้ (BitmapOr)
+        # และรวมกับ clinic ด้วย UNION: ถ้าใช้ OR กับ subquery Postgres จะ seq scan ตาราง doctor แทน
+        for term in query.split()[:3]:
+            matching_users = User.objects.filter(
+                models.Q(first_name__icontains=term)
+                | models.Q(last_name__icontains=term)
+                | models.Q(email__icontains=term)
+            ).values("id")
+            ids = Doctor.objects.filter(user__in=matching_users).values("id").union(
+                Doctor.objects.filter(clinic__icontains=term).values("id")
+            )
+            doctors = doctors.filter(id__in=ids)
+        return doctors
+
 class Doctor(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, limit_choices_to={"role": "doctor"})
+    user = models.OneToOneField(User, on_delete=models.CASCADE, limit_choices_to={"role": "DOCTOR"})
     pets = models.ManyToManyField(Pet, related_name="doctors", blank=True)
+    clinic = models.CharField(max_length=150, blank=True, default="")
+
+    objects = DoctorQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper("clinic"), name="gin_trgm_ops"), name="core_doctor_clinic_trgm"),
+        ]
+
     def __str__(self):
-        return f"Dr. {self.doctor.first_name} {self.doctor.last_name}"
+        return f"Dr. {self.user.first_name} {self.user.last_name}"
+
+class MedicalRecordQuerySet(models.QuerySet):
+    def recent(self, days=365):
+        """Records from the last ``days`` days; lets Postgres prune to the hot yearly partitions."""
+        return self.filter(date__gte=timezone.localdate() - datetime.timedelta(days=days))
+
+    def older(self, days=365):
+        """Records before ``recent(days)``: the archive, usually in the cold partitions."""
+        return self.filter(date__lt=timezone.localdate() - datetime.timedelta(days=days))
 
 class MedicalRecord(models.Model):
-    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name="medical_records")
+    """A visit. The table is partitioned by year on ``date`` (migration 0004, core.partitions)."""
+    # index ของ pet อยู่ใน (pet, -date) ด้านล่างแทน index เดี่ยวของ FK
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name="medical_records", db_index=False)
     doctor = models.ForeignKey(Doctor, on_delete=models.SET_NULL, null=True)
     diagnosis = models.CharField(max_length=255)  # การวินิจฉัยโรค
     treatment = models.TextField()  # วิธีการรักษา
     prescription = models.TextField(blank=True, null=True)  # ยาที่สั่ง
     notes = models.TextField(blank=True, null=True)  # บันทึกเพิ่มเติม   
     date = models.DateField(auto_now_add=True)
+    # นัดติดตามอาการ/ฉีดวัคซีนครั้งถัดไป; send_reminders ส่ง email เตือนเจ้าของ (core.reminders)
+    follow_up_on = models.DateField(blank=True, null=True)
+    reminder_sent_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = MedicalRecordQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["pet", "-date"], name="core_medrec_pet_date_idx"),
+            # เฉพาะแถวที่ยังรอเตือน: index เล็ก และ scan ตามช่วงวันที่ได้ตรง ๆ
+            models.Index(
+                fields=["follow_up_on", "id"],
+                name="core_medrec_follow_up_idx",
+                condition=models.Q(follow_up_on__isnull=False, reminder_sent_at__isnull=True),
+            ),
+        ]
+
+class DoctorVisitMonth(models.Model):
+    """Medical records per doctor and calendar month; maintained by core.signals (core.analytics)."""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="+")
+    month = models.DateField()  # วันที่ 1 ของเดือน
+    visits = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "month"], name="core_doctorvisitmonth_unique"),
+        ]
+
+class DoctorDiagnosisCount(models.Model):
+    """Medical records per doctor and normalized diagnosis; maintained by core.signals (core.analytics)."""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="+")
+    diagnosis = models.CharField(max_length=255)
+    visits = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "diagnosis"], name="core_doctordiagnosiscount_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["doctor", "-visits"], name="core_doctordiag_top_idx"),
+        ]
+
+class DoctorPatient(models.Model):
+    """Pets a doctor has written records for, with the pet's species and lost flag copied in.
+
+    Maintained by core.signals (core.analytics); a row is removed when its last
+    record is deleted.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="+")
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name="+")
+    species = models.CharField(max_length=50, blank=True, default="")
+    is_lost = models.BooleanField(default=False)
+    visits = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "pet"], name="core_doctorpatient_unique"),
+        ]
+
+class AppendOnlyQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError(f"{self.model.__name__} is append-only")
+
+    def delete(self):
+        raise TypeError(f"{self.model.__name__} is append-only")
+
+class RecordAccessLog(models.Model):
+    """Append-only audit trail of medical record access.
+
+    The table is partitioned by month on ``accessed_at`` (see migration 0003
+    and core.partitions); rows are written in batches by core.audit.
+    """
+    ACTION_CHOICES = (
+        ("VIEW", "VIEW"),
+        ("CREATE", "CREATE"),
+        ("UPDATE", "UPDATE"),
+        ("DELETE", "DELETE"),
+        ("EXPORT", "EXPORT"),
+    )
+    id = models.BigAutoField(primary_key=True)
+    accessed_at = models.DateTimeField(default=timezone.now)
+    # ไม่ใช้ FK constraint เพื่อให้ audit ยังอยู่แม้ user/pet/record ถูกลบ
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name="+")
+    pet = models.ForeignKey(Pet, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    record_id = models.BigIntegerField(null=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+
+    objects = AppendOnlyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["pet", "accessed_at"], name="core_accesslog_pet_at_idx"),
+            models.Index(fields=["user", "accessed_at"], name="core_accesslog_user_at_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("RecordAccessLog is append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("RecordAccessLog is append-only")
+
+class ChunkedUpload(models.Model):
+    """A resumable avatar upload assembled from chunks (see core.uploads)."""
+    STATUS_CHOICES = (
+        ("UPLOADING", "UPLOADING"),
+        ("PROCESSING", "PROCESSING"),
+        ("READY", "READY"),
+        ("FAILED", "FAILED"),
+    )
+    token = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chunked_uploads")
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="UPLOADING")
+    # ชื่อ blob ของ avatar ที่ประมวลผลเสร็จแล้ว (core.storage)
+    result = models.CharField(max_length=255, blank=True, default="")
+    error = models.CharField(max_length=255, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
+
+class ChangeEvent(models.Model):
+    """A domain change written in the same transaction as the change itself (see core.outbox).
+
+    ``id`` is the event's sequence number. ``txid`` is the writing
+    transaction's id, filled in by Postgres; consumers only read events of
+    transactions older than every one still running, so a checkpoint never
+    passes an event that commits later.
+    """
+    id = models.BigAutoField(primary_key=True)
+    txid = models.BigIntegerField(
+        db_default=models.Func(template="pg_current_xact_id()::text::bigint", output_field=models.BigIntegerField()),
+        editable=False,
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    topic = models.CharField(max_length=50)
+    key = models.CharField(max_length=64, blank=True, default="")  # เช่น id ของ pet
+    payload = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["txid", "id"], name="core_changeevent_pos_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.topic} {self.key}"
+
+class OutboxCheckpoint(models.Model):
+    """How far a named outbox consumer has read: the (txid, id) of its last event."""
+    consumer = models.CharField(max_length=100, primary_key=True)
+    txid = models.BigIntegerField(default=0)
+    event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.consumer} @ {self.txid}/{self.event_id}"
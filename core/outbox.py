@@ -0,0 +1,95 @@
+"""
+Transactional outbox of domain change events.
+
+Write paths record what changed as ``ChangeEvent`` rows in the same
+transaction as the change (core.signals and ``bulk_update_access``), so an
+event exists if and only if its change committed. Consumers such as caches,
+search indexes and notifications tail the table in batches
+(``consume_outbox``) instead of adding work to the request.
+
+Event ids come from a sequence and are handed out before commit, so a
+later id can become visible before an earlier one. Consumers therefore read
+only events of transactions older than the oldest one still running
+(``pg_snapshot_xmin``) and keep their position as ``(txid, id)``: no event
+can appear behind a saved checkpoint.
+
+Delivery is at least once: the checkpoint is saved in the same transaction
+as the batch was read, after the handler returns, and a failing handler
+leaves it where it was. Events of different transactions are delivered in
+``txid`` order, which is not always commit order, so consumers that need the
+current state should re-read it rather than trust the payload.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChangeEvent, OutboxCheckpoint
+
+PET_LOST_CHANGED = "pet.lost_changed"
+PET_AVATAR_CHANGED = "pet.avatar_changed"
+RECORD_CREATED = "medical_record.created"
+RECORD_UPDATED = "medical_record.updated"
+RECORD_DELETED = "medical_record.deleted"
+ACCESS_GRANTED = "access.granted"
+ACCESS_REVOKED = "access.revoked"
+
+# (txid, id) ถัดจาก checkpoint และเฉพาะ transaction ที่เก่ากว่าทุกตัวที่ยังไม่จบ
+READ_SQL = """
+    SELECT * FROM core_changeevent
+    WHERE (txid, id) > (%s, %s)
+      AND txid < pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+    ORDER BY txid, id
+    LIMIT %s
+"""
+
+
+def emit(topic, key="", payload=None):
+    """Record a change event; call inside the transaction that makes the change."""
+    return ChangeEvent.objects.create(topic=topic, key=str(key), payload=payload or {})
+
+
+def emit_access_change(topic, pet_ids, doctor_ids):
+    """One ``access.granted``/``access.revoked`` event per pet, listing the doctors."""
+    doctor_ids = sorted(doctor_ids)
+    ChangeEvent.objects.bulk_create([
+        ChangeEvent(topic=topic, key=str(pet_id), payload={"pet_id": str(pet_id), "doctor_ids": doctor_ids})
+        for pet_id in sorted(pet_ids, key=str)
+    ], batch_size=1000)
+
+
+def read_events(after=(0, 0), limit=500):
+    """Committed events after position ``after`` (a ``(txid, id)`` pair), oldest first."""
+    txid, event_id = after
+    return list(ChangeEvent.objects.raw(READ_SQL, [txid, event_id, limit]))
+
+
+def consume_batch(consumer, handler, batch_size=500):
+    """Pass the next batch of ``consumer``'s events to ``handler`` and move its checkpoint.
+
+    Consumers with the same name wait for each other on the checkpoint row.
+    Returns the number of events handled.
+    """
+    with transaction.atomic():
+        checkpoint, _ = OutboxCheckpoint.objects.select_for_update().get_or_create(consumer=consumer)
+        events = read_events((checkpoint.txid, checkpoint.event_id), batch_size)
+        if not events:
+            return 0
+        handler(events)
+        checkpoint.txid, checkpoint.event_id = events[-1].txid, events[-1].id
+        checkpoint.save(update_fields=["txid", "event_id", "updated_at"])
+    return len(events)
+
+
+def drain(consumer, handler, batch_size=500):
+    """Consume batches until ``consumer`` has caught up; returns the number of events."""
+    total = 0
+    while True:
+        handled = consume_batch(consumer, handler, batch_size)
+        total += handled
+        if handled < batch_size:
+            return total
+
+
+def prune_events(older_than):
+    """Delete events created before ``older_than`` (a timedelta); returns the number deleted."""
+    deleted, _ = ChangeEvent.objects.filter(created_at__lt=timezone.now() - older_than).delete()
+    return deleted
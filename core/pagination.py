@@ -0,0 +1,47 @@
+"""
+Paginators for tables too large to COUNT(*) on every page view.
+
+``EstimatedCountPaginator`` asks Postgres for its planner estimate of the
+table's row count (``pg_class.reltuples``, summed over the partitions of a
+partitioned table). It uses that estimate when the queryset is unfiltered and
+the table is larger than ``ADMIN_ESTIMATED_COUNT_THRESHOLD``. Filtered
+querysets, and tables never analyzed, are counted exactly. The estimate is
+refreshed by autovacuum/ANALYZE, so page numbers near the end may be off.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+ESTIMATE_SQL = """
+    SELECT COALESCE(
+        (SELECT sum(c.reltuples) FROM pg_partition_tree(%s::regclass) t
+         JOIN pg_class c ON c.oid = t.relid
+         WHERE t.isleaf AND c.reltuples >= 0),
+        (SELECT reltuples FROM pg_class WHERE oid = %s::regclass)
+    )
+"""
+
+
+def estimated_row_count(model, using="default"):
+    """Planner estimate of ``model``'s row count, or None if unknown."""
+    table = connections[using].ops.quote_name(model._meta.db_table)
+    with connections[using].cursor() as cursor:
+        cursor.execute(ESTIMATE_SQL, [table, table])
+        row = cursor.fetchone()
+    # -1: ยังไม่เคย ANALYZE
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, "query", None)
+        if query is not None and not query.has_filters() and not query.distinct:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
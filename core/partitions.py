@@ -0,0 +1,155 @@
+"""
+Maintenance helpers for Postgres declaratively partitioned tables.
+
+Each table in ``PARTITIONED_TABLES`` is partitioned by RANGE on a single
+date/timestamp column, with one partition per month or per year named
+``<table>_pYYYY_MM`` / ``<table>_pYYYY`` and a ``<table>_default`` partition
+that catches rows outside the created ranges. Partitions are created ahead of
+time, and old ones detached for archival, by the ``manage_partitions``
+management command.
+"""
+import datetime
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+
+
+@dataclass(frozen=True)
+class PartitionSpec:
+    table: str
+    column: str
+    interval: str  # "month" or "year"
+
+    @property
+    def default_partition(self):
+        return f"{self.table}_default"
+
+    def period_start(self, day):
+        if self.interval == "year":
+            return datetime.date(day.year, 1, 1)
+        return datetime.date(day.year, day.month, 1)
+
+    def next_start(self, start):
+        if self.interval == "year":
+            return datetime.date(start.year + 1, 1, 1)
+        if start.month == 12:
+            return datetime.date(start.year + 1, 1, 1)
+        return datetime.date(start.year, start.month + 1, 1)
+
+    def partition_name(self, start):
+        if self.interval == "year":
+            return f"{self.table}_p{start.year}"
+        return f"{self.table}_p{start.year}_{start.month:02d}"
+
+    def partition_start(self, name):
+        """Inverse of ``partition_name``; None for the default or foreign partitions."""
+        suffix = name[len(self.table) + 2:] if name.startswith(f"{self.table}_p") else ""
+        try:
+            if self.interval == "year":
+                return datetime.date(int(suffix), 1, 1)
+            year, month = suffix.split("_")
+            return datetime.date(int(year), int(month), 1)
+        except ValueError:
+            return None
+
+
+PARTITIONED_TABLES = {
+    "core_recordaccesslog": PartitionSpec("core_recordaccesslog", "accessed_at", "month"),
+    "core_medicalrecord": PartitionSpec("core_medicalrecord", "date", "year"),
+}
+
+
+def existing_partitions(spec):
+    """Names of the partitions currently attached to ``spec.table``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [spec.table],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def ensure_partitions(spec, start, end):
+    """Create missing partitions covering ``start`` up to and including ``end``.
+
+    Returns the names of the partitions created.
+    """
+    existing = existing_partitions(spec)
+    created = []
+    period = spec.period_start(start)
+    while period <= end:
+        name = spec.partition_name(period)
+        if name not in existing:
+            _create_partition(spec, name, period, spec.next_start(period))
+            created.append(name)
+        period = spec.next_start(period)
+    return created
+
+
+def _create_partition(spec, name, lower, upper):
+    qn = connection.ops.quote_name
+    table, column, default = qn(spec.table), qn(spec.column), qn(spec.default_partition)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {column} >= %s AND {column} < %s)",
+            [lower, upper],
+        )
+        has_stray_rows = cursor.fetchone()[0]
+        if not has_stray_rows:
+            cursor.execute(
+                f"CREATE TABLE {qn(name)} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                [lower.isoformat(), upper.isoformat()],
+            )
+            return
+
+        # มีแถวในช่วงนี้ตกอยู่ใน default partition แล้ว: ต้องย้ายออกก่อน
+        # ไม่อย่างนั้น Postgres จะไม่ยอมสร้าง partition ที่ทับกัน
+        # FK ของตารางเป็น DEFERRABLE; ตรวจทันทีเพื่อไม่ให้มี trigger ค้างตอน ATTACH
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+        cursor.execute(
+            f"CREATE TABLE {qn(name)} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+            [lower.isoformat(), upper.isoformat()],
+        )
+        cursor.execute(
+            f"INSERT INTO {table} SELECT * FROM {default} WHERE {column} >= %s AND {column} < %s",
+            [lower, upper],
+        )
+        cursor.execute(f"DELETE FROM {default} WHERE {column} >= %s AND {column} < %s", [lower, upper])
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+
+
+def detach_partitions_before(spec, cutoff):
+    """Detach every partition whose range ends on or before ``cutoff``.
+
+    Detached partitions stay in the database as ordinary archive tables (same
+    name) but are no longer scanned, vacuumed or indexed as part of
+    ``spec.table``. Their foreign keys are dropped, so pets, owners and doctors
+    can still be deleted; archived rows keep the ids they had. Returns the
+    names of the partitions detached.
+    """
+    qn = connection.ops.quote_name
+    detached = []
+    for name in sorted(existing_partitions(spec)):
+        start = spec.partition_start(name)
+        if start is None or spec.next_start(start) > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            # DROP CONSTRAINT แก้ตารางปลายทางด้วย: ตรวจ FK ที่ค้าง (DEFERRABLE) ให้จบก่อน
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"ALTER TABLE {qn(spec.table)} DETACH PARTITION {qn(name)}")
+            # FK ที่สืบทอดมาจะติดไปกับตาราง archive และทำให้ลบ pet/doctor ไม่ได้
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                [name],
+            )
+            for (constraint,) in cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {qn(name)} DROP CONSTRAINT {qn(constraint)}")
+        detached.append(name)
+    return detached
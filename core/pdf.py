@@ -0,0 +1,511 @@
+"""
+Streaming PDF export of a pet's medical history.
+
+``medical_history_pdf`` yields the document a chunk at a time: pages are laid
+out and written while records are read from a server-side cursor
+(``QuerySet.iterator``), so memory stays flat for pets with thousands of
+visits. The page tree that lists the pages is written last, followed by the
+cross-reference table; readers find objects through the xref offsets, so the
+order of objects in the file does not matter.
+
+The writer is deliberately minimal and needs no PDF library. Text is set in
+the TrueType fonts ``PDF_FONT``/``PDF_BOLD_FONT`` (Thai and Latin), embedded
+as CID fonts subset to the glyphs the document uses (fontTools); they are
+written after the last page, once those glyphs are known. Without the font
+files the built-in Helvetica is used, which prints anything outside WinAnsi
+(Thai included) as "?". The avatar is a JPEG thumbnail and the pet's QR code
+an image.
+
+Finished documents are cached in asset storage under
+``exports/history/<pet id>/``, named after a per-pet version stamp in the
+shared cache (as in core.backends) and the pet's ``updated_at``. core.signals
+bumps the stamp after any medical record of the pet is saved or deleted.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import unicodedata
+import uuid
+import zlib
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.utils import timezone
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 (points)
+MARGIN = 50
+IMAGE_SIZE = 96  # กรอบของ avatar และ QR บนหน้าแรก (points)
+RECORD_CHUNK_SIZE = 200
+SPOOL_SIZE = 1024 * 1024  # PDF ที่ใหญ่กว่านี้ถูกพักลงดิสก์ระหว่างเขียนลง storage
+
+EXPORT_PREFIX = "exports/history"
+
+# ความกว้างตัวอักษร Helvetica (ต่อ 1000 หน่วยของขนาดฟอนต์) ตาม AFM ของ Adobe สำหรับ ASCII 32-126
+_WIDTHS = dict(zip(
+    " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`abcdefghijklmnopqrstuvwxyz{|}~",
+    [
+        278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+        556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+        1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+        667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+        333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+        556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+    ],
+))
+
+
+def _version_key(pet_id):
+    return f"pdf:history:{pet_id}:version"
+
+
+def bump_history_version(pet_id):
+    version = uuid.uuid4().hex[:12]
+    cache.set(_version_key(pet_id), version, None)
+    return version
+
+
+def history_pdf_name(pet):
+    """Storage name of the current export of ``pet``'s medical history."""
+    version = cache.get(_version_key(pet.pk)) or bump_history_version(pet.pk)
+    return f"{EXPORT_PREFIX}/{pet.pk}/{version}-{int(pet.updated_at.timestamp())}.pdf"
+
+
+def delete_history_exports(storage, pet_id, keep=None):
+    directory = f"{EXPORT_PREFIX}/{pet_id}"
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        name = posixpath.join(directory, filename)
+        if name != keep:
+            storage.delete(name)
+
+
+def save_while_streaming(chunks, storage, name):
+    """Pass ``chunks`` through and store the complete file as ``name`` at the end.
+
+    Nothing is stored if the client disconnects before the last chunk. Older
+    exports of the same pet are deleted once the new one is saved.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+        for chunk in chunks:
+            spool.write(chunk)
+            yield chunk
+        spool.seek(0)
+        try:
+            saved = storage.save(name, File(spool, name=name))
+            delete_history_exports(storage, posixpath.basename(posixpath.dirname(name)), keep=saved)
+        except Exception as e:
+            print(f"Error caching PDF export {name}: {e}")
+
+
+class TrueTypeFont:
+    """Metrics and glyph ids of a TrueType font, and subsets of it for embedding."""
+
+    def __init__(self, path):
+        from fontTools.ttLib import TTFont
+
+        with open(path, "rb") as f:
+            self.data = f.read()
+        font = TTFont(BytesIO(self.data), lazy=True)
+        if "glyf" not in font:
+            raise ValueError(f"{path} has no TrueType outlines")
+        scale = 1000 / font["head"].unitsPerEm
+        self.glyph_ids = {code: font.getGlyphID(name) for code, name in font.getBestCmap().items()}
+        self.widths = [round(font["hmtx"][name][0] * scale) for name in font.getGlyphOrder()]
+        head, hhea = font["head"], font["hhea"]
+        self.bbox = [round(v * scale) for v in (head.xMin, head.yMin, head.xMax, head.yMax)]
+        self.ascent, self.descent = round(hhea.ascent * scale), round(hhea.descent * scale)
+        cap_height = getattr(font["OS/2"], "sCapHeight", 0) if "OS/2" in font else 0
+        self.cap_height = round(cap_height * scale) or self.ascent
+        name = font["name"].getDebugName(6) or os.path.splitext(os.path.basename(path))[0]
+        self.name = re.sub(r"[^A-Za-z0-9-]", "", name) or "Font"
+        # ตัวอักษรที่ฟอนต์ไม่มีพิมพ์เป็น "?" เหมือน Helvetica
+        self.missing = self.glyph_ids.get(ord("?"), 0)
+
+    def glyph(self, char):
+        return self.glyph_ids.get(ord(char), self.missing)
+
+    def width(self, text):
+        return sum(self.widths[self.glyph(c)] for c in text)
+
+    def subset(self, glyph_ids):
+        """The font reduced to ``glyph_ids``; glyph ids stay the same (Identity CIDToGIDMap)."""
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+
+        options = subset.Options()
+        options.retain_gids = True
+        options.hinting = False
+        options.notdef_outline = True
+        options.layout_features = []
+        # FFTM (timestamp ของ FontForge เช่นในฟอนต์ TLWG) ไม่จำเป็นและ subset ไม่ได้
+        options.drop_tables += ["FFTM"]
+        font = TTFont(BytesIO(self.data))
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(gids=sorted(glyph_ids | {0}))
+        subsetter.subset(font)
+        out = BytesIO()
+        font.save(out)
+        return out.getvalue()
+
+
+@lru_cache(maxsize=None)
+def _load_font(path):
+    try:
+        return TrueTypeFont(path)
+    except Exception as e:
+        print(f"PDF font {path} unavailable, using Helvetica: {e}")
+        return None
+
+
+def _fonts():
+    """(regular, bold) TrueTypeFont, or None to use the built-in Helvetica."""
+    regular, bold = _load_font(settings.PDF_FONT), _load_font(settings.PDF_BOLD_FONT)
+    if regular is None or bold is None:
+        return None
+    return regular, bold
+
+
+def _latin(text):
+    # Helvetica ในตัวของ PDF รองรับแค่ WinAnsi: ตัวอักษรอื่นกลายเป็น "?"
+    return str(text).encode("cp1252", "replace").decode("cp1252")
+
+
+def _pdf_string(text, bold=False):
+    fonts = _fonts()
+    if fonts is not None:
+        font = fonts[bold]
+        return b"<" + "".join(f"{font.glyph(c):04X}" for c in text).encode() + b">"
+    data = text.encode("cp1252", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def text_width(text, size, bold=False):
+    fonts = _fonts()
+    if fonts is not None:
+        return fonts[bold].width(text) * size / 1000
+    width = sum(_WIDTHS.get(c, 556) for c in text) * size / 1000
+    # Helvetica-Bold กว้างกว่าตัวปกติไม่เกินราว 10%
+    return width * 1.1 if bold else width
+
+
+def wrap(text, size, width, bold=False):
+    """Split ``text`` into lines no wider than ``width`` points."""
+    lines = []
+    if _fonts() is None:
+        text = _latin(text)
+    for paragraph in str(text).splitlines() or [""]:
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if text_width(candidate, size, bold) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # คำที่ยาวกว่าบรรทัด (เช่น URL หรือประโยคภาษาไทยที่ไม่เว้นวรรค) ตัดเป็นท่อน
+            # ไม่ตัดหน้าสระบน/ล่างหรือวรรณยุกต์ (Mn) ให้แยกจากพยัญชนะ
+            while text_width(word, size, bold) > width:
+                cut = len(word) - 1
+                while cut > 1 and (text_width(word[:cut], size, bold) > width
+                                   or unicodedata.category(word[cut]) == "Mn"):
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+class _Image:
+    def __init__(self, width, height, color_space, filter_name, data):
+        self.width, self.height = width, height
+        self.color_space, self.filter_name, self.data = color_space, filter_name, data
+
+    def dictionary(self):
+        return b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s " \
+               b"/BitsPerComponent 8 /Filter %s /Length %d >>" % (
+                   self.width, self.height, self.color_space, self.filter_name, len(self.data))
+
+    def fit(self, box):
+        scale = box / max(self.width, self.height)
+        return self.width * scale, self.height * scale
+
+
+def avatar_image(pet):
+    """JPEG thumbnail of the pet's avatar, or None."""
+    from PIL import Image, ImageOps
+
+    if not pet.avatar:
+        return None
+    pixels = IMAGE_SIZE * 2  # 2x เพื่อให้คมบนจอ retina และตอนพิมพ์
+    try:
+        with pet.avatar.open("rb") as f, Image.open(f) as image:
+            image.draft("RGB", (pixels, pixels))
+            thumbnail = ImageOps.exif_transpose(image).convert("RGB")
+    except (OSError, ValueError) as e:
+        print(f"Error reading avatar of pet {pet.pk} for PDF: {e}")
+        return None
+    thumbnail.thumbnail((pixels, pixels))
+    buf = BytesIO()
+    thumbnail.save(buf, format="JPEG", quality=85)
+    return _Image(thumbnail.width, thumbnail.height, b"/DeviceRGB", b"/DCTDecode", buf.getvalue())
+
+
+def qr_image(qr_slug):
+    from PIL import Image
+
+    from .utils import generate_qr_image
+
+    with Image.open(generate_qr_image(qr_slug)) as image:
+        gray = image.convert("L")
+    return _Image(gray.width, gray.height, b"/DeviceGray", b"/FlateDecode", zlib.compress(gray.tobytes()))
+
+
+class _Writer:
+    """Numbers objects and records their byte offsets for the xref table."""
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.next_id = 1
+
+    def reserve(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def raw(self, data):
+        self.offset += len(data)
+        return data
+
+    def obj(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.offset
+        if stream is None:
+            return self.raw(b"%d 0 obj\n%s\nendobj\n" % (obj_id, body))
+        return self.raw(b"%d 0 obj\n%s\nstream\n%s\nendstream\nendobj\n" % (obj_id, body, stream))
+
+    def trailer(self, root_id):
+        start = self.offset
+        entries = b"".join(b"%010d 00000 n \n" % self.offsets[i] for i in range(1, self.next_id))
+        return self.raw(
+            b"xref\n0 %d\n0000000000 65535 f \n%s" % (self.next_id, entries)
+            + b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, root_id, start)
+        )
+
+
+class _Page:
+    def __init__(self):
+        self.ops = []
+        self.y = PAGE_HEIGHT - MARGIN
+        # ตัวอักษรที่ใช้ (ปกติ, ตัวหนา) สำหรับ subset ฟอนต์ที่ฝัง
+        self.chars = (set(), set())
+
+    def text(self, x, y, text, size, bold=False, gray=0):
+        self.chars[bold].update(text)
+        self.ops.append(b"%.2f g BT /%s %d Tf %.2f %.2f Td %s Tj ET" % (
+            gray, b"F2" if bold else b"F1", size, x, y, _pdf_string(text, bold)))
+
+    def image(self, name, x, y, width, height):
+        self.ops.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q" % (width, height, x, y, name))
+
+    def rule(self, y):
+        self.ops.append(b"0.8 G 0.5 w %d %.2f m %d %.2f l S" % (MARGIN, y, PAGE_WIDTH - MARGIN, y))
+
+    def content(self):
+        return zlib.compress(b"\n".join(self.ops))
+
+
+# รายการที่วางลงหน้า: ("text", ข้อความ, ขนาด, ตัวหนา, ย่อหน้า, สีเทา) หรือ ("gap", ความสูง) หรือ ("rule",)
+def _paragraph(text, size=10, bold=False, indent=0, gray=0):
+    width = PAGE_WIDTH - 2 * MARGIN - indent
+    return [("text", line, size, bold, indent, gray) for line in wrap(text, size, width, bold)]
+
+
+def _record_items(record):
+    items = [("gap", 8)]
+    items += _paragraph(f"{record.date:%B %d, %Y}  -  {record.diagnosis}", size=12, bold=True)
+    if record.doctor:
+        clinic = f", {record.doctor.clinic}" if record.doctor.clinic else ""
+        items += _paragraph(f"{record.doctor}{clinic}", size=9, gray=0.4)
+    for label, value in (("Treatment", record.treatment), ("Prescription", record.prescription),
+                         ("Notes", record.notes)):
+        if value:
+            items += _paragraph(label, size=10, bold=True)
+            items += _paragraph(value, indent=12)
+    if record.follow_up_on:
+        items += _paragraph(f"Follow-up: {record.follow_up_on:%B %d, %Y}", size=10, bold=True)
+    items += [("gap", 4), ("rule",)]
+    return items
+
+
+def _item_height(item):
+    if item[0] == "gap":
+        return item[1]
+    if item[0] == "rule":
+        return 6
+    return item[2] * 1.4
+
+
+def _place(page, item):
+    page.y -= _item_height(item)
+    if item[0] == "text":
+        _, line, size, bold, indent, gray = item
+        page.text(MARGIN + indent, page.y, line, size, bold, gray)
+    elif item[0] == "rule":
+        page.rule(page.y + 3)
+
+
+def _first_page(pet, images, exported_at):
+    page = _Page()
+    top = page.y
+    x = MARGIN
+    if b"Avatar" in images:
+        width, height = images[b"Avatar"][1].fit(IMAGE_SIZE)
+        page.image(b"Avatar", MARGIN, top - height, width, height)
+        x += IMAGE_SIZE + 16
+    if b"QR" in images:
+        page.image(b"QR", PAGE_WIDTH - MARGIN - IMAGE_SIZE, top - IMAGE_SIZE, IMAGE_SIZE, IMAGE_SIZE)
+
+    owner = pet.owner
+    lines = [
+        ("Medical history", 18, True, 0),
+        (pet.name, 14, True, 0),
+        (" / ".join(v for v in (pet.species, pet.breed, pet.color) if v), 10, False, 0.3),
+        (f"Born {pet.birth_date:%B %d, %Y}" if pet.birth_date else "", 10, False, 0.3),
+        (f"Owner: {owner.first_name} {owner.last_name}, {owner.email}"
+         + (f", {owner.phone_number}" if owner.phone_number else ""), 9, False, 0.3),
+        (f"Exported {timezone.localtime(exported_at):%B %d, %Y %H:%M}", 9, False, 0.3),
+    ]
+    y = top
+    text_width_limit = PAGE_WIDTH - MARGIN - IMAGE_SIZE - 16 - x
+    for text, size, bold, gray in lines:
+        if not text:
+            continue
+        y -= size * 1.4
+        page.text(x, y, wrap(text, size, text_width_limit, bold)[0], size, bold, gray)
+    page.y = min(y, top - IMAGE_SIZE) - 12
+    page.rule(page.y)
+    return page
+
+
+def _footer(page, pet, number):
+    page.text(MARGIN, MARGIN / 2, f"{pet.name} - medical history - page {number}", 8, gray=0.5)
+
+
+def _to_unicode(font, chars):
+    """ToUnicode CMap from glyph ids back to ``chars``, so the text can be copied and searched."""
+    mapping = {}
+    for char in sorted(chars):
+        gid = font.glyph(char)
+        if gid != font.missing or char == "?":
+            mapping.setdefault(gid, char)
+    entries = [b"<%04X> <%s>" % (gid, char.encode("utf-16-be").hex().upper().encode())
+               for gid, char in sorted(mapping.items())]
+    blocks = []
+    # bfchar หนึ่งบล็อกมีได้ไม่เกิน 100 รายการ
+    for start in range(0, len(entries), 100):
+        chunk = entries[start:start + 100]
+        blocks.append(b"%d beginbfchar\n%s\nendbfchar" % (len(chunk), b"\n".join(chunk)))
+    return b"\n".join([
+        b"/CIDInit /ProcSet findresource begin 12 dict begin begincmap",
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+        b"/CMapName /Adobe-Identity-UCS def /CMapType 2 def",
+        b"1 begincodespacerange <0000> <FFFF> endcodespacerange",
+        *blocks,
+        b"endcmap CMapName currentdict /CMap defineresource pop end end",
+    ])
+
+
+def _embedded_font(writer, font_id, font, chars):
+    """Yield the objects of ``font`` subset to ``chars`` as a Type0 font with id ``font_id``."""
+    glyph_ids = {font.glyph(c) for c in chars} | {0}
+    tag = "".join(chr(65 + b % 26) for b in hashlib.md5(repr(sorted(glyph_ids)).encode()).digest()[:6])
+    base_font = f"{tag}+{font.name}".encode()
+    file_id, descriptor, cid_font, to_unicode = (writer.reserve() for _ in range(4))
+
+    data = font.subset(glyph_ids)
+    stream = zlib.compress(data)
+    yield writer.obj(file_id, b"<< /Length %d /Length1 %d /Filter /FlateDecode >>" % (len(stream), len(data)), stream)
+    yield writer.obj(descriptor, b"<< /Type /FontDescriptor /FontName /%s /Flags 32 /FontBBox [%s] /ItalicAngle 0 "
+                                 b"/Ascent %d /Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>" % (
+                                     base_font, b" ".join(b"%d" % v for v in font.bbox),
+                                     font.ascent, font.descent, font.cap_height, file_id))
+    widths = b" ".join(b"%d [%d]" % (gid, font.widths[gid]) for gid in sorted(glyph_ids))
+    yield writer.obj(cid_font, b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s "
+                               b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+                               b"/FontDescriptor %d 0 R /W [%s] /CIDToGIDMap /Identity >>" % (
+                                   base_font, descriptor, widths))
+    cmap = zlib.compress(_to_unicode(font, chars))
+    yield writer.obj(to_unicode, b"<< /Length %d /Filter /FlateDecode >>" % len(cmap), cmap)
+    yield writer.obj(font_id, b"<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H "
+                              b"/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>" % (base_font, cid_font, to_unicode))
+
+
+def medical_history_pdf(pet, records):
+    """Yield the PDF of ``pet``'s medical history as bytes chunks.
+
+    ``records`` is a queryset in display order; it is read with a server-side
+    cursor. Select ``doctor__user`` on it, the pages show each record's doctor.
+    """
+    writer = _Writer()
+    catalog, pages, resources, font, bold = (writer.reserve() for _ in range(5))
+    fonts = _fonts()
+
+    yield writer.raw(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    yield writer.obj(catalog, b"<< /Type /Catalog /Pages %d 0 R >>" % pages)
+    if fonts is None:
+        yield writer.obj(font, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        yield writer.obj(bold, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold "
+                               b"/Encoding /WinAnsiEncoding >>")
+
+    images = {}
+    for name, image in ((b"Avatar", avatar_image(pet)), (b"QR", qr_image(pet.qr_slug))):
+        if image is not None:
+            images[name] = (writer.reserve(), image)
+            yield writer.obj(images[name][0], image.dictionary(), image.data)
+    xobjects = b" ".join(b"/%s %d 0 R" % (name, obj_id) for name, (obj_id, _) in images.items())
+    yield writer.obj(resources, b"<< /Font << /F1 %d 0 R /F2 %d 0 R >> /XObject << %s >> >>" % (font, bold, xobjects))
+
+    kids = []
+    chars = (set(), set())
+
+    def finish(page):
+        _footer(page, pet, len(kids) + 1)
+        chars[0].update(page.chars[0])
+        chars[1].update(page.chars[1])
+        content, page_id = writer.reserve(), writer.reserve()
+        kids.append(page_id)
+        stream = page.content()
+        yield writer.obj(content, b"<< /Length %d /Filter /FlateDecode >>" % len(stream), stream)
+        yield writer.obj(page_id, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources %d 0 R "
+                                  b"/Contents %d 0 R >>" % (pages, PAGE_WIDTH, PAGE_HEIGHT, resources, content))
+
+    page = _first_page(pet, images, timezone.now())
+    empty = True
+    for record in records.iterator(chunk_size=RECORD_CHUNK_SIZE):
+        empty = False
+        for item in _record_items(record):
+            if page.y - _item_height(item) < MARGIN:
+                yield from finish(page)
+                page = _Page()
+            _place(page, item)
+    if empty:
+        _place(page, ("gap", 12))
+        _place(page, ("text", "No medical records yet.", 11, False, 0, 0.3))
+    yield from finish(page)
+
+    if fonts is not None:
+        # ฟอนต์ที่ฝังเขียนหลังหน้าสุดท้าย เมื่อรู้ครบแล้วว่าใช้ตัวอักษรใดบ้าง
+        yield from _embedded_font(writer, font, fonts[0], chars[0])
+        yield from _embedded_font(writer, bold, fonts[1], chars[1])
+    refs = b" ".join(b"%d 0 R" % kid for kid in kids)
+    yield writer.obj(pages, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (refs, len(kids)))
+    yield writer.trailer(catalog)
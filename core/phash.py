@@ -0,0 +1,233 @@
+"""
+Perceptual hashes of pet photos, for matching a found animal to lost pets.
+
+``image_hashes`` reduces a photo to two 64-bit hashes computed with NumPy
+on a small grayscale copy:
+
+* pHash: signs of the lowest 8x8 frequencies of a 32x32 DCT against their
+  median. Robust to scaling, compression and small edits.
+* dHash: whether each pixel of a 9x8 thumbnail is brighter than its right
+  neighbour. Cheaper and coarser; used to rank pHash candidates.
+
+Similar photos have hashes a small Hamming distance apart. Pets store the
+hashes of their avatar (``Pet.avatar_phash``/``avatar_dhash``) as signed
+64-bit integers. When the avatar changes core.signals clears them and
+``schedule_hashing`` recomputes them on a background thread after commit, so
+the request never downloads the image (S3). ``hash_pet_avatars`` fills in
+hashes lost with a restarted worker.
+
+``find_lost_pets`` looks a photo up in a BK-tree of the pHashes of lost pets.
+A BK-tree only visits subtrees whose distance to the query can still be
+within the threshold, so lookups stay sub-linear as the number of lost pets
+grows. Each process keeps the tree in memory and rebuilds it when the set of
+lost pets or their hashes change (version stamp in the shared cache, as in
+core.backends); other pet edits leave it alone.
+
+NumPy and Pillow are imported with this module; import it lazily so they stay
+out of worker boot (see profile_imports).
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+LOST_INDEX_VERSION_KEY = "phash:lost:version"
+
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+
+
+def _dct_matrix(n):
+    # DCT-II แบบ orthonormal: dct(A) = C @ A @ C.T
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _pixels(gray, size):
+    return np.asarray(gray.resize(size, Image.Resampling.LANCZOS), dtype=np.float64)
+
+
+def phash(gray):
+    pixels = _pixels(gray, (_PHASH_SIZE, _PHASH_SIZE))
+    low = (_DCT @ pixels @ _DCT.T)[:_PHASH_LOW, :_PHASH_LOW]
+    # ไม่นับค่า DC (ความสว่างเฉลี่ย) ตอนหา median
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+def dhash(gray):
+    pixels = _pixels(gray, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def image_hashes(fileobj):
+    """Return ``(phash, dhash)`` of an image file as unsigned 64-bit ints."""
+    with Image.open(fileobj) as image:
+        # draft ให้ JPEG decode ที่ความละเอียดต่ำตั้งแต่แรก เร็วกว่า decode เต็มแล้วย่อมาก
+        image.draft("L", (_PHASH_SIZE * 4, _PHASH_SIZE * 4))
+        gray = ImageOps.exif_transpose(image).convert("L")
+    return phash(gray), dhash(gray)
+
+
+def avatar_hashes(field_file):
+    """``(phash, dhash)`` of a stored avatar, signed for the Pet fields."""
+    with field_file.open("rb") as f:
+        phash_value, dhash_value = image_hashes(f)
+    return to_signed(phash_value), to_signed(dhash_value)
+
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="avatar-hash")
+        return _executor
+
+
+def schedule_hashing(pet_id):
+    """Hash ``pet_id``'s avatar on a background thread once the current transaction commits."""
+    transaction.on_commit(lambda: _get_executor().submit(_hash_in_thread, pet_id))
+
+
+def _hash_in_thread(pet_id):
+    close_old_connections()
+    try:
+        hash_pet_avatar(pet_id)
+    except Exception as e:
+        print(f"Error hashing avatar of pet {pet_id}: {e}")
+    finally:
+        connection.close()
+
+
+def hash_pet_avatar(pet_id):
+    """Store the hashes of ``pet_id``'s current avatar; returns them, or None without an avatar."""
+    from .models import Pet
+
+    pet = Pet.objects.filter(pk=pet_id).only("pk", "avatar", "is_lost").first()
+    if pet is None or not pet.avatar:
+        return None
+    hashes = avatar_hashes(pet.avatar)
+    # avatar อาจถูกเปลี่ยนอีกระหว่างคำนวณ: เขียนเฉพาะเมื่อยังเป็นไฟล์เดิม
+    updated = Pet.objects.filter(pk=pet_id, avatar=pet.avatar.name).update(
+        avatar_phash=hashes[0], avatar_dhash=hashes[1]
+    )
+    if updated and pet.is_lost:
+        bump_lost_index_version()
+    return hashes
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(value):
+    """Unsigned 64-bit hash -> value that fits a BigIntegerField."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+class BKTree:
+    """Burkhard-Keller tree of 64-bit hashes under the Hamming distance."""
+
+    def __init__(self):
+        # node: (hash, items, {distance: child})
+        self._root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return ``(distance, item)`` pairs within ``max_distance``, closest first."""
+        results = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in items)
+            # triangle inequality: ลูกที่อยู่นอกช่วงนี้ไม่มีทางใกล้กว่า max_distance
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+_index = None
+_index_lock = Lock()
+
+
+def bump_lost_index_version():
+    version = uuid.uuid4().hex[:12]
+    cache.set(LOST_INDEX_VERSION_KEY, version, None)
+    return version
+
+
+def lost_pet_index():
+    """BK-tree of lost pets' avatar pHashes; items are ``(pet_id, dhash)``."""
+    from .models import Pet
+
+    global _index
+    version = cache.get(LOST_INDEX_VERSION_KEY) or bump_lost_index_version()
+    with _index_lock:
+        if _index is None or _index[0] != version:
+            tree = BKTree()
+            rows = Pet.objects.filter(is_lost=True, avatar_phash__isnull=False).values_list(
+                "pk", "avatar_phash", "avatar_dhash"
+            )
+            for pk, phash_value, dhash_value in rows.iterator():
+                tree.add(to_unsigned(phash_value), (pk, to_unsigned(dhash_value or 0)))
+            _index = (version, tree)
+        return _index[1]
+
+
+def find_lost_pets(fileobj, max_distance=None, limit=None):
+    """Lost pets whose avatar looks like the photo in ``fileobj``.
+
+    Returns ``(pet_id, distance)`` pairs, best match first. ``distance`` is the
+    pHash Hamming distance (0-64); dHash breaks ties.
+    """
+    if max_distance is None:
+        max_distance = settings.PHASH_MATCH_DISTANCE
+    if limit is None:
+        limit = settings.PHASH_MATCH_LIMIT
+    query_phash, query_dhash = image_hashes(fileobj)
+    candidates = lost_pet_index().search(query_phash, max_distance)
+    candidates.sort(key=lambda c: (c[0], hamming(query_dhash, c[1][1])))
+    return [(pet_id, distance) for distance, (pet_id, _) in candidates[:limit]]
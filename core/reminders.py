@@ -0,0 +1,117 @@
+"""
+Follow-up and vaccination reminders.
+
+A medical record may carry a ``follow_up_on`` date (next check-up or booster
+shot). ``send_due_reminders``, run periodically by ``send_reminders``, emails
+each owner a digest of the visits coming up within ``REMINDER_LEAD_DAYS`` and
+sets ``reminder_sent_at`` on those records.
+
+Due records are read ``REMINDER_BATCH_SIZE`` at a time from the partial index
+on (follow_up_on, id) of records still waiting, continuing after the last
+(follow_up_on, id) seen, so memory stays bounded however many rows are due.
+Each batch is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``: schedulers
+started at the same time on web1 and web2 split the rows instead of emailing
+twice. A batch stays locked until its emails are out; records of an owner
+whose email failed are left unmarked and retried on the next run.
+
+Digests are built per batch, so an owner with reminders in two batches of the
+same run gets two emails (rare: batches follow the date order). All emails of
+a run go over one SMTP connection.
+"""
+import datetime
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MedicalRecord
+
+
+def due_reminders(today=None):
+    """Records whose reminder should go out, in (follow_up_on, id) order."""
+    today = today or timezone.localdate()
+    return MedicalRecord.objects.filter(
+        reminder_sent_at__isnull=True,
+        follow_up_on__gte=today - datetime.timedelta(days=settings.REMINDER_MAX_AGE_DAYS),
+        follow_up_on__lte=today + datetime.timedelta(days=settings.REMINDER_LEAD_DAYS),
+    ).order_by("follow_up_on", "id")
+
+
+def _claim_batch(today, after, size):
+    records = due_reminders(today)
+    if after is not None:
+        day, pk = after
+        records = records.filter(Q(follow_up_on__gt=day) | Q(follow_up_on=day, id__gt=pk))
+    # of=self: ล็อกเฉพาะแถว record ไม่ล็อก pet/owner/doctor ที่ join มา (doctor เป็น outer join ล็อกไม่ได้อยู่แล้ว)
+    return list(
+        records.select_related("pet__owner", "doctor__user")
+        .select_for_update(skip_locked=True, of=("self",))[:size]
+    )
+
+
+def build_digest(owner, records):
+    """One email listing ``records`` (all of ``owner``'s pets) by date."""
+    lines = [
+        f"Hello {owner.first_name} {owner.last_name},",
+        "",
+        "This is a reminder of upcoming visits for your pets:",
+        "",
+    ]
+    for record in records:
+        lines.append(f"📅 {record.follow_up_on:%B %d, %Y}: {record.pet.name} - follow-up for {record.diagnosis}")
+        if record.doctor:
+            clinic = f" ({record.doctor.clinic})" if record.doctor.clinic else ""
+            lines.append(f"   {record.doctor}{clinic}")
+    lines += ["", "Best regards,", "PetID Team"]
+
+    subject = (
+        f"🐾 Reminder: {records[0].pet.name} has a visit on {records[0].follow_up_on:%B %d}"
+        if len(records) == 1 else f"🐾 Reminder: {len(records)} upcoming visits for your pets"
+    )
+    return EmailMessage(subject=subject, body="\n".join(lines), to=[owner.email])
+
+
+def send_due_reminders(today=None, batch_size=None):
+    """Email all due reminders. Returns ``(emails_sent, records_reminded)``."""
+    today = today or timezone.localdate()
+    batch_size = batch_size or settings.REMINDER_BATCH_SIZE
+    emails = reminded = 0
+    after = None
+    with get_connection() as mail:
+        while True:
+            with transaction.atomic():
+                batch = _claim_batch(today, after, batch_size)
+                if not batch:
+                    break
+                after = (batch[-1].follow_up_on, batch[-1].id)
+
+                sent_ids = []
+                batch.sort(key=lambda r: (r.pet.owner_id, r.follow_up_on, r.id))
+                for _, owner_records in groupby(batch, key=lambda r: r.pet.owner_id):
+                    owner_records = list(owner_records)
+                    owner = owner_records[0].pet.owner
+                    if owner.is_active and owner.email:
+                        try:
+                            mail.send_messages([build_digest(owner, owner_records)])
+                        except Exception as e:
+                            print(f"Reminder email error ({owner.email}): {e}")
+                            _reopen(mail)
+                            continue
+                        emails += 1
+                    sent_ids.extend(record.id for record in owner_records)
+
+                MedicalRecord.objects.filter(id__in=sent_ids).update(reminder_sent_at=timezone.now())
+                reminded += len(sent_ids)
+    return emails, reminded
+
+
+def _reopen(mail):
+    # connection ที่ error ไปแล้วอาจใช้ต่อไม่ได้: เปิดใหม่ให้ owner ถัดไป
+    mail.close()
+    try:
+        mail.open()
+    except Exception as e:
+        print(f"Reminder email reconnect error: {e}")
@@ -0,0 +1,137 @@
+"""
+Live sighting stream for pet owners.
+
+Sync views call ``publish_event`` when a finder reports a location. Each event
+is written to the shared cache under a per-owner sequence number, so it is
+visible from every web container (web1/web2). Inside each ASGI worker a single
+``SightingHub`` polls the cache for all owners that currently have an open
+stream and fans new events out to their in-process queues. Idle connections
+only cost an asyncio queue, not a thread.
+
+This needs a cache shared between processes (Redis, ``REDIS_URL``). The
+LocMem fallback is per process: events published by one worker never reach
+streams held by another, so serving SSE next to more than one worker needs Redis.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = "sightings"
+
+
+def _cache():
+    return caches[settings.SIGHTING_CACHE_ALIAS]
+
+
+def _seq_key(owner_id):
+    return f"{KEY_PREFIX}:{owner_id}:seq"
+
+
+def _event_key(owner_id, seq):
+    return f"{KEY_PREFIX}:{owner_id}:{seq}"
+
+
+def publish_event(owner_id, event, data):
+    """Publish an event to every open stream of ``owner_id``. Returns the event id."""
+    cache = _cache()
+    seq_key = _seq_key(owner_id)
+    cache.add(seq_key, 0, timeout=None)
+    try:
+        seq = cache.incr(seq_key)
+    except ValueError:
+        # key ถูก evict ระหว่าง add กับ incr
+        cache.set(seq_key, 1, timeout=None)
+        seq = 1
+    cache.set(_event_key(owner_id, seq), {"event": event, "data": data}, settings.SIGHTING_EVENT_TTL)
+    return seq
+
+
+class SightingHub:
+    """Per-process fan-out of cached owner events to local subscriber queues."""
+
+    # How long a sequence number may stay missing (published but not yet
+    # written, or already expired) before the poller skips over it.
+    MISSING_GRACE = 5.0
+
+    def __init__(self):
+        self._subscribers = {}  # owner_id -> set of asyncio.Queue
+        self._cursors = {}  # owner_id -> last seq delivered
+        self._missing_since = {}  # owner_id -> monotonic time of first gap
+        self._task = None
+
+    async def subscribe(self, owner_id, last_event_id=None):
+        queue = asyncio.Queue(maxsize=settings.SIGHTING_QUEUE_SIZE)
+        cache = _cache()
+        if owner_id not in self._cursors:
+            self._cursors[owner_id] = await cache.aget(_seq_key(owner_id), 0)
+        self._subscribers.setdefault(owner_id, set()).add(queue)
+
+        # ส่ง event ที่พลาดไประหว่าง reconnect (Last-Event-ID) ให้เฉพาะ queue นี้
+        if last_event_id is not None and last_event_id < self._cursors[owner_id]:
+            seqs = range(last_event_id + 1, self._cursors[owner_id] + 1)
+            found = await cache.aget_many([_event_key(owner_id, seq) for seq in seqs])
+            for seq in seqs:
+                event = found.get(_event_key(owner_id, seq))
+                if event is not None:
+                    self._offer(queue, seq, event)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, owner_id, queue):
+        queues = self._subscribers.get(owner_id)
+        if not queues:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[owner_id]
+            self._cursors.pop(owner_id, None)
+            self._missing_since.pop(owner_id, None)
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                await self._poll()
+            except Exception as e:
+                print(f"Sighting hub poll error: {e}")
+            await asyncio.sleep(settings.SIGHTING_POLL_INTERVAL)
+
+    async def _poll(self):
+        cache = _cache()
+        owners = list(self._subscribers)
+        latest = await cache.aget_many([_seq_key(owner_id) for owner_id in owners])
+        for owner_id in owners:
+            head = latest.get(_seq_key(owner_id), 0)
+            cursor = self._cursors.get(owner_id, head)
+            if head <= cursor:
+                continue
+            seqs = range(cursor + 1, head + 1)
+            found = await cache.aget_many([_event_key(owner_id, seq) for seq in seqs])
+            for seq in seqs:
+                event = found.get(_event_key(owner_id, seq))
+                if event is None:
+                    first_seen = self._missing_since.setdefault(owner_id, time.monotonic())
+                    if time.monotonic() - first_seen < self.MISSING_GRACE:
+                        break
+                else:
+                    self._broadcast(owner_id, seq, event)
+                self._missing_since.pop(owner_id, None)
+                if owner_id in self._cursors:
+                    self._cursors[owner_id] = seq
+
+    def _broadcast(self, owner_id, seq, event):
+        for queue in list(self._subscribers.get(owner_id, ())):
+            self._offer(queue, seq, event)
+
+    @staticmethod
+    def _offer(queue, seq, event):
+        # client ที่อ่านช้าจะเสีย event เก่าสุดแทนการบล็อก poller
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait((seq, event))
+
+
+hub = SightingHub()
@@ -0,0 +1,270 @@
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .access import invalidate_access_cache
+from .analytics import adjust_record_counts, pet_changed, record_key, rollup_key
+from .backends import bump_permission_version
+from .cards import delete_snapshot, schedule_render
+from .facets import adjust_facet_counts, facet_key
+from .models import Doctor, MedicalRecord, Pet, User
+from .outbox import (
+    ACCESS_GRANTED, ACCESS_REVOKED, PET_AVATAR_CHANGED, PET_LOST_CHANGED, RECORD_CREATED, RECORD_DELETED,
+    RECORD_UPDATED, emit, emit_access_change,
+)
+from .pdf import bump_history_version, delete_history_exports
+from .storage import add_blob_reference, asset_storage, release_blob_reference
+from .utils import qr_asset_name
+
+
+@receiver(m2m_changed, sender=Doctor.pets.through)
+def doctor_pets_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # pet.doctors.add()/doctor.pets.remove() และการแก้ไขผ่าน admin
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+    if action == "pre_clear":
+        # clear(): pk_set ไม่ถูกส่งมา ต้องอ่านก่อนลบ
+        related = instance.doctors if reverse else instance.pets
+        instance._cleared_ids = list(related.values_list("pk", flat=True))
+        return
+    ids = pk_set if action != "post_clear" else getattr(instance, "_cleared_ids", [])
+    doctor_ids, pet_ids = (ids, [instance.pk]) if reverse else ([instance.pk], ids)
+    invalidate_access_cache(doctor_ids)
+    if ids:
+        emit_access_change(ACCESS_GRANTED if action == "post_add" else ACCESS_REVOKED, pet_ids, doctor_ids)
+
+
+# ค่าก่อน save ที่ handler หลัง save ใช้เทียบ: อ่านจาก DB ใน query เดียว
+PREVIOUS_PET_FIELDS = ("avatar", "is_lost", *(f"{facet}_normalized" for facet in Pet.FACET_FIELDS))
+
+
+@receiver(pre_save, sender=Pet)
+def remember_previous_pet(sender, instance, update_fields=None, **kwargs):
+    row = None
+    if instance._state.adding:
+        pass
+    elif update_fields is not None and not {"avatar", "is_lost", *Pet.FACET_FIELDS} & set(update_fields):
+        # ไม่มี field ที่สนใจถูกบันทึก: ค่าใน instance คือค่าเดิม
+        row = (instance.avatar.name, instance.is_lost, *facet_key(instance))
+    else:
+        row = Pet.objects.filter(pk=instance.pk).values_list(*PREVIOUS_PET_FIELDS).first()
+
+    if row is None:
+        instance._previous_avatar = instance._previous_facets = None
+        instance._previous_is_lost = instance.is_lost
+        return
+    # avatar ว่างใน DB เป็น "" ไม่ใช่ None
+    instance._previous_avatar = row[0] or None
+    instance._previous_is_lost = row[1]
+    instance._previous_facets = tuple(row[2:])
+
+
+@receiver(post_save, sender=Pet)
+def update_avatar_references(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_avatar", None)
+    current = instance.avatar.name if instance.avatar else None
+    if current == previous:
+        return
+    if current:
+        add_blob_reference(current)
+    if previous:
+        release_blob_reference(previous)
+
+
+@receiver(post_save, sender=Pet)
+def update_facet_counts(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_facets", None)
+    current = facet_key(instance)
+    if not created and previous == current:
+        return
+    deltas = {current: 1}
+    if previous is not None:
+        deltas[previous] = deltas.get(previous, 0) - 1
+    adjust_facet_counts(deltas)
+
+
+@receiver(post_delete, sender=Pet)
+def release_facet_count(sender, instance, **kwargs):
+    adjust_facet_counts({facet_key(instance): -1})
+
+
+def _avatar_changed(instance):
+    current = instance.avatar.name if instance.avatar else None
+    return current != getattr(instance, "_previous_avatar", None)
+
+
+@receiver(post_save, sender=Pet)
+def hash_avatar(sender, instance, **kwargs):
+    if not _avatar_changed(instance):
+        return
+    from .phash import schedule_hashing
+
+    # hash ของรูปเดิมใช้ไม่ได้แล้ว; รูปใหม่คำนวณใน background เพราะอาจต้องโหลดจาก S3
+    if instance.avatar_phash is not None or instance.avatar_dhash is not None:
+        instance.avatar_phash = instance.avatar_dhash = None
+        Pet.objects.filter(pk=instance.pk).update(avatar_phash=None, avatar_dhash=None)
+    if instance.avatar:
+        schedule_hashing(instance.pk)
+
+
+@receiver(post_save, sender=Pet)
+def lost_pets_changed(sender, instance, created, **kwargs):
+    was_lost = False if created else getattr(instance, "_previous_is_lost", instance.is_lost)
+    # BK-tree มีแค่ hash ของสัตว์ที่หาย: แก้ชื่อ/ข้อมูลอื่นไม่ต้อง rebuild
+    if was_lost != instance.is_lost or (instance.is_lost and _avatar_changed(instance)):
+        from .phash import bump_lost_index_version
+
+        # หลัง commit: process อื่นที่สร้าง BK-tree ใหม่ต้องเห็นข้อมูลชุดใหม่แล้ว
+        transaction.on_commit(bump_lost_index_version)
+
+
+@receiver(post_delete, sender=Pet)
+def lost_pet_deleted(sender, instance, **kwargs):
+    if instance.is_lost:
+        from .phash import bump_lost_index_version
+
+        transaction.on_commit(bump_lost_index_version)
+
+
+@receiver(post_delete, sender=Pet)
+def release_avatar_reference(sender, instance, **kwargs):
+    if instance.avatar:
+        release_blob_reference(instance.avatar.name)
+
+
+@receiver(post_delete, sender=Pet)
+def delete_pet_assets(sender, instance, **kwargs):
+    name = qr_asset_name(instance.qr_slug)
+    transaction.on_commit(lambda: asset_storage().delete(name))
+    transaction.on_commit(lambda: delete_snapshot(instance.qr_slug))
+    transaction.on_commit(lambda: delete_history_exports(asset_storage(), instance.pk))
+
+
+@receiver(pre_save, sender=MedicalRecord)
+def remember_previous_record(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance._previous_record_key = None
+        return
+    row = (
+        MedicalRecord.objects.filter(pk=instance.pk)
+        .values_list("doctor_id", "pet_id", "date", "diagnosis").first()
+    )
+    instance._previous_record_key = rollup_key(*row) if row else None
+
+
+@receiver(post_save, sender=MedicalRecord)
+def update_doctor_analytics(sender, instance, **kwargs):
+    adjust_record_counts(getattr(instance, "_previous_record_key", None), record_key(instance))
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def release_doctor_analytics(sender, instance, **kwargs):
+    adjust_record_counts(record_key(instance), None)
+
+
+@receiver(post_save, sender=Pet)
+def update_doctor_patients(sender, instance, created, **kwargs):
+    if not created:
+        pet_changed(instance)
+
+
+@receiver(post_save, sender=Pet)
+def emit_pet_events(sender, instance, created, **kwargs):
+    # อยู่ใน transaction เดียวกับการ save เมื่อผู้เรียกครอบด้วย atomic() (core.outbox)
+    if not created and instance.is_lost != getattr(instance, "_previous_is_lost", instance.is_lost):
+        emit(PET_LOST_CHANGED, instance.pk, {"pet_id": str(instance.pk), "is_lost": instance.is_lost})
+    previous = getattr(instance, "_previous_avatar", None)
+    current = instance.avatar.name if instance.avatar else None
+    if current != previous:
+        emit(PET_AVATAR_CHANGED, instance.pk, {"pet_id": str(instance.pk), "avatar": current, "previous": previous})
+
+
+@receiver(post_save, sender=MedicalRecord)
+def emit_record_saved(sender, instance, created, **kwargs):
+    emit(RECORD_CREATED if created else RECORD_UPDATED, instance.pet_id, {
+        "record_id": instance.pk,
+        "pet_id": str(instance.pet_id),
+        "doctor_id": instance.doctor_id,
+    })
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def emit_record_deleted(sender, instance, **kwargs):
+    emit(RECORD_DELETED, instance.pet_id, {
+        "record_id": instance.pk,
+        "pet_id": str(instance.pet_id),
+        "doctor_id": instance.doctor_id,
+    })
+
+
+@receiver(post_save, sender=MedicalRecord)
+@receiver(post_delete, sender=MedicalRecord)
+def medical_history_changed(sender, instance, **kwargs):
+    # หลัง commit: export ที่เริ่มก่อนหน้านั้นยังอ่านข้อมูลชุดเก่า จึงต้องไม่ได้ version ใหม่
+    pet_id = instance.pet_id
+    transaction.on_commit(lambda: bump_history_version(pet_id))
+
+
+@receiver(post_save, sender=Pet)
+def render_pet_card(sender, instance, **kwargs):
+    schedule_render([instance.pk])
+
+
+# ข้อมูลเจ้าของที่แสดงบน pet card (เรียงตามลำดับให้เทียบค่าเป็น tuple ได้)
+OWNER_CARD_FIELDS = ("first_name", "last_name", "email", "phone_number")
+
+
+def owner_card_details(user):
+    return tuple(getattr(user, field) for field in OWNER_CARD_FIELDS)
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_owner(sender, instance, update_fields=None, **kwargs):
+    # login บันทึกแค่ last_login: ค่าใน instance คือค่าเดิม ไม่ต้อง query
+    if instance._state.adding or (update_fields is not None and not set(OWNER_CARD_FIELDS) & set(update_fields)):
+        instance._previous_card_details = owner_card_details(instance)
+        return
+    instance._previous_card_details = User.objects.filter(pk=instance.pk).values_list(*OWNER_CARD_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def owner_details_changed(sender, instance, created, **kwargs):
+    # เช่นเปลี่ยนรหัสผ่าน: save() ทั้งแถวแต่ข้อมูลบนการ์ดเหมือนเดิม
+    if created or getattr(instance, "_previous_card_details", None) == owner_card_details(instance):
+        return
+    pets = Pet.objects.filter(owner=instance)
+    pet_ids = list(pets.values_list("pk", flat=True))
+    if not pet_ids:
+        return
+    # เลื่อน updated_at ให้ทั้ง fragment cache บน dashboard และ snapshot รู้ว่าต้อง render ใหม่
+    pets.update(updated_at=timezone.now())
+    schedule_render(pet_ids)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        bump_permission_version([instance.pk])
+    elif pk_set:
+        # group.user_set.add(...) หรือ permission.user_set.add(...)
+        bump_permission_version(pk_set)
+    else:
+        # group.user_set.clear(): ไม่รู้ว่าเป็นใครบ้าง
+        bump_permission_version()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_permission_version()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def permission_objects_deleted(sender, **kwargs):
+    bump_permission_version()
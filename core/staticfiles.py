@@ -0,0 +1,65 @@
+"""
+Static files storage used by collectstatic.
+
+``CompressedManifestStaticFilesStorage`` stores every file under a
+content-hashed name (``css/app.3f2a9c1b7e4d.css``) like Django's
+``ManifestStaticFilesStorage``, so nginx can cache it for a year. It also
+writes ``.gz`` and, when the ``brotli`` package is installed, ``.br`` copies
+next to each text asset, so nginx can serve them precompressed
+(``gzip_static``) instead of compressing on every request.
+
+Until collectstatic has written the manifest (a fresh checkout run with
+``DEBUG=False``, or the test suite) ``{% static %}`` falls back to the
+unhashed names instead of raising on every page.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli เป็น optional: ไม่มีก็ทำแค่ .gz
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".map", ".txt", ".html", ".xml")
+# ไฟล์เล็กกว่านี้บีบแล้วแทบไม่ต่าง ไม่คุ้มกับ request ที่ต้องเปิดไฟล์เพิ่ม
+MIN_COMPRESS_SIZE = 256
+
+
+def compress_file(path):
+    """Write ``path.gz`` (and ``path.br``) unless they are already up to date."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return
+    variants = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", lambda d: brotli.compress(d, quality=11)))
+    mtime = os.path.getmtime(path)
+    for suffix, compress in variants:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        compressed = compress(data)
+        # เก็บเฉพาะถ้าเล็กลงจริง nginx จะ fallback ไปไฟล์ต้นฉบับเอง
+        if len(compressed) < len(data):
+            with open(target, "wb") as f:
+                f.write(compressed)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # ไม่มี manifest = ยังไม่ได้ collectstatic: ใช้ชื่อเดิมแทนการ raise ValueError
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # template อ้างถึงแค่ชื่อที่มี hash จึงบีบเฉพาะชื่อเหล่านั้น
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                compress_file(self.path(name))
@@ -0,0 +1,145 @@
+"""
+Content-addressed media storage for pet avatars.
+
+``ContentHashStorage`` hashes an upload while streaming it to a temporary
+file and stores it once under ``blobs/<aa>/<bb>/<sha256><ext>``; uploading
+the same photo again reuses the existing blob. Blob names never change
+content, so they can be served with ``Cache-Control: immutable``.
+
+References are counted in ``MediaBlob`` rows maintained by core.signals.
+A blob whose count drops to zero is deleted after commit, unless it was
+(re)written within ``MEDIA_BLOB_GRACE_SECONDS``. In that case a concurrent
+upload may be about to reference it, and ``gc_media_blobs`` collects it later.
+
+Generated files such as QR codes live in the separate ``assets`` storage.
+Both storages are local filesystem storages under ``MEDIA_ROOT`` by default,
+or S3-compatible buckets with signed URLs when ``MEDIA_STORAGE=s3``
+(core.storage_s3).
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = "blobs/"
+
+
+def avatar_storage():
+    return storages["avatars"]
+
+
+def asset_storage():
+    return storages["assets"]
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def blob_name_for(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def _copy_hashing(content, out):
+    digest = hashlib.sha256()
+    if hasattr(content, "seek"):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+        out.write(chunk)
+    return digest.hexdigest()
+
+
+class ContentHashMixin:
+    """Store every file under its content hash, whatever the underlying storage."""
+
+    def get_available_name(self, name, max_length=None):
+        # ชื่อจริงถูกกำหนดจาก hash ใน _save จึงไม่ต้องเติม suffix แบบสุ่ม
+        return name
+
+    def _save(self, name, content):
+        with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as tmp:
+            blob_name = blob_name_for(_copy_hashing(content, tmp), name)
+            _touch_blob(blob_name)
+            if not self.exists(blob_name):
+                tmp.seek(0)
+                super()._save(blob_name, File(tmp, name=blob_name))
+        return blob_name
+
+    def save_as(self, name, content):
+        """Store ``content`` under ``name`` as is, e.g. when copying existing media."""
+        return super()._save(name, content)
+
+
+@deconstructible
+class ContentHashStorage(ContentHashMixin, FileSystemStorage):
+    def _save(self, name, content):
+        tmp_dir = self.path(f"{BLOB_PREFIX}tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                digest = _copy_hashing(content, tmp)
+
+            blob_name = blob_name_for(digest, name)
+            _touch_blob(blob_name)
+            full_path = self.path(blob_name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            # rename แบบ atomic: เนื้อหาเหมือนกันเสมอ จึงเขียนทับ blob เดิมได้อย่างปลอดภัย
+            os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return blob_name
+
+
+def _touch_blob(name):
+    from .models import MediaBlob
+
+    MediaBlob.objects.update_or_create(name=name, defaults={"last_written_at": timezone.now()})
+
+
+def add_blob_reference(name):
+    from .models import MediaBlob
+
+    if is_blob_name(name):
+        MediaBlob.objects.filter(name=name).update(refcount=F("refcount") + 1)
+
+
+def release_blob_reference(name):
+    from .models import MediaBlob
+
+    if not is_blob_name(name):
+        return
+    MediaBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F("refcount") - 1)
+    transaction.on_commit(lambda: delete_blob_if_unreferenced(name))
+
+
+def delete_blob_if_unreferenced(name, grace=None):
+    """Delete blob ``name`` if nothing references it and no upload is writing it."""
+    from .models import MediaBlob
+
+    if grace is None:
+        grace = timedelta(seconds=settings.MEDIA_BLOB_GRACE_SECONDS)
+    with transaction.atomic():
+        blob = (
+            MediaBlob.objects.select_for_update(skip_locked=True)
+            .filter(name=name, refcount=0, last_written_at__lt=timezone.now() - grace)
+            .first()
+        )
+        if blob is None:
+            return False
+        avatar_storage().delete(name)
+        blob.delete()
+    return True
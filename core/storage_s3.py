@@ -0,0 +1,44 @@
+"""
+S3-compatible media storages, used when ``MEDIA_STORAGE=s3``.
+
+Objects are private. ``url()`` returns a signed link that expires after
+``querystring_expire`` seconds, so browsers fetch images straight from the
+bucket and never through a web worker. Any S3-compatible server works;
+docker-compose.s3.yml adds MinIO to the compose setup.
+
+If the app reaches the bucket by an internal host name (``http://minio:9000``),
+set ``public_endpoint_url`` to the address browsers use. Signed URLs are
+rewritten to that address. The proxy behind it must forward requests with
+the internal host as the ``Host`` header, or the signature will not match
+(see nginx/s3/media-store.conf).
+
+Kept apart from core.storage so boto3 is only imported when S3 is in use.
+"""
+from django.utils.deconstruct import deconstructible
+from django.utils.http import content_disposition_header
+from storages.backends.s3 import S3Storage
+
+from .storage import ContentHashMixin
+
+
+@deconstructible
+class SignedS3Storage(S3Storage):
+    def get_default_settings(self):
+        return {**super().get_default_settings(), "public_endpoint_url": None}
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        url = super().url(name, parameters, expire, http_method)
+        if self.public_endpoint_url and self.endpoint_url:
+            endpoint = self.endpoint_url.rstrip("/")
+            if url.startswith(endpoint):
+                url = self.public_endpoint_url.rstrip("/") + url[len(endpoint):]
+        return url
+
+    def download_url(self, name, filename):
+        """Signed URL that makes the browser save ``name`` as ``filename``."""
+        return self.url(name, parameters={"ResponseContentDisposition": content_disposition_header(True, filename)})
+
+
+@deconstructible
+class S3ContentHashStorage(ContentHashMixin, SignedS3Storage):
+    pass
@@ -1,3 +1,1878 @@
-from django.test import TestCase
+"""
+Tests for core.
 
-# Create your tests here.
+``QueryBudgetTests`` are query-budget regression tests for the views in
+core/urls.py.
+
+Each test requests a view once against a small data set (one pet, one medical
+record, one doctor) and once after growing it to 200 pets, 500 records and 50
+doctors. The number of SQL queries must be the same: a view whose query count
+grows with the data has an N+1 (a query per row in a loop or a template).
+On failure the message lists the statements that repeat, followed by every
+query of both runs.
+
+Not covered: ``sighting_stream`` (an endless ASGI stream) and the PUT of
+``chunked_upload_part``, whose cost depends on the uploaded bytes rather than
+on the number of rows.
+"""
+import asyncio
+import datetime
+import importlib
+import io
+import json
+import os
+import random
+import re
+import runpy
+import shutil
+import string
+import tempfile
+import threading
+import unicodedata
+import unittest
+import uuid
+import zlib
+from collections import Counter
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import DataError, connection, transaction
+from django.db.models import F
+from django.http import FileResponse
+from django.template import engines
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:  # ทดสอบ S3 storage ต้องมี moto (README)
+    mock_aws = None
+
+from .access import bulk_update_access, doctor_pet_ids
+from .analytics import doctor_analytics, rebuild_doctor_analytics
+from .audit import AuditBuffer, accesses_for_pet
+from .backends import EmailBackend, sync_role_group
+from .cards import render_snapshot, snapshot_path, stale_pets
+from .forms import PetForm, RegistrationForm
+from .models import (
+    ChangeEvent, ChunkedUpload, Doctor, DoctorDiagnosisCount, DoctorPatient, DoctorVisitMonth, MedicalRecord,
+    MediaBlob, OutboxCheckpoint, Pet, PetFacetCount, RecordAccessLog, User,
+)
+from .facets import rebuild_facet_counts, summary_facet_counts
+from .outbox import consume_batch, drain, emit
+from .pdf import TrueTypeFont, _pdf_string, medical_history_pdf, wrap
+from .pagination import EstimatedCountPaginator, estimated_row_count
+from .partitions import PARTITIONED_TABLES, detach_partitions_before, ensure_partitions
+from .phash import LOST_INDEX_VERSION_KEY, BKTree, find_lost_pets, hamming, hash_pet_avatar, lost_pet_index
+from .reminders import send_due_reminders
+from .sightings import SightingHub, publish_event
+from .staticfiles import CompressedManifestStaticFilesStorage
+from .storage import asset_storage, avatar_storage, blob_name_for
+from .uploads import UploadOffsetMismatch, part_path, process_upload, write_part
+from .warmup import warm_up
+
+LARGE_PETS = 200
+LARGE_RECORDS = 500
+LARGE_DOCTORS = 50
+
+OWNER_PERMISSIONS = [
+    'add_pet', 'change_pet', 'view_pet', 'view_medicalrecord', 'view_doctor', 'change_user', 'view_user',
+]
+DOCTOR_PERMISSIONS = [
+    'view_pet', 'add_medicalrecord', 'change_medicalrecord', 'delete_medicalrecord', 'view_medicalrecord',
+    'view_doctor', 'change_user', 'view_user',
+]
+
+_ASSET_DIR = tempfile.mkdtemp(prefix='petid-test-assets-')
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b|\"s\d+_x\d+\"")
+
+
+def _normalize(sql):
+    # ตัดค่าคงที่และชื่อ savepoint ออก ให้ query เดียวกันที่ต่างกันแค่ id นับเป็นแบบเดียวกัน
+    return _LITERALS.sub('?', sql)
+
+
+@override_settings(
+    # QR code เขียนลง temp dir
+    STORAGES={
+        **settings.STORAGES,
+        'assets': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': _ASSET_DIR}},
+    },
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    PET_CARD_SNAPSHOTS=False,
+    # เขียน audit log ทันทีในแต่ละ request: นับเป็นส่วนหนึ่งของ budget และไม่มี timer thread ค้าง
+    AUDIT_BUFFER_SIZE=1,
+)
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_ASSET_DIR, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        owner_group = cls._group('Owner', OWNER_PERMISSIONS)
+        doctor_group = cls._group('Doctor', DOCTOR_PERMISSIONS)
+
+        cls.owner = User.objects.create_user(
+            email='owner@example.com', password=None, role='OWNER', first_name='Olive', last_name='Owner',
+        )
+        cls.owner.groups.add(owner_group)
+        cls.doctor_user = User.objects.create_user(
+            email='doctor@example.com', password=None, role='DOCTOR', first_name='Dana', last_name='Doctor',
+        )
+        cls.doctor_user.groups.add(doctor_group)
+        cls.doctor = Doctor.objects.create(user=cls.doctor_user, clinic='Central Clinic')
+
+        cls.pet = Pet.objects.create(
+            owner=cls.owner, name='Pet 0', species='Dog', breed='Beagle', color='Brown', qr_slug='pet-0',
+        )
+        cls.doctor.pets.add(cls.pet)
+        cls.record = MedicalRecord.objects.create(
+            pet=cls.pet, doctor=cls.doctor, diagnosis='Checkup', treatment='Rest',
+        )
+
+    @staticmethod
+    def _group(name, codenames):
+        group = Group.objects.create(name=name)
+        group.permissions.set(Permission.objects.filter(content_type__app_label='core', codename__in=codenames))
+        return group
+
+    def _grow(self):
+        """Bring the fixtures up to LARGE_PETS pets, LARGE_RECORDS records and LARGE_DOCTORS doctors."""
+        # bulk_create ไม่ผ่าน signal: ข้อมูลที่เพิ่มจึงไม่ไปแตะ cache หรือตารางสรุป
+        pets = Pet.objects.bulk_create([
+            Pet(owner=self.owner, name=f'Pet {i}', species='Cat', species_normalized='cat', qr_slug=f'pet-{i}')
+            for i in range(1, LARGE_PETS)
+        ])
+        users = User.objects.bulk_create([
+            User(email=f'doctor-{i}@example.com', role='DOCTOR', first_name='Doc', last_name=str(i))
+            for i in range(1, LARGE_DOCTORS)
+        ])
+        doctors = [self.doctor] + Doctor.objects.bulk_create([
+            Doctor(user=user, clinic=f'Clinic {i}') for i, user in enumerate(users, 1)
+        ])
+        PetDoctor = Doctor.pets.through
+        PetDoctor.objects.bulk_create(
+            [PetDoctor(doctor=self.doctor, pet=pet) for pet in pets]
+            + [PetDoctor(doctor=doctor, pet=self.pet) for doctor in doctors[1:]]
+        )
+        # บันทึกจากหมอหลายคน: template ที่อ่าน record.doctor.user ทีละแถวจะเห็นชัด
+        MedicalRecord.objects.bulk_create([
+            MedicalRecord(pet=self.pet, doctor=doctors[i % len(doctors)], diagnosis=f'Visit {i}', treatment='Rest')
+            for i in range(1, LARGE_RECORDS)
+        ])
+        rebuild_doctor_analytics()
+
+    def _run(self, request, status):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+            # อ่าน streaming response ให้หมด (query ระหว่างสร้างเนื้อหาก็นับด้วย) test client จึงปิดไฟล์ให้
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(response.status_code, status, body[:500])
+        if response.get('Content-Type') == 'application/json':
+            self.assertNotEqual(response.json().get('success'), False, response.content)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def assertConstantQueries(self, request, status=200):
+        """Call ``request`` before and after ``_grow``; both runs must issue the same number of queries."""
+        small = self._run(request, status)
+        self._grow()
+        large = self._run(request, status)
+        if len(small) == len(large):
+            return
+
+        small_counts = Counter(map(_normalize, small))
+        large_counts = Counter(map(_normalize, large))
+        repeated = [
+            f'  {small_counts[sql]} -> {large_counts[sql]}x  {sql}'
+            for sql in small_counts | large_counts
+            if small_counts[sql] != large_counts[sql]
+        ]
+        self.fail('\n'.join([
+            f'{len(small)} queries with small data, {len(large)} with large data.',
+            'Statements whose count changed:',
+            *repeated,
+            'Small run:',
+            *(f'  {i}. {sql}' for i, sql in enumerate(small, 1)),
+            'Large run:',
+            *(f'  {i}. {sql}' for i, sql in enumerate(large, 1)),
+        ]))
+
+    def _post_json(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    # ---- anonymous pages ----
+
+    def test_login(self):
+        self.assertConstantQueries(lambda: self.client.get(reverse('login')))
+
+    def test_register(self):
+        self.assertConstantQueries(lambda: self.client.get(reverse('register')))
+
+    def test_pet_card(self):
+        self.assertConstantQueries(lambda: self.client.get(reverse('pet_card', args=[self.pet.qr_slug])))
+
+    def test_found_animal(self):
+        self.assertConstantQueries(lambda: self.client.get(reverse('found_animal')))
+
+    def test_send_location_alert(self):
+        url = reverse('send_location_alert', args=[self.pet.id])
+        self.assertConstantQueries(lambda: self._post_json(url, {
+            'latitude': 13.7563, 'longitude': 100.5018, 'timestamp': '2026-01-01T00:00:00Z',
+        }))
+
+    def test_send_manual_location_alert(self):
+        url = reverse('send_manual_location_alert', args=[self.pet.id])
+        self.assertConstantQueries(lambda: self._post_json(url, {
+            'locationDescription': 'Near the park gate', 'contactInfo': '0812345678',
+            'timestamp': '2026-01-01T00:00:00Z',
+        }))
+
+    # ---- owner ----
+
+    def test_owner_dashboard(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('dashboard')))
+
+    def test_create_pet_form(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('create_pet')))
+
+    def test_edit_pet_form(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('edit_pet', args=[self.pet.id])))
+
+    def test_generate_qr(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('generate_qr', args=[self.pet.id])))
+
+    def test_grant_access_form(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('grant_access', args=[self.pet.id])))
+
+    def test_grant_access(self):
+        self.client.force_login(self.owner)
+        url = reverse('grant_access', args=[self.pet.id])
+        self.assertConstantQueries(lambda: self.client.post(url, {'doctor_id': self.doctor.id}), status=302)
+
+    def test_bulk_access_form(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('bulk_access')))
+
+    def test_bulk_access(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.post(reverse('bulk_access'), {
+            'action': 'grant', 'pet_ids': [str(self.pet.id)], 'doctor_ids': [str(self.doctor.id)],
+        }), status=302)
+
+    def test_doctor_search(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('doctor_search'), {'q': 'doc'}))
+
+    def test_pet_search(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('pet_search')))
+
+    def test_pet_search_filtered(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('pet_search'), {'q': 'pet', 'species': 'dog'}))
+
+    def test_owner_medical_record(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('view_medical_record', args=[self.pet.id])))
+
+    def test_owner_older_medical_records(self):
+        self.client.force_login(self.owner)
+        url = reverse('view_medical_record', args=[self.pet.id]) + '?older=1'
+        self.assertConstantQueries(lambda: self.client.get(url))
+
+    def test_owner_medical_history_pdf(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('medical_history_pdf', args=[self.pet.id])))
+
+    def test_toggle_lost_status(self):
+        self.client.force_login(self.owner)
+        url = reverse('toggle_lost_status', args=[self.pet.id])
+        self.assertConstantQueries(lambda: self.client.post(url), status=302)
+
+    def test_chunked_upload(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(
+            lambda: self._post_json(reverse('chunked_upload'), {'filename': 'avatar.jpg', 'size': 1024}),
+            status=201,
+        )
+
+    def test_chunked_upload_status(self):
+        self.client.force_login(self.owner)
+        upload = ChunkedUpload.objects.create(user=self.owner, filename='avatar.jpg', total_size=1024)
+        self.assertConstantQueries(lambda: self.client.get(reverse('chunked_upload_part', args=[upload.token])))
+
+    def test_edit_user_profile(self):
+        self.client.force_login(self.owner)
+        self.assertConstantQueries(lambda: self.client.get(reverse('edit_user_profile')))
+
+    # ---- doctor ----
+
+    def test_doctor_dashboard(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('doctor_dashboard')))
+
+    def test_doctor_medical_record(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('view_medical_record', args=[self.pet.id])))
+
+    def test_doctor_analytics(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('doctor_analytics')))
+
+    def test_doctor_analytics_data(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('doctor_analytics_data')))
+
+    def test_doctor_pet_search(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('pet_search')))
+
+    def test_doctor_medical_history_pdf(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('medical_history_pdf', args=[self.pet.id])))
+
+    def test_add_medical_record_form(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('add_medical_record', args=[self.pet.id])))
+
+    def test_add_medical_record(self):
+        self.client.force_login(self.doctor_user)
+        url = reverse('add_medical_record', args=[self.pet.id])
+        self.assertConstantQueries(
+            lambda: self.client.post(url, {'diagnosis': 'Vaccination', 'treatment': 'Rabies shot'}), status=302,
+        )
+
+    def test_doctor_adds_record_on_medical_record_page(self):
+        self.client.force_login(self.doctor_user)
+        url = reverse('view_medical_record', args=[self.pet.id])
+        self.assertConstantQueries(
+            lambda: self.client.post(url, {'diagnosis': 'Vaccination', 'treatment': 'Rabies shot'}), status=302,
+        )
+
+    def test_edit_medical_record_form(self):
+        self.client.force_login(self.doctor_user)
+        self.assertConstantQueries(lambda: self.client.get(reverse('edit_medical_record', args=[self.record.id])))
+
+    def test_edit_medical_record(self):
+        self.client.force_login(self.doctor_user)
+        url = reverse('edit_medical_record', args=[self.record.id])
+        self.assertConstantQueries(
+            lambda: self.client.post(url, {'diagnosis': 'Checkup', 'treatment': 'More rest'}), status=302,
+        )
+
+    def test_delete_medical_record(self):
+        self.client.force_login(self.doctor_user)
+
+        def delete():
+            # สร้างแถวที่จะลบในแต่ละรอบ (INSERT เดียว นับรวมทั้งสองรอบเท่ากัน)
+            record = MedicalRecord.objects.create(pet=self.pet, doctor=self.doctor, diagnosis='Typo', treatment='-')
+            return self.client.post(reverse('delete_medical_record', args=[record.id]))
+
+        self.assertConstantQueries(delete, status=302)
+
+
+@override_settings(
+    PET_CARD_SNAPSHOTS=False,
+    AUDIT_BUFFER_SIZE=1,
+)
+class MedicalRecordPartitionTests(TestCase):
+    spec = PARTITIONED_TABLES['core_medicalrecord']
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        ensure_partitions(cls.spec, datetime.date(today.year - 4, 1, 1), datetime.date(today.year + 1, 1, 1))
+        group = Group.objects.create(name='Owner')
+        group.permissions.set(Permission.objects.filter(content_type__app_label='core', codename__in=OWNER_PERMISSIONS))
+        cls.owner = User.objects.create_user(email='owner@example.com', password=None, role='OWNER')
+        cls.owner.groups.add(group)
+        cls.pet = Pet.objects.create(owner=cls.owner, name='Rex', qr_slug='rex')
+        MedicalRecord.objects.create(pet=cls.pet, diagnosis='Recent visit', treatment='-')
+        old = MedicalRecord.objects.create(pet=cls.pet, diagnosis='Old visit', treatment='-')
+        # date เป็น auto_now_add: ย้ายไป partition ของปีก่อน ๆ ด้วย update
+        MedicalRecord.objects.filter(pk=old.pk).update(date=datetime.date(today.year - 3, 6, 1))
+
+    def _scanned_partitions(self, queryset):
+        return set(re.findall(r'core_medicalrecord_p\d{4}', queryset.explain()))
+
+    def test_recent_records_prune_old_partitions(self):
+        today = timezone.localdate()
+        years = {(today - datetime.timedelta(days=365)).year, today.year, today.year + 1}
+        scanned = self._scanned_partitions(MedicalRecord.objects.filter(pet=self.pet).recent())
+        self.assertEqual(scanned, {self.spec.partition_name(datetime.date(year, 1, 1)) for year in years})
+
+    def test_older_visits_are_on_their_own_page(self):
+        self.client.force_login(self.owner)
+        url = reverse('view_medical_record', args=[self.pet.id])
+        recent = self.client.get(url)
+        self.assertEqual([r.diagnosis for r in recent.context['medical_records']], ['Recent visit'])
+        self.assertContains(recent, '?older=1')
+        older = self.client.get(url + '?older=1')
+        self.assertEqual([r.diagnosis for r in older.context['medical_records']], ['Old visit'])
+
+    def test_pet_with_archived_records_can_be_deleted(self):
+        today = timezone.localdate()
+        archive = self.spec.partition_name(datetime.date(today.year - 3, 1, 1))
+        self.assertIn(archive, detach_partitions_before(self.spec, datetime.date(today.year - 2, 1, 1)))
+        self.assertEqual([r.diagnosis for r in MedicalRecord.objects.filter(pet=self.pet)], ['Recent visit'])
+
+        with connection.cursor() as cursor:
+            # FK ของ Django เป็น DEFERRED: ตรวจทันทีแทนการรอ commit ที่ไม่เกิดในเทสต์
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            self.pet.delete()
+            cursor.execute(f'SELECT diagnosis FROM {archive}')
+            self.assertEqual(cursor.fetchall(), [('Old visit',)])
+
+
+def _test_font(path, characters):
+    """TrueType ฟอนต์เล็ก ๆ ที่มีเฉพาะ ``characters`` (ทุกตัวเป็นสี่เหลี่ยม) สำหรับทดสอบการฝังฟอนต์ใน PDF"""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    names = ['.notdef'] + [f'uni{ord(c):04X}' for c in characters]
+    pen = TTGlyphPen(None)
+    pen.moveTo((50, 0))
+    pen.lineTo((50, 700))
+    pen.lineTo((450, 700))
+    pen.lineTo((450, 0))
+    pen.closePath()
+    box = pen.glyph()
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({ord(c): name for c, name in zip(characters, names[1:])})
+    builder.setupGlyf({name: box for name in names})
+    # สระบน/วรรณยุกต์กว้าง 0 เหมือนฟอนต์ไทยจริง
+    builder.setupHorizontalMetrics({
+        name: (0 if unicodedata.category(chr(int(name[3:], 16))) == 'Mn' else 500, 50) if name != '.notdef'
+        else (500, 50) for name in names
+    })
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': 'Test Thai', 'styleName': 'Regular'})
+    builder.setupOS2(sTypoAscender=800, usWinAscent=800, usWinDescent=200, sCapHeight=700)
+    builder.setupPost()
+    builder.save(path)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    AUDIT_BUFFER_SIZE=1,
+)
+class MedicalHistoryPdfTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.font_dir = tempfile.mkdtemp(prefix='petid-test-fonts-')
+        cls.asset_dir = tempfile.mkdtemp(prefix='petid-test-assets-')
+        cls.enterClassContext(override_settings(STORAGES={
+            **settings.STORAGES,
+            'assets': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': cls.asset_dir}},
+        }))
+        characters = ''.join(sorted(set(' ?-,.:/0123456789' + string.ascii_letters + 'กขดนมหวาแไ่้')))
+        cls.font = os.path.join(cls.font_dir, 'test.ttf')
+        _test_font(cls.font, characters)
+        cls.enterClassContext(override_settings(PDF_FONT=cls.font, PDF_BOLD_FONT=cls.font))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.font_dir, ignore_errors=True)
+        shutil.rmtree(cls.asset_dir, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password=None, role='OWNER', first_name='สมหญิง',
+        )
+        self.owner.user_permissions.set(
+            Permission.objects.filter(content_type__app_label='core', codename__in=OWNER_PERMISSIONS)
+        )
+        self.pet = Pet.objects.create(owner=self.owner, name='ขนมหวาน', species='แมว', qr_slug='khanom')
+        MedicalRecord.objects.create(pet=self.pet, diagnosis='ไข้หวัด', treatment='-')
+
+    def _pdf(self):
+        records = MedicalRecord.objects.filter(pet=self.pet).select_related('doctor__user').order_by('date')
+        return b''.join(medical_history_pdf(self.pet, records))
+
+    def _text_objects(self, pdf):
+        # ถอดสตรีมทั้งหมดที่บีบอัดไว้ แล้วรวมเป็นก้อนเดียวให้ค้นหาได้
+        streams = re.findall(rb'/FlateDecode >>\nstream\n(.*?)\nendstream', pdf, re.S)
+        return b'\n'.join(zlib.decompress(stream) for stream in streams if stream[:1] == b'x')
+
+    def test_medical_history_pdf_is_cached_until_records_change(self):
+        self.client.force_login(self.owner)
+        url = reverse('medical_history_pdf', args=[self.pet.id])
+
+        first = self.client.get(url)
+        pdf = b''.join(first.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF-') and pdf.endswith(b'%%EOF\n'))
+        self.assertNotIsInstance(first, FileResponse)
+
+        cached = self.client.get(url)
+        self.assertIsInstance(cached, FileResponse)
+        self.assertEqual(b''.join(cached.streaming_content), pdf)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MedicalRecord.objects.create(pet=self.pet, diagnosis='Follow-up', treatment='-')
+        fresh = self.client.get(url)
+        self.assertNotIsInstance(fresh, FileResponse)
+        b''.join(fresh.streaming_content)
+        # ฉบับเก่าถูกลบเมื่อเก็บฉบับใหม่
+        _, files = asset_storage().listdir(f'exports/history/{self.pet.id}')
+        self.assertEqual(len(files), 1)
+
+    def test_thai_text_is_set_in_the_embedded_font(self):
+        pdf = self._pdf()
+        self.assertTrue(pdf.startswith(b'%PDF-') and pdf.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Subtype /Type0', pdf)
+        self.assertIn(b'/Encoding /Identity-H', pdf)
+        self.assertIn(b'/FontFile2', pdf)
+        self.assertNotIn(b'/Helvetica', pdf)
+
+        font = TrueTypeFont(self.font)
+        decoded = self._text_objects(pdf)
+        self.assertIn(_pdf_string('ขนมหวาน'), decoded)
+        self.assertIn(_pdf_string('ไข้หว', bold=True)[1:-1], decoded)
+        # ToUnicode แปลง glyph กลับเป็นตัวอักษรไทย ให้คัดลอก/ค้นหาข้อความได้
+        self.assertIn(b'<%04X> <0E02>' % font.glyph('ข'), decoded)
+
+    def test_characters_missing_from_the_font_fall_back_to_question_mark(self):
+        font = TrueTypeFont(self.font)
+        self.assertEqual(font.glyph('ั'), font.glyph('?'))
+        self.assertEqual(_pdf_string('ก?'), b'<%04X%04X>' % (font.glyph('ก'), font.glyph('?')))
+
+    def test_embedded_font_is_subset_to_the_characters_used(self):
+        from fontTools.ttLib import TTFont
+
+        pdf = self._pdf()
+        match = re.search(rb'/Length (\d+) /Length1 \d+ /Filter /FlateDecode >>\nstream\n', pdf)
+        data = zlib.decompress(pdf[match.end():match.end() + int(match.group(1))])
+        subset = TTFont(io.BytesIO(data))
+        font = TrueTypeFont(self.font)
+        # retain_gids: glyph id เดิม (Identity CIDToGIDMap) ยังใช้ได้ แต่ตัวที่ไม่ได้ใช้ไม่มีเส้น
+        glyf = subset['glyf']
+        order = subset.getGlyphOrder()
+        self.assertGreater(glyf[order[font.glyph('ข')]].numberOfContours, 0)
+        self.assertEqual(glyf[order[font.glyph('Z')]].numberOfContours, 0)
+
+    def test_long_thai_lines_are_not_cut_before_a_tone_mark(self):
+        font = TrueTypeFont(self.font)
+        text = 'แม่' * 10
+        width = font.width('แม่' * 3 + 'แม') * 10 / 1000
+        lines = wrap(text, 10, width)
+        self.assertEqual(''.join(lines), text)
+        for line in lines:
+            self.assertNotEqual(unicodedata.category(line[0]), 'Mn')
+
+    def test_missing_font_falls_back_to_helvetica(self):
+        missing = os.path.join(self.font_dir, 'missing.ttf')
+        with override_settings(PDF_FONT=missing), mock.patch('builtins.print') as log:
+            pdf = self._pdf()
+        log.assert_called()
+        self.assertIn(b'/BaseFont /Helvetica /Encoding /WinAnsiEncoding', pdf)
+        self.assertNotIn(b'/FontFile2', pdf)
+        self.assertIn(b'(??????? - medical history - page 1)', self._text_objects(pdf))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PermissionCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='vet@example.com', password=None, role='DOCTOR')
+        self.group = Group.objects.create(name='Vets')
+        self.view_pet = Permission.objects.get(content_type__app_label='core', codename='view_pet')
+        self.view_doctor = Permission.objects.get(content_type__app_label='core', codename='view_doctor')
+
+    def _permissions(self):
+        """Permissions of a freshly loaded user and the queries the check needed besides loading it."""
+        user = User.objects.get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            perms = user.get_all_permissions()
+        return perms, len(queries)
+
+    def test_second_check_is_served_from_the_cache(self):
+        self.user.user_permissions.add(self.view_pet)
+        self.assertEqual(self._permissions(), ({'core.view_pet'}, 2))
+        self.assertEqual(self._permissions(), ({'core.view_pet'}, 0))
+
+    def test_group_and_permission_changes_invalidate(self):
+        self.assertEqual(self._permissions()[0], set())
+        self.user.groups.add(self.group)
+        self.group.permissions.add(self.view_pet)
+        self.assertEqual(self._permissions()[0], {'core.view_pet'})
+        self.user.user_permissions.add(self.view_doctor)
+        self.assertEqual(self._permissions()[0], {'core.view_pet', 'core.view_doctor'})
+        self.group.user_set.remove(self.user)
+        self.assertEqual(self._permissions()[0], {'core.view_doctor'})
+
+    def test_role_and_superuser_changes_invalidate(self):
+        self.user.user_permissions.add(self.view_pet)
+        self._permissions()
+        User.objects.filter(pk=self.user.pk).update(role='OWNER')
+        self.assertEqual(self._permissions()[1], 2)
+
+        User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        self.assertIn('core.view_doctor', self._permissions()[0])
+        User.objects.filter(pk=self.user.pk).update(is_superuser=False)
+        self.assertEqual(self._permissions()[0], {'core.view_pet'})
+
+    def test_login_syncs_the_role_group_only_when_it_differs(self):
+        self.user.set_password('secret-pass')
+        self.user.save()
+        self.user.groups.add(self.group)
+        response = self.client.post(reverse('login'), {'email': 'vet@example.com', 'password': 'secret-pass'})
+        self.assertRedirects(response, reverse('doctor_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(list(self.user.groups.values_list('name', flat=True)), ['Doctor'])
+
+        # membership ถูกต้องแล้ว: อ่านอย่างเดียว ไม่เขียนซ้ำ (และไม่ทำให้ cache ของสิทธิ์หมดอายุ)
+        with self.assertNumQueries(1):
+            sync_role_group(self.user)
+
+
+class DoctorSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(email='owner@example.com', password=None, role='OWNER')
+        cls.owner.user_permissions.set(
+            Permission.objects.filter(content_type__app_label='core', codename__in=OWNER_PERMISSIONS)
+        )
+        cls.pet = Pet.objects.create(owner=cls.owner, name='Rex', qr_slug='rex')
+        people = [
+            ('somchai@vet.example.com', 'Somchai', 'Jaidee', 'Happy Paws Clinic'),
+            ('anna@example.com', 'Anna', 'Smith', 'Riverside Animal Hospital'),
+            ('ben@example.com', 'Ben', 'Somsak', ''),
+        ]
+        cls.doctors = {}
+        for email, first_name, last_name, clinic in people:
+            user = User.objects.create_user(
+                email=email, password=None, role='DOCTOR', first_name=first_name, last_name=last_name,
+            )
+            cls.doctors[first_name] = Doctor.objects.create(user=user, clinic=clinic)
+
+    def _names(self, query):
+        return sorted(doctor.user.first_name for doctor in Doctor.objects.search(query))
+
+    def test_search_matches_name_email_or_clinic_case_insensitively(self):
+        self.assertEqual(self._names('SOM'), ['Ben', 'Somchai'])
+        self.assertEqual(self._names('vet.example'), ['Somchai'])
+        self.assertEqual(self._names('riverside'), ['Anna'])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self._names('som paws'), ['Somchai'])
+        self.assertEqual(self._names('anna paws'), [])
+
+    def test_search_can_use_the_trigram_indexes(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            # ตารางในเทสต์เล็กจน planner เลือกอ่านทั้งตาราง (seq scan หรือไล่ pkey): ปิดไว้
+            # เหลือแต่ bitmap scan ซึ่งต้องมีเงื่อนไขของ index จึงเห็นว่า trigram index ใช้ได้หรือไม่
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_indexscan = off')
+            plan = Doctor.objects.search('clinic').explain()
+        self.assertIn('core_doctor_clinic_trgm', plan)
+        self.assertIn('core_user_email_trgm', plan)
+
+    def test_view_returns_at_most_max_results(self):
+        for i in range(12):
+            user = User.objects.create_user(email=f'vet-{i:02}@example.com', password=None, role='DOCTOR',
+                                            first_name='Vet', last_name=f'{i:02}')
+            Doctor.objects.create(user=user)
+        self.client.force_login(self.owner)
+        results = self.client.get(reverse('doctor_search'), {'q': 'vet'}).json()['results']
+        self.assertEqual(len(results), 10)
+        # Somchai ตรงกับ "vet" ทาง email และเรียงตามชื่อหลัง "Vet"
+        self.assertEqual([r['name'] for r in results[:2]], ['Dr. Somchai Jaidee', 'Dr. Vet 00'])
+
+    def test_view_answers_owners_only_and_ignores_short_queries(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse('doctor_search'), {'q': 's'}).json(), {'results': []})
+        response = self.client.get(reverse('doctor_search'), {'q': 'riverside'})
+        self.assertEqual(response.json(), {'results': [{
+            'id': self.doctors['Anna'].id, 'name': 'Dr. Anna Smith', 'email': 'anna@example.com',
+            'clinic': 'Riverside Animal Hospital',
+        }]})
+
+        doctor_user = self.doctors['Anna'].user
+        doctor_user.user_permissions.set(Permission.objects.filter(codename='view_doctor'))
+        self.client.force_login(doctor_user)
+        self.assertEqual(self.client.get(reverse('doctor_search'), {'q': 'riverside'}).status_code, 403)
+
+    def test_grant_access_page_lists_only_granted_doctors(self):
+        self.doctors['Anna'].pets.add(self.pet)
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('grant_access', args=[self.pet.id]))
+        self.assertEqual(list(response.context['granted_doctors']), [self.doctors['Anna']])
+        self.assertNotContains(response, 'somchai@vet.example.com')
+
+        self.client.post(reverse('grant_access', args=[self.pet.id]), {'doctor_id': self.doctors['Ben'].id})
+        self.assertEqual(set(self.pet.doctors.all()), {self.doctors['Anna'], self.doctors['Ben']})
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    AUDIT_BUFFER_SIZE=1,
+)
+class BulkAccessTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(email='owner@example.com', password=None, role='OWNER')
+        self.pets = [Pet.objects.create(owner=self.owner, name=f'Pet {i}', qr_slug=f'pet-{i}') for i in range(3)]
+        self.pet_ids = {pet.pk for pet in self.pets}
+        self.doctors = [
+            Doctor.objects.create(user=User.objects.create_user(email=f'vet{i}@example.com', password=None, role='DOCTOR'))
+            for i in range(2)
+        ]
+        self.doctor_ids = {doctor.pk for doctor in self.doctors}
+
+    def _pairs(self):
+        return set(Doctor.pets.through.objects.values_list('doctor_id', 'pet_id'))
+
+    def test_grant_and_revoke_are_idempotent(self):
+        expected = {(doctor_id, pet_id) for doctor_id in self.doctor_ids for pet_id in self.pet_ids}
+        self.assertEqual(bulk_update_access(self.pet_ids, grant=self.doctor_ids), (6, 0))
+        self.assertEqual(bulk_update_access(self.pet_ids, grant=self.doctor_ids), (6, 0))
+        self.assertEqual(self._pairs(), expected)
+
+        self.assertEqual(bulk_update_access(self.pet_ids, revoke=self.doctor_ids), (0, 6))
+        self.assertEqual(bulk_update_access(self.pet_ids, revoke=self.doctor_ids), (0, 0))
+        self.assertEqual(self._pairs(), set())
+
+    def test_access_cache_is_invalidated_after_commit(self):
+        doctor_id = self.doctors[0].pk
+        self.assertEqual(doctor_pet_ids(doctor_id), frozenset())
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk_update_access(self.pet_ids, grant=[doctor_id])
+        # ยังไม่ commit: คนอื่นยังต้องเห็นชุดเดิม
+        self.assertEqual(doctor_pet_ids(doctor_id), frozenset())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(doctor_pet_ids(doctor_id), frozenset(self.pet_ids))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_access([self.pets[0].pk], revoke=[doctor_id])
+        self.assertEqual(doctor_pet_ids(doctor_id), frozenset(self.pet_ids - {self.pets[0].pk}))
+
+    def test_command_matches_emails_in_any_case_and_rejects_unknown_ones(self):
+        doctor = self.doctors[0]
+        call_command(
+            'bulk_access', 'grant', '--owner', ' Owner@Example.com',
+            '--doctor', str(doctor.pk), '--doctor', doctor.user.email.upper(), stdout=io.StringIO(),
+        )
+        self.assertEqual(self._pairs(), {(doctor.pk, pet_id) for pet_id in self.pet_ids})
+        with self.assertRaisesMessage(CommandError, 'nobody@example.com'):
+            call_command(
+                'bulk_access', 'grant', '--owner', 'owner@example.com',
+                '--doctor', str(doctor.pk), '--doctor', 'nobody@example.com', stdout=io.StringIO(),
+            )
+        with self.assertRaisesMessage(CommandError, 'nobody@example.com'):
+            call_command(
+                'bulk_access', 'grant', '--owner', 'owner@example.com', '--owner', 'Nobody@example.com',
+                '--doctor', str(doctor.pk), stdout=io.StringIO(),
+            )
+
+    def test_view_rejects_an_unknown_action(self):
+        self.owner.user_permissions.set(Permission.objects.filter(
+            content_type__app_label='core', codename__in=['change_pet', 'view_doctor'],
+        ))
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse('bulk_access'), {'action': 'share'})
+        self.assertEqual(response.status_code, 400)
+
+
+class EmailLoginTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email=' Ann@Example.COM ', password='secret-pass-1')
+
+    def test_emails_are_stored_lowercase_and_login_ignores_case(self):
+        self.assertEqual(self.user.email, 'ann@example.com')
+        self.assertEqual(authenticate(None, username='ANN@example.com ', password='secret-pass-1'), self.user)
+        self.assertIsNone(authenticate(None, username='ann@example.com', password='wrong'))
+
+        form = RegistrationForm(data={
+            'first_name': 'A', 'last_name': 'B', 'email': 'Ann@example.com', 'role': 'OWNER',
+            'phone_number': '0800000000', 'password1': 'Xx1!long-enough', 'password2': 'Xx1!long-enough',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('email', form.errors)
+
+    def test_unknown_email_still_hashes_the_password(self):
+        with mock.patch.object(User, 'set_password') as set_password:
+            self.assertIsNone(EmailBackend().authenticate(None, username='nobody@example.com', password='secret-pass-1'))
+        set_password.assert_called_once_with('secret-pass-1')
+
+    def test_case_colliding_accounts_are_left_alone_and_need_the_exact_email(self):
+        # บัญชีเก่าก่อน normalize: update() ไม่ผ่าน save() จึงเก็บตัวพิมพ์ใหญ่ไว้ได้
+        other = User.objects.create_user(email='other@example.com', password='secret-pass-2')
+        solo = User.objects.create_user(email='solo@example.com', password='secret-pass-3')
+        User.objects.filter(pk=self.user.pk).update(email='Ann@Example.com')
+        User.objects.filter(pk=other.pk).update(email='ANN@example.com')
+        User.objects.filter(pk=solo.pk).update(email='Solo@Example.com')
+
+        migration = importlib.import_module('core.migrations.0007_user_email_normalization')
+        with connection.schema_editor() as schema_editor:
+            migration.lowercase_emails(None, schema_editor)
+        self.assertEqual(
+            dict(User.objects.values_list('pk', 'email')),
+            {self.user.pk: 'Ann@Example.com', other.pk: 'ANN@example.com', solo.pk: 'solo@example.com'},
+        )
+
+        self.assertEqual(authenticate(None, username='ANN@example.com', password='secret-pass-2'), other)
+        with mock.patch.object(User, 'set_password') as set_password:
+            self.assertIsNone(EmailBackend().authenticate(None, username='ann@example.com', password='secret-pass-1'))
+        set_password.assert_called_once_with('secret-pass-1')
+
+
+@override_settings(AUDIT_BUFFER_SIZE=3, AUDIT_FLUSH_INTERVAL=5.0)
+class AuditLogTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user(email='owner@example.com', password=None)
+        self.pet = Pet.objects.create(owner=owner, name='Rex', qr_slug='rex')
+        self.buffer = AuditBuffer()
+        # ไม่ให้ timer thread จริงเขียนผ่าน connection อื่นนอก transaction ของเทสต์
+        timer = mock.patch('core.audit.threading.Timer')
+        self.Timer = timer.start()
+        self.addCleanup(timer.stop)
+
+    def _event(self, action='VIEW'):
+        return RecordAccessLog(pet_id=self.pet.pk, action=action)
+
+    def test_buffer_is_written_in_one_batch_once_full(self):
+        self.buffer.add(self._event())
+        self.buffer.add(self._event())
+        self.assertEqual(RecordAccessLog.objects.count(), 0)
+        with self.assertNumQueries(1):
+            self.buffer.add(self._event())
+        self.assertEqual(RecordAccessLog.objects.count(), 3)
+        self.Timer.assert_called_once()
+
+    def test_events_older_than_the_interval_are_flushed(self):
+        with mock.patch('core.audit.time.monotonic', return_value=100.0):
+            self.buffer.add(self._event())
+        with mock.patch('core.audit.time.monotonic', return_value=105.0):
+            self.buffer.add(self._event('EXPORT'))
+        self.assertEqual(RecordAccessLog.objects.count(), 2)
+
+    def test_idle_buffer_is_flushed_by_the_timer(self):
+        self.buffer.add(self._event())
+        interval, on_timer = self.Timer.call_args.args
+        self.assertEqual(interval, settings.AUDIT_FLUSH_INTERVAL)
+        with mock.patch('core.audit.connection'):
+            on_timer()
+        self.assertEqual(RecordAccessLog.objects.count(), 1)
+
+    def test_accesses_for_pet_returns_the_range_newest_first(self):
+        now = timezone.now()
+        RecordAccessLog.objects.bulk_create([
+            RecordAccessLog(pet_id=self.pet.pk, action='VIEW', accessed_at=now - datetime.timedelta(days=days))
+            for days in (1, 10, 40, 400)
+        ])
+        RecordAccessLog.objects.create(pet_id=uuid.uuid4(), action='VIEW', accessed_at=now)
+        found = accesses_for_pet(self.pet.pk, now - datetime.timedelta(days=30), now)
+        self.assertEqual(
+            [log.accessed_at for log in found],
+            [now - datetime.timedelta(days=1), now - datetime.timedelta(days=10)],
+        )
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+)
+class PetFacetCountTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password=None)
+
+    def _pet(self, name, species, breed=''):
+        return Pet.objects.create(owner=self.owner, name=name, species=species, breed=breed, qr_slug=name.lower())
+
+    @staticmethod
+    def _counts():
+        return {
+            (row.species, row.breed, row.color): row.count
+            for row in PetFacetCount.objects.filter(count__gt=0)
+        }
+
+    def test_counts_follow_create_edit_and_delete(self):
+        rex = self._pet('Rex', 'Dog', 'Beagle')
+        self._pet('Max', ' DOG ', 'beagle')
+        tom = self._pet('Tom', 'Cat')
+        self.assertEqual(self._counts(), {('dog', 'beagle', ''): 2, ('cat', '', ''): 1})
+
+        rex.species = 'Cat'
+        rex.save()
+        # บันทึก field อื่นต้องไม่นับซ้ำ
+        tom.name = 'Tommy'
+        tom.save(update_fields=['name'])
+        self.assertEqual(self._counts(), {('dog', 'beagle', ''): 1, ('cat', 'beagle', ''): 1, ('cat', '', ''): 1})
+
+        tom.delete()
+        expected = {('dog', 'beagle', ''): 1, ('cat', 'beagle', ''): 1}
+        self.assertEqual(self._counts(), expected)
+        self.assertEqual(
+            summary_facet_counts({}, 10)['species'],
+            [{'value': 'cat', 'count': 1}, {'value': 'dog', 'count': 1}],
+        )
+
+        # แก้ข้ามโมเดล (ไม่มี signal) แล้ว rebuild ต้องได้ค่าตรงกับตาราง pet
+        Pet.objects.filter(pk=rex.pk).update(species_normalized='dog')
+        self.assertEqual(self._counts(), expected)
+        self.assertEqual(rebuild_facet_counts(), 1)
+        self.assertEqual(self._counts(), {('dog', 'beagle', ''): 2})
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    ADMIN_ESTIMATED_COUNT_THRESHOLD=1000,
+)
+class AdminScalingTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email='admin@example.com', password=None, is_staff=True)
+        self.pets = Pet.objects.bulk_create([
+            Pet(owner=self.admin, name=f'Pet {i}', species='Dog', species_normalized='dog', qr_slug=f'pet-{i}')
+            for i in range(3)
+        ])
+
+    def test_planner_estimate_is_read_after_analyze(self):
+        MedicalRecord.objects.create(pet=self.pets[0], diagnosis='Checkup', treatment='-')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_pet')
+            cursor.execute('ANALYZE core_medicalrecord')
+        self.assertEqual(estimated_row_count(Pet), 3)
+        # ตาราง partition: รวมจากทุก partition ย่อย
+        self.assertEqual(estimated_row_count(MedicalRecord), 1)
+
+    def test_estimate_only_for_large_unfiltered_tables(self):
+        with mock.patch('core.pagination.estimated_row_count', return_value=5000) as estimate:
+            self.assertEqual(EstimatedCountPaginator(Pet.objects.order_by('pk'), 50).count, 5000)
+            self.assertEqual(EstimatedCountPaginator(Pet.objects.filter(name='Pet 1').order_by('pk'), 50).count, 1)
+            self.assertEqual(EstimatedCountPaginator(Pet.objects.distinct().order_by('pk'), 50).count, 3)
+            estimate.return_value = 500
+            self.assertEqual(EstimatedCountPaginator(Pet.objects.order_by('pk'), 50).count, 3)
+            estimate.return_value = None
+            self.assertEqual(EstimatedCountPaginator(Pet.objects.order_by('pk'), 50).count, 3)
+
+    def _add_doctors(self, count):
+        start = Doctor.objects.count()
+        users = User.objects.bulk_create([
+            User(email=f'doctor-{i}@example.com', role='DOCTOR', first_name='Doc', last_name=str(i))
+            for i in range(start, start + count)
+        ])
+        Doctor.objects.bulk_create([Doctor(user=user, clinic=f'Clinic {i}') for i, user in enumerate(users)])
+
+    def _changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:core_doctor_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_doctor_changelist_loads_in_a_fixed_number_of_queries(self):
+        self.client.force_login(self.admin)
+        self._add_doctors(2)
+        small = self._changelist_queries(), self._changelist_queries(q='clinic 1')
+        self._add_doctors(40)
+        self.assertEqual((self._changelist_queries(), self._changelist_queries(q='clinic 1')), small)
+        self.assertLessEqual(max(small), 6)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    AUDIT_BUFFER_SIZE=1,
+)
+class DashboardFragmentCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        owner_group = Group.objects.create(name='Owner')
+        owner_group.permissions.set(Permission.objects.filter(content_type__app_label='core', codename__in=OWNER_PERMISSIONS))
+        doctor_group = Group.objects.create(name='Doctor')
+        doctor_group.permissions.set(Permission.objects.filter(content_type__app_label='core', codename__in=DOCTOR_PERMISSIONS))
+        self.owner = User.objects.create_user(email='owner@example.com', password=None, role='OWNER', phone_number='0811111111')
+        self.owner.groups.add(owner_group)
+        self.doctor_user = User.objects.create_user(email='vet@example.com', password=None, role='DOCTOR')
+        self.doctor_user.groups.add(doctor_group)
+        self.pet = Pet.objects.create(owner=self.owner, name='Rex', qr_slug='rex')
+        Doctor.objects.create(user=self.doctor_user).pets.add(self.pet)
+
+    def _page(self, user, url_name):
+        self.client.force_login(user)
+        return self.client.get(reverse(url_name)).content.decode()
+
+    def test_editing_the_pet_refreshes_its_card(self):
+        self.assertIn('Rex', self._page(self.owner, 'dashboard'))
+        # update() ไม่เลื่อน updated_at: การ์ดยังมาจาก cache
+        Pet.objects.filter(pk=self.pet.pk).update(name='Sneaky')
+        self.assertNotIn('Sneaky', self._page(self.owner, 'dashboard'))
+
+        self.pet.name = 'Rex II'
+        self.pet.save()
+        self.assertIn('Rex II', self._page(self.owner, 'dashboard'))
+
+    def test_editing_the_owner_refreshes_the_doctors_card(self):
+        self.assertIn('0811111111', self._page(self.doctor_user, 'doctor_dashboard'))
+        updated_at = Pet.objects.get(pk=self.pet.pk).updated_at
+
+        self.owner.phone_number = '0822222222'
+        self.owner.save()
+        self.assertGreater(Pet.objects.get(pk=self.pet.pk).updated_at, updated_at)
+        page = self._page(self.doctor_user, 'doctor_dashboard')
+        self.assertIn('0822222222', page)
+        self.assertNotIn('0811111111', page)
+
+
+class WarmUpTests(TestCase):
+
+    def test_compiles_the_projects_templates_only(self):
+        loader = engines['django'].engine.template_loaders[0]
+        loader.reset()
+        self.addCleanup(loader.reset)
+
+        self.assertEqual(set(warm_up()), {'urls', 'templates', 'db'})
+        compiled = set(loader.get_template_cache)
+        self.assertTrue({'pet_card.html', 'owner_dashboard.html', 'doctor_dashboard.html'} <= compiled)
+        self.assertFalse(any(name.startswith('admin/') for name in compiled))
+
+    def test_boot_does_not_import_imaging_libraries(self):
+        out = io.StringIO()
+        call_command('profile_imports', '--top', '100000', stdout=out)
+        lines = out.getvalue().splitlines()
+        modules = {line.split()[0] for line in lines[1:-1]}
+        self.assertIn('core.views', modules)
+        # qrcode/Pillow/fontTools โหลดเมื่อสร้าง QR, รูป หรือ PDF ครั้งแรกเท่านั้น
+        for lazy in ('qrcode', 'PIL', 'fontTools'):
+            self.assertFalse({m for m in modules if m == lazy or m.startswith(lazy + '.')}, lazy)
+        self.assertTrue(lines[-1].startswith('Total import time at boot:'))
+
+
+def _photo(seed):
+    """A PNG of random blocks; different seeds give clearly different pHashes."""
+    rng = random.Random(seed)
+    image = Image.new('L', (8, 8))
+    image.putdata([rng.randrange(256) for _ in range(64)])
+    out = io.BytesIO()
+    image.resize((128, 128), Image.Resampling.NEAREST).save(out, 'PNG')
+    return out.getvalue()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    PHASH_MATCH_DISTANCE=12,
+)
+class LostPetMatchingTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(prefix='petid-test-media-')
+        cls.enterClassContext(override_settings(MEDIA_ROOT=cls.media_root))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(email='owner@example.com', password=None)
+        self.pet = Pet.objects.create(owner=owner, name='Rex', qr_slug='rex')
+
+    def test_bk_tree_finds_exactly_the_hashes_within_distance(self):
+        rng = random.Random(1)
+        values = [rng.getrandbits(64) for _ in range(300)]
+        # ค่าที่ใกล้ query จริง ๆ: สุ่มพลิก bit ไม่เกิน 14 bit
+        query = values[0]
+        values += [query ^ sum(1 << bit for bit in rng.sample(range(64), flips)) for flips in range(15)]
+        tree = BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+
+        found = tree.search(query, settings.PHASH_MATCH_DISTANCE)
+        expected = sorted(
+            (hamming(query, value), i) for i, value in enumerate(values)
+            if hamming(query, value) <= settings.PHASH_MATCH_DISTANCE
+        )
+        self.assertEqual(sorted(found), expected)
+        self.assertEqual([d for d, _ in found], sorted(d for d, _ in found))
+        self.assertEqual(len(expected), 14)
+
+    def test_index_is_rebuilt_only_when_lost_pets_change(self):
+        Pet.objects.filter(pk=self.pet.pk).update(avatar_phash=42, avatar_dhash=7)
+        self.pet.refresh_from_db()
+        self.assertEqual(lost_pet_index().size, 0)
+        version = cache.get(LOST_INDEX_VERSION_KEY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pet.name = 'Rex II'
+            self.pet.save()
+        self.assertEqual(cache.get(LOST_INDEX_VERSION_KEY), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pet.is_lost = True
+            self.pet.save()
+        self.assertNotEqual(cache.get(LOST_INDEX_VERSION_KEY), version)
+        self.assertEqual(lost_pet_index().search(42, 0), [(0, (self.pet.pk, 7))])
+
+        version = cache.get(LOST_INDEX_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            Pet.objects.get(pk=self.pet.pk).delete()
+        self.assertNotEqual(cache.get(LOST_INDEX_VERSION_KEY), version)
+        self.assertEqual(lost_pet_index().size, 0)
+
+    def test_new_avatar_is_hashed_after_commit(self):
+        Pet.objects.filter(pk=self.pet.pk).update(is_lost=True, avatar_phash=42, avatar_dhash=7)
+        self.pet.refresh_from_db()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.pet.avatar.save('rex.png', ContentFile(_photo(1)))
+        # ไม่มีการอ่านรูประหว่าง request: hash เก่าถูกล้าง และการคำนวณรอหลัง commit
+        self.assertEqual(Pet.objects.filter(pk=self.pet.pk, avatar_phash__isnull=True).count(), 1)
+        self.assertTrue(callbacks)
+
+        version = cache.get(LOST_INDEX_VERSION_KEY)
+        self.assertIsNotNone(hash_pet_avatar(self.pet.pk))
+        self.assertNotEqual(cache.get(LOST_INDEX_VERSION_KEY), version)
+        self.assertEqual(find_lost_pets(io.BytesIO(_photo(1))), [(self.pet.pk, 0)])
+        self.assertEqual(find_lost_pets(io.BytesIO(_photo(2))), [])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ALLOWED_HOSTS=['pets.ngrok-free.app', 'testserver'],
+    AUDIT_BUFFER_SIZE=1,
+    PET_CARD_SNAPSHOTS=False,
+)
+class PetCardSnapshotTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.snapshot_dir = tempfile.mkdtemp(prefix='petid-test-cards-')
+        cls.enterClassContext(override_settings(PET_CARD_SNAPSHOT_DIR=cls.snapshot_dir))
+        cls.enterClassContext(mock.patch.dict('os.environ', {'NGROK_DOMAIN': 'https://pets.ngrok-free.app'}))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.snapshot_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password='old-password', first_name='Ann')
+        self.pet = Pet.objects.create(owner=self.owner, name='Rex', qr_slug='rex')
+        Pet.objects.filter(pk=self.pet.pk).update(avatar='avatars/rex.png')
+
+    def test_snapshot_renders_like_a_scan_on_the_public_host(self):
+        self.assertTrue(render_snapshot(self.pet.pk))
+        with open(snapshot_path('rex'), encoding='utf-8') as f:
+            html = f.read()
+        self.assertIn('rex.png?ngrok-skip-browser-warning=1', html)
+        self.assertNotIn('csrfmiddlewaretoken', html)
+        self.assertNotIn('X-CSRFToken', html)
+        self.assertIsNotNone(Pet.objects.get(pk=self.pet.pk).card_rendered_at)
+        self.assertFalse(render_snapshot(0))
+
+    def test_snapshot_is_removed_with_the_pet(self):
+        render_snapshot(self.pet.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pet.delete()
+        self.assertFalse(os.path.exists(snapshot_path('rex')))
+
+    def test_card_view_serves_pets_without_a_snapshot(self):
+        # nginx ส่งต่อมาที่ view เมื่อยังไม่มีไฟล์ snapshot
+        self.assertFalse(os.path.exists(snapshot_path('rex')))
+        response = self.client.get(reverse('pet_card', args=['rex']), HTTP_HOST='pets.ngrok-free.app')
+        self.assertContains(response, 'rex.png?ngrok-skip-browser-warning=1')
+
+    def test_only_card_details_of_the_owner_trigger_a_render(self):
+        updated_at = Pet.objects.get(pk=self.pet.pk).updated_at
+        self.owner.set_password('new-password')
+        self.owner.save()
+        self.assertEqual(Pet.objects.get(pk=self.pet.pk).updated_at, updated_at)
+
+        self.owner.first_name = 'Anna'
+        self.owner.save()
+        self.assertGreater(Pet.objects.get(pk=self.pet.pk).updated_at, updated_at)
+
+    @override_settings(PET_CARD_CACHE_TIMEOUT=300)
+    def test_snapshots_near_expiry_are_stale(self):
+        render_snapshot(self.pet.pk)
+        self.assertFalse(stale_pets().exists())
+        Pet.objects.filter(pk=self.pet.pk).update(card_rendered_at=F('card_rendered_at') - datetime.timedelta(minutes=6))
+        self.assertEqual(list(stale_pets()), [self.pet])
+
+    def test_s3_snapshots_are_re_rendered_before_signed_urls_expire(self):
+        env = {'MEDIA_STORAGE': 's3', 'S3_URL_EXPIRY': '600', 'PET_CARD_SNAPSHOTS': 'True'}
+        with mock.patch.dict('os.environ', env):
+            s3_settings = runpy.run_path(os.path.join(settings.BASE_DIR, 'PetID', 'settings.py'))
+        schedule = {name: interval for name, _, interval in s3_settings['SCHEDULED_COMMANDS']}
+        # snapshot ที่ render ช่วงท้ายของรอบ render ก่อนหน้าต้องยังไม่หมดอายุเมื่อรอบถัดไปมาถึง
+        self.assertLess(s3_settings['PET_CARD_CACHE_TIMEOUT'] + schedule['render_pet_cards'], 600)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+)
+class MediaBlobTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(prefix='petid-test-media-')
+        cls.enterClassContext(override_settings(MEDIA_ROOT=cls.media_root))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        owner = User.objects.create_user(email='owner@example.com', password=None)
+        self.pets = [Pet.objects.create(owner=owner, name=name, qr_slug=name.lower()) for name in ('Rex', 'Max')]
+
+    def test_shared_blob_outlives_one_pet_and_is_collected_when_unreferenced(self):
+        for pet in self.pets:
+            pet.avatar.save('photo.png', ContentFile(_photo(1)))
+        name = self.pets[0].avatar.name
+        self.assertEqual(self.pets[1].avatar.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pets[0].delete()
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+        self.assertTrue(avatar_storage().exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pets[1].delete()
+        # เพิ่งเขียน: ยังอยู่ในช่วง grace ให้ gc_media_blobs เก็บทีหลัง
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 0)
+        self.assertTrue(avatar_storage().exists(name))
+
+        call_command('gc_media_blobs', '--grace', '0', stdout=io.StringIO())
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(avatar_storage().exists(name))
+
+    def test_gc_keeps_referenced_blobs(self):
+        self.pets[0].avatar.save('photo.png', ContentFile(_photo(1)))
+        name = self.pets[0].avatar.name
+        call_command('gc_media_blobs', '--grace', '0', stdout=io.StringIO())
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+        self.assertTrue(avatar_storage().exists(name))
+
+
+class StaticFilesStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='petid-test-static-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_unhashed_names_until_collectstatic_writes_the_manifest(self):
+        self.assertEqual(CompressedManifestStaticFilesStorage(location=self.root).url('css/app.css'), '/static/css/app.css')
+
+        with open(os.path.join(self.root, 'staticfiles.json'), 'w') as f:
+            json.dump({'version': '1.1', 'paths': {'css/app.css': 'css/app.3f2a9c1b7e4d.css'}}, f)
+        storage = CompressedManifestStaticFilesStorage(location=self.root)
+        self.assertEqual(storage.url('css/app.css'), '/static/css/app.3f2a9c1b7e4d.css')
+        with self.assertRaises(ValueError):
+            storage.url('css/missing.css')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SIGHTING_POLL_INTERVAL=0.01,
+    PET_CARD_SNAPSHOTS=False,
+)
+class SightingStreamTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create_user(email='vet@example.com', password=None, role='DOCTOR')
+        self.owner = User.objects.create_user(email='owner@example.com', password=None, role='OWNER')
+        self.hub = SightingHub()
+        patcher = mock.patch('core.views.hub', self.hub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _stop_hub(self):
+        # ไม่ให้ poller ค้างอยู่ตอน event loop ของเทสต์ปิด
+        if self.hub._task is not None:
+            self.hub._task.cancel()
+            await asyncio.gather(self.hub._task, return_exceptions=True)
+
+    async def test_events_fan_out_to_the_owners_streams_only(self):
+        first, second = await self.hub.subscribe(1), await self.hub.subscribe(1)
+        other = await self.hub.subscribe(2)
+        try:
+            seq = publish_event(1, 'sighting', {'pet': 'Rex'})
+            for queue in (first, second):
+                self.assertEqual(
+                    await asyncio.wait_for(queue.get(), 1), (seq, {'event': 'sighting', 'data': {'pet': 'Rex'}}),
+                )
+            await asyncio.sleep(0.05)
+            self.assertTrue(other.empty())
+
+            # reconnect พร้อม Last-Event-ID ได้ event ที่พลาดไปคืน
+            replay = await self.hub.subscribe(1, last_event_id=seq - 1)
+            self.assertEqual((await asyncio.wait_for(replay.get(), 1))[0], seq)
+        finally:
+            await self._stop_hub()
+
+    async def test_stream_requires_an_owner_and_carries_only_their_events(self):
+        url = reverse('sighting_stream')
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+
+        await self.async_client.aforce_login(self.doctor)
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.get(url)
+        try:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = response.streaming_content
+            self.assertTrue((await anext(stream)).startswith(b'retry:'))
+
+            publish_event(self.doctor.pk, 'sighting', {'pet': 'Max'})
+            seq = publish_event(self.owner.pk, 'alert', {'pet': 'Rex'})
+            self.assertEqual(
+                await asyncio.wait_for(anext(stream), 1),
+                f'id: {seq}\nevent: alert\ndata: {{"pet": "Rex"}}\n\n'.encode(),
+            )
+        finally:
+            await self._stop_hub()
+
+
+class _DroppedConnection(io.BytesIO):
+    """A request body whose connection drops after ``limit`` bytes."""
+
+    def __init__(self, data, limit):
+        super().__init__(data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise OSError('connection reset by peer')
+        return super().read(min(size, self.limit - self.tell()))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    CHUNKED_UPLOAD_BUFFER_SIZE=64,
+    AVATAR_MAX_DIMENSION=64,
+)
+class ChunkedUploadTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(prefix='petid-test-media-')
+        cls.enterClassContext(override_settings(
+            MEDIA_ROOT=cls.media_root, CHUNKED_UPLOAD_DIR=os.path.join(cls.media_root, 'uploads_tmp'),
+        ))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password=None)
+        self.photo = _photo(1)
+
+    def _upload(self, data, **kwargs):
+        return ChunkedUpload.objects.create(user=self.user, filename='rex.png', total_size=len(data), **kwargs)
+
+    def _write(self, upload, offset, stream, length):
+        with self.captureOnCommitCallbacks() as callbacks:
+            offset = write_part(upload, offset, stream, length)
+        return offset, callbacks
+
+    def test_part_at_the_wrong_offset_is_refused(self):
+        upload = self._upload(self.photo)
+        self._write(upload, 0, io.BytesIO(self.photo[:100]), 100)
+        with self.assertRaises(UploadOffsetMismatch) as raised:
+            write_part(upload, 50, io.BytesIO(self.photo[50:]), len(self.photo) - 50)
+        self.assertEqual(raised.exception.offset, 100)
+
+    def test_upload_resumes_after_a_dropped_connection(self):
+        upload = self._upload(self.photo)
+        offset, _ = self._write(upload, 0, _DroppedConnection(self.photo, 200), len(self.photo))
+        self.assertEqual((offset, upload.status), (200, 'UPLOADING'))
+        # ไบต์ที่เขียนเกิน offset ที่บันทึกไว้ (request ที่ล้มก่อน save) ต้องถูกทิ้ง
+        with open(part_path(upload), 'ab') as part:
+            part.write(b'garbage')
+
+        offset, callbacks = self._write(upload, 200, io.BytesIO(self.photo[200:]), len(self.photo) - 200)
+        self.assertEqual((offset, upload.status), (len(self.photo), 'PROCESSING'))
+        self.assertEqual(len(callbacks), 1)
+        with open(part_path(upload), 'rb') as part:
+            self.assertEqual(part.read(), self.photo)
+
+    def test_finished_upload_is_downscaled_into_the_avatar_storage(self):
+        upload = self._upload(self.photo)
+        self._write(upload, 0, io.BytesIO(self.photo), len(self.photo))
+        self.assertTrue(process_upload(upload.token))
+        self.assertFalse(process_upload(upload.token))
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, 'READY')
+        self.assertTrue(upload.result.endswith('.png'))
+        with avatar_storage().open(upload.result) as f, Image.open(f) as image:
+            self.assertEqual(image.size, (64, 64))
+        self.assertFalse(os.path.exists(part_path(upload)))
+
+    def test_invalid_image_is_rejected(self):
+        data = b'not an image' * 20
+        upload = self._upload(data)
+        self._write(upload, 0, io.BytesIO(data), len(data))
+        process_upload(upload.token)
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.result), ('FAILED', ''))
+        self.assertEqual(upload.error, 'The uploaded file is not a valid image.')
+
+    def _form(self, upload, user=None):
+        form = PetForm(data={'name': 'Rex', 'upload_token': str(upload.token)}, user=user or self.user)
+        form.is_valid()
+        return form
+
+    def test_pet_form_takes_only_the_users_ready_fresh_upload(self):
+        upload = self._upload(self.photo, status='READY', result='blobs/aa/bb/rex.png')
+        form = self._form(upload)
+        self.assertNotIn('upload_token', form.errors)
+        self.assertEqual(form.cleaned_data['avatar'], 'blobs/aa/bb/rex.png')
+
+        stranger = User.objects.create_user(email='stranger@example.com', password=None)
+        self.assertIn('upload_token', self._form(upload, stranger).errors)
+
+        ChunkedUpload.objects.filter(pk=upload.pk).update(status='PROCESSING')
+        self.assertIn('still being processed', self._form(upload).errors['upload_token'][0])
+
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            status='READY',
+            updated_at=timezone.now() - datetime.timedelta(seconds=settings.MEDIA_BLOB_GRACE_SECONDS + 1),
+        )
+        self.assertIn('expired', self._form(upload).errors['upload_token'][0])
+
+
+S3_TEST_OPTIONS = {
+    'bucket_name': 'petid-media',
+    'endpoint_url': 'http://minio:9000',
+    'public_endpoint_url': 'https://pets.example.com/media-store',
+    'access_key': 'test',
+    'secret_key': 'test-secret',
+    'region_name': 'us-east-1',
+    'addressing_style': 'path',
+    'signature_version': 's3v4',
+    'default_acl': None,
+    'querystring_auth': True,
+    'querystring_expire': 600,
+}
+
+
+@unittest.skipUnless(mock_aws, 'moto is not installed')
+@override_settings(
+    STORAGES={
+        **settings.STORAGES,
+        'avatars': {'BACKEND': 'core.storage_s3.S3ContentHashStorage', 'OPTIONS': S3_TEST_OPTIONS},
+        'assets': {'BACKEND': 'core.storage_s3.SignedS3Storage', 'OPTIONS': {**S3_TEST_OPTIONS, 'location': 'assets'}},
+    },
+    PET_CARD_SNAPSHOTS=False,
+)
+class S3StorageTests(TestCase):
+    """The S3 storages against moto standing in for MinIO at http://minio:9000."""
+
+    def setUp(self):
+        patcher = mock.patch.dict('os.environ', {'MOTO_S3_CUSTOM_ENDPOINTS': S3_TEST_OPTIONS['endpoint_url']})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.enterContext(mock_aws())
+        self.s3 = boto3.client(
+            's3', endpoint_url=S3_TEST_OPTIONS['endpoint_url'], region_name='us-east-1',
+            aws_access_key_id='test', aws_secret_access_key='test-secret',
+        )
+        self.s3.create_bucket(Bucket=S3_TEST_OPTIONS['bucket_name'])
+
+    def _keys(self):
+        listing = self.s3.list_objects_v2(Bucket=S3_TEST_OPTIONS['bucket_name'])
+        return sorted(obj['Key'] for obj in listing.get('Contents', []))
+
+    def test_signed_url_uses_public_endpoint(self):
+        url = urlsplit(asset_storage().url('qr/rex.png'))
+        query = parse_qs(url.query)
+        self.assertEqual((url.scheme, url.netloc), ('https', 'pets.example.com'))
+        self.assertEqual(url.path, '/media-store/petid-media/assets/qr/rex.png')
+        self.assertEqual(query['X-Amz-Expires'], ['600'])
+        self.assertIn('X-Amz-Signature', query)
+
+        download = parse_qs(urlsplit(asset_storage().download_url('exports/a.pdf', 'Rex.pdf')).query)
+        self.assertEqual(download['response-content-disposition'], ['attachment; filename="Rex.pdf"'])
+
+    def test_same_content_is_stored_once(self):
+        storage = avatar_storage()
+        first = storage.save('pets/avatars/rex.png', ContentFile(b'same photo'))
+        second = storage.save('pets/avatars/copy.png', ContentFile(b'same photo'))
+        other = storage.save('pets/avatars/tom.png', ContentFile(b'another photo'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('blobs/'))
+        self.assertNotEqual(first, other)
+        self.assertEqual(self._keys(), sorted([first, other]))
+        with storage.open(first) as f:
+            self.assertEqual(f.read(), b'same photo')
+
+    def test_copy_media_is_idempotent(self):
+        source = tempfile.mkdtemp(prefix='petid-test-media-')
+        self.addCleanup(shutil.rmtree, source, ignore_errors=True)
+        avatar = blob_name_for('ab' * 32, 'rex.png')
+        for name, content in ((avatar, b'avatar'), ('assets/qr/rex.png', b'qr code')):
+            os.makedirs(os.path.dirname(os.path.join(source, name)), exist_ok=True)
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(content)
+        owner = User.objects.create_user(email='owner@example.com', password=None)
+        Pet.objects.create(owner=owner, name='Rex', qr_slug='rex', avatar=avatar)
+
+        out = io.StringIO()
+        call_command('copy_media', source=source, workers=2, stdout=out, stderr=io.StringIO())
+        self.assertIn('2 copied, 0 skipped, 0 missing, 0 failed', out.getvalue())
+        # avatar ต้องอยู่ใต้ชื่อเดิม ไม่ใช่ชื่อ hash ใหม่ของเนื้อหา
+        self.assertEqual(self._keys(), sorted([avatar, 'assets/qr/rex.png']))
+
+        out = io.StringIO()
+        call_command('copy_media', source=source, workers=2, stdout=out, stderr=io.StringIO())
+        self.assertIn('0 copied, 2 skipped, 0 missing, 0 failed', out.getvalue())
+        self.assertEqual(self._keys(), sorted([avatar, 'assets/qr/rex.png']))
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    PET_CARD_SNAPSHOTS=False,
+    REMINDER_LEAD_DAYS=2,
+    REMINDER_MAX_AGE_DAYS=7,
+)
+class SendRemindersTests(TestCase):
+    today = datetime.date(2026, 3, 10)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owners = [
+            User.objects.create_user(email=f'owner-{i}@example.com', password=None, first_name='Owner', last_name=str(i))
+            for i in range(2)
+        ]
+        cls.pets = [
+            Pet.objects.create(owner=owner, name=f'Pet {i}', qr_slug=f'reminder-pet-{i}')
+            for i, owner in enumerate(cls.owners + cls.owners)
+        ]
+
+    def _record(self, pet, follow_up_on, **kwargs):
+        return MedicalRecord.objects.create(
+            pet=pet, diagnosis='Vaccination', treatment='Booster due', follow_up_on=follow_up_on, **kwargs,
+        )
+
+    def test_one_digest_per_owner(self):
+        due = [
+            self._record(self.pets[0], self.today),
+            self._record(self.pets[2], self.today + datetime.timedelta(days=2)),
+            self._record(self.pets[1], self.today + datetime.timedelta(days=1)),
+        ]
+        later = self._record(self.pets[0], self.today + datetime.timedelta(days=3))
+        too_old = self._record(self.pets[1], self.today - datetime.timedelta(days=8))
+        self._record(self.pets[1], self.today, reminder_sent_at=timezone.now())
+
+        self.assertEqual(send_due_reminders(today=self.today), (2, 3))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['owner-0@example.com', 'owner-1@example.com'])
+        digest = next(m for m in mail.outbox if m.to == ['owner-0@example.com'])
+        self.assertIn('Pet 0', digest.body)
+        self.assertIn('Pet 2', digest.body)
+
+        for record in due:
+            record.refresh_from_db()
+            self.assertIsNotNone(record.reminder_sent_at)
+        for record in (later, too_old):
+            record.refresh_from_db()
+            self.assertIsNone(record.reminder_sent_at)
+        self.assertEqual(send_due_reminders(today=self.today), (0, 0))
+
+    def test_batches_resume_after_last_row(self):
+        for i in range(5):
+            self._record(self.pets[i % 2], self.today)
+        self.assertEqual(send_due_reminders(today=self.today, batch_size=2), (5, 5))
+        self.assertFalse(MedicalRecord.objects.filter(reminder_sent_at__isnull=True).exists())
+
+    def test_failed_email_is_retried(self):
+        record = self._record(self.pets[0], self.today)
+        with override_settings(EMAIL_BACKEND='core.tests.FailingEmailBackend'):
+            self.assertEqual(send_due_reminders(today=self.today), (0, 0))
+        record.refresh_from_db()
+        self.assertIsNone(record.reminder_sent_at)
+        self.assertEqual(send_due_reminders(today=self.today), (1, 1))
+
+
+@override_settings(PET_CARD_SNAPSHOTS=False)
+class DoctorAnalyticsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(email='owner@example.com', password=None)
+        cls.doctors = [
+            Doctor.objects.create(user=User.objects.create_user(email=f'vet-{i}@example.com', password=None, role='DOCTOR'))
+            for i in range(2)
+        ]
+        cls.dog = Pet.objects.create(owner=owner, name='Rex', species='Dog', qr_slug='rex')
+        cls.cat = Pet.objects.create(owner=owner, name='Tom', species='Cat', qr_slug='tom')
+
+    def _rollups(self):
+        return (
+            sorted(DoctorVisitMonth.objects.filter(visits__gt=0).values_list('doctor_id', 'month', 'visits')),
+            sorted(DoctorDiagnosisCount.objects.filter(visits__gt=0).values_list('doctor_id', 'diagnosis', 'visits')),
+            sorted(DoctorPatient.objects.values_list('doctor_id', 'pet_id', 'species', 'is_lost', 'visits')),
+        )
+
+    def test_rollups_follow_record_changes(self):
+        vet, other = self.doctors
+        first = MedicalRecord.objects.create(pet=self.dog, doctor=vet, diagnosis='Ear infection', treatment='Drops')
+        MedicalRecord.objects.create(pet=self.dog, doctor=vet, diagnosis=' ear  INFECTION', treatment='Drops')
+        MedicalRecord.objects.create(pet=self.cat, doctor=vet, diagnosis='Checkup', treatment='-')
+        MedicalRecord.objects.create(pet=self.cat, doctor=other, diagnosis='Checkup', treatment='-')
+        MedicalRecord.objects.create(pet=self.cat, doctor=None, diagnosis='Walk-in', treatment='-')
+
+        first.diagnosis = 'Allergy'
+        first.save()
+        self.cat.is_lost = True
+        self.cat.save()
+        self.dog.species = 'Canine'
+        self.dog.save()
+        MedicalRecord.objects.filter(pet=self.cat, doctor=other).get().delete()
+
+        analytics = doctor_analytics(vet)
+        self.assertEqual(analytics['total_visits'], 3)
+        self.assertEqual(analytics['visits_per_month'][-1]['visits'], 3)
+        self.assertEqual(analytics['top_diagnoses'][0], {'diagnosis': 'allergy', 'visits': 1})
+        self.assertEqual(len(analytics['top_diagnoses']), 3)
+        self.assertEqual(analytics['patients'], 2)
+        self.assertEqual(analytics['lost_patients'], 1)
+        self.assertEqual(doctor_analytics(other)['patients'], 0)
+
+        # ค่าที่ปรับทีละ record ต้องตรงกับการคำนวณใหม่ทั้งหมด
+        incremental = self._rollups()
+        rebuild_doctor_analytics()
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_deleting_a_pet_releases_its_rows(self):
+        vet = self.doctors[0]
+        MedicalRecord.objects.create(pet=self.dog, doctor=vet, diagnosis='Checkup', treatment='-')
+        self.dog.delete()
+        self.assertFalse(DoctorPatient.objects.exists())
+        self.assertEqual(doctor_analytics(vet)['total_visits'], 0)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PET_CARD_SNAPSHOTS=False,
+    AUDIT_BUFFER_SIZE=1,
+)
+class OutboxTests(TransactionTestCase):
+    # TransactionTestCase: consumer อ่านเฉพาะ transaction ที่ commit แล้ว
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password=None, role='OWNER')
+        self.owner.user_permissions.set(self._permissions('change_pet', 'view_doctor'))
+        self.doctor_user = User.objects.create_user(email='vet@example.com', password=None, role='DOCTOR')
+        self.doctor_user.user_permissions.set(self._permissions(
+            'view_pet', 'add_medicalrecord', 'change_medicalrecord', 'view_medicalrecord',
+        ))
+        self.doctor = Doctor.objects.create(user=self.doctor_user)
+        self.pet = Pet.objects.create(owner=self.owner, name='Rex', species='Dog', qr_slug='rex')
+
+    @staticmethod
+    def _permissions(*codenames):
+        return Permission.objects.filter(content_type__app_label='core', codename__in=codenames)
+
+    def _consume(self, consumer='test'):
+        events = []
+        drain(consumer, events.extend, batch_size=2)
+        return [(event.topic, event.key) for event in events]
+
+    def test_write_paths_emit_events(self):
+        pet_key = str(self.pet.pk)
+        self.client.force_login(self.owner)
+        self.client.post(reverse('toggle_lost_status', args=[self.pet.pk]))
+        self.client.post(reverse('grant_access', args=[self.pet.pk]), {'doctor_id': self.doctor.pk})
+
+        self.client.force_login(self.doctor_user)
+        record = {'diagnosis': 'Checkup', 'treatment': '-'}
+        response = self.client.post(reverse('add_medical_record', args=[self.pet.pk]), record)
+        self.assertEqual(response.status_code, 302)
+        record_id = MedicalRecord.objects.get(pet=self.pet).pk
+        response = self.client.post(reverse('edit_medical_record', args=[record_id]), {**record, 'diagnosis': 'Allergy'})
+        self.assertEqual(response.status_code, 302)
+
+        bulk_update_access([self.pet.pk], grant=[self.doctor.pk])
+        self.pet.doctors.clear()
+        bulk_update_access([self.pet.pk], revoke=[self.doctor.pk])  # ไม่มีอะไรให้ถอน
+
+        self.assertEqual(self._consume(), [
+            ('pet.lost_changed', pet_key),
+            ('access.granted', pet_key),
+            ('medical_record.created', pet_key),
+            ('medical_record.updated', pet_key),
+            ('access.granted', pet_key),
+            ('access.revoked', pet_key),
+        ])
+        lost = ChangeEvent.objects.get(topic='pet.lost_changed')
+        self.assertEqual(lost.payload, {'pet_id': pet_key, 'is_lost': True})
+        revoked = ChangeEvent.objects.get(topic='access.revoked')
+        self.assertEqual(revoked.payload, {'pet_id': pet_key, 'doctor_ids': [self.doctor.pk]})
+        self.assertEqual(self._consume(), [])
+        self.assertEqual(self._consume('other')[0], ('pet.lost_changed', pet_key))
+
+    def test_change_is_rolled_back_when_its_event_cannot_be_written(self):
+        self.client.force_login(self.owner)
+        with mock.patch('core.signals.emit', side_effect=RuntimeError('outbox unavailable')), \
+                self.assertRaises(RuntimeError):
+            self.client.post(reverse('toggle_lost_status', args=[self.pet.pk]))
+        self.pet.refresh_from_db()
+        self.assertFalse(self.pet.is_lost)
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    def test_event_is_rolled_back_when_the_write_fails(self):
+        # INSERT ของ record ล้มเหลวใน DB (diagnosis ยาวเกิน): event ที่เขียนไปก่อนหน้าต้องหายด้วย
+        with self.assertRaises(DataError), transaction.atomic():
+            self.pet.is_lost = True
+            self.pet.save()
+            MedicalRecord.objects.create(pet=self.pet, diagnosis='x' * 300, treatment='-')
+        self.assertFalse(Pet.objects.get(pk=self.pet.pk).is_lost)
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    def test_pet_save_reads_its_previous_state_once(self):
+        self.pet.is_lost = True
+        with CaptureQueriesContext(connection) as queries:
+            self.pet.save()
+        reads = [q['sql'] for q in queries.captured_queries
+                 if q['sql'].startswith('SELECT') and 'FROM "core_pet" WHERE "core_pet"."id"' in q['sql']]
+        self.assertEqual(len(reads), 1, reads)
+
+    def test_failing_handler_keeps_checkpoint(self):
+        emit('test.event', 'a')
+
+        def fail(events):
+            raise RuntimeError('handler failed')
+
+        with self.assertRaises(RuntimeError):
+            consume_batch('test', fail)
+        self.assertEqual(OutboxCheckpoint.objects.filter(consumer='test', event_id__gt=0).count(), 0)
+        self.assertEqual(self._consume(), [('test.event', 'a')])
+
+    def test_open_transactions_hold_back_later_events(self):
+        # event id 1 อยู่ใน transaction ที่ยังไม่ commit, id 2 commit ไปแล้ว:
+        # ถ้าอ่าน id 2 ก่อน checkpoint จะข้าม id 1 ไป
+        written, release = threading.Event(), threading.Event()
+
+        def slow_writer():
+            try:
+                with transaction.atomic():
+                    emit('test.slow', 'a')
+                    written.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=slow_writer)
+        thread.start()
+        try:
+            self.assertTrue(written.wait(10))
+            emit('test.fast', 'b')
+            self.assertEqual(self._consume(), [])
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(self._consume(), [('test.slow', 'a'), ('test.fast', 'b')])
+
+    def test_prune_outbox_deletes_only_old_events(self):
+        emit('test.old', 'a')
+        emit('test.new', 'b')
+        ChangeEvent.objects.filter(topic='test.old').update(
+            created_at=timezone.now() - datetime.timedelta(days=settings.OUTBOX_RETENTION_DAYS + 1))
+        out = io.StringIO()
+        call_command('prune_outbox', stdout=out)
+        self.assertIn('Pruned 1 event(s).', out.getvalue())
+        self.assertEqual(self._consume(), [('test.new', 'b')])
+
+
+class SchedulerTests(unittest.TestCase):
+
+    def test_every_scheduled_command_exists(self):
+        from django.core.management import get_commands
+
+        for name, arguments, interval in settings.SCHEDULED_COMMANDS:
+            self.assertIn(name, get_commands())
+            self.assertGreater(interval, 0)
+
+    @override_settings(SCHEDULED_COMMANDS=[('send_reminders', [], 60), ('gc_media_blobs', ['--grace', '0'], 60)])
+    def test_failing_command_does_not_stop_the_others(self):
+        def run(name, *args, **kwargs):
+            if name == 'send_reminders':
+                raise ConnectionError('SMTP server unavailable')
+
+        with mock.patch('core.management.commands.run_scheduler.call_command', side_effect=run) as command, \
+                mock.patch('core.management.commands.run_scheduler.close_old_connections'), \
+                mock.patch('builtins.print') as log:
+            call_command('run_scheduler', '--once', stderr=io.StringIO())
+        self.assertEqual([c.args for c in command.call_args_list], [('send_reminders',), ('gc_media_blobs', '--grace', '0')])
+        log.assert_called_once_with('Error running scheduled command send_reminders: SMTP server unavailable')
+
+    @override_settings(SCHEDULED_COMMANDS=[('send_reminders', [], 60), ('prune_outbox', [], 150)])
+    def test_commands_run_at_their_own_interval(self):
+        clock = [1000.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+            if clock[0] > 1000 + 200:
+                raise KeyboardInterrupt
+
+        with mock.patch('core.management.commands.run_scheduler.call_command') as command, \
+                mock.patch('core.management.commands.run_scheduler.close_old_connections'), \
+                mock.patch('core.management.commands.run_scheduler.time.monotonic', lambda: clock[0]), \
+                mock.patch('core.management.commands.run_scheduler.time.sleep', sleep), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('run_scheduler', stderr=io.StringIO())
+        # t=0, 60, 120, 180: reminders ทุก 60 วินาที; prune ที่ t=0 และ 150
+        self.assertEqual([c.args[0] for c in command.call_args_list], [
+            'send_reminders', 'prune_outbox', 'send_reminders', 'send_reminders', 'prune_outbox', 'send_reminders',
+        ])
+
+
+class FailingEmailBackend(LocmemEmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP server unavailable')
@@ -0,0 +1,162 @@
+"""
+Chunked, resumable avatar uploads.
+
+The browser creates a ``ChunkedUpload`` and then PUTs the file in parts.
+Each part names the byte offset it starts at in an ``Upload-Offset`` header.
+The part is streamed from the request into ``CHUNKED_UPLOAD_DIR`` in
+``CHUNKED_UPLOAD_BUFFER_SIZE`` pieces, so a worker never holds a whole
+photo in memory. If a connection drops, the client asks for the current
+offset and continues from there.
+
+Once the last byte has arrived, the assembled file is validated and
+downscaled with Pillow on a small background thread pool. The result is
+stored through the avatar storage (core.storage). ``PetForm`` and
+``PetEditForm`` then refer to the finished upload by its token.
+``process_uploads`` retries uploads left in PROCESSING by a restarted worker
+and discards expired ones.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+
+from .storage import avatar_storage
+
+# รูปแบบที่เก็บต่อได้เลยหลังย่อขนาด ที่เหลือแปลงเป็น PNG
+KEPT_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+_executor = None
+_executor_lock = Lock()
+
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, offset):
+        super().__init__(f"expected offset {offset}")
+        self.offset = offset
+
+
+def part_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{upload.token}.part")
+
+
+def write_part(upload, offset, stream, length):
+    """Append ``length`` bytes from ``stream`` at ``offset`` of ``upload``'s temp file.
+
+    ``upload`` must be locked with select_for_update by the caller. Bytes that
+    arrived before the client disconnected are kept, so a retry can resume
+    after them. Returns the new offset.
+    """
+    if offset != upload.offset:
+        raise UploadOffsetMismatch(upload.offset)
+    length = min(length, upload.total_size - offset)
+
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    path = part_path(upload)
+    with open(path, "r+b" if os.path.exists(path) else "wb") as part:
+        # ตัดส่วนที่เขียนค้างจาก request ที่ล้มเหลวซึ่งยังไม่ได้บันทึก offset ทิ้ง
+        part.truncate(offset)
+        part.seek(offset)
+        remaining = length
+        try:
+            while remaining > 0:
+                data = stream.read(min(settings.CHUNKED_UPLOAD_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                part.write(data)
+                remaining -= len(data)
+        except OSError as e:
+            print(f"Chunked upload {upload.token} interrupted: {e}")
+        written = length - remaining
+
+    upload.offset = offset + written
+    if upload.offset >= upload.total_size:
+        upload.status = "PROCESSING"
+        schedule_processing(upload.token)
+    upload.save(update_fields=["offset", "status", "updated_at"])
+    return upload.offset
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHUNKED_UPLOAD_WORKERS, thread_name_prefix="avatar-upload"
+            )
+        return _executor
+
+
+def schedule_processing(token):
+    transaction.on_commit(lambda: _get_executor().submit(_process_in_thread, token))
+
+
+def _process_in_thread(token):
+    close_old_connections()
+    try:
+        process_upload(token)
+    except Exception as e:
+        print(f"Error processing upload {token}: {e}")
+    finally:
+        connection.close()
+
+
+def process_upload(token):
+    """Validate and downscale a fully received upload. Returns True if it was processed."""
+    from .models import ChunkedUpload
+
+    with transaction.atomic():
+        # skip_locked: thread ใน worker และ process_uploads อาจหยิบ upload เดียวกัน
+        upload = (
+            ChunkedUpload.objects.select_for_update(skip_locked=True)
+            .filter(token=token, status="PROCESSING")
+            .first()
+        )
+        if upload is None:
+            return False
+        path = part_path(upload)
+        try:
+            content, ext = build_avatar(path)
+        except Exception as e:
+            upload.status = "FAILED"
+            upload.error = "The uploaded file is not a valid image."
+            upload.save(update_fields=["status", "error", "updated_at"])
+            print(f"Rejected upload {upload.token}: {e}")
+        else:
+            stem = os.path.splitext(os.path.basename(upload.filename))[0] or "avatar"
+            upload.result = avatar_storage().save(f"pets/avatars/{stem}{ext}", content)
+            upload.status = "READY"
+            upload.save(update_fields=["status", "result", "updated_at"])
+    if os.path.exists(path):
+        os.remove(path)
+    return True
+
+
+def build_avatar(path):
+    """Open the image at ``path``, check it and fit it into AVATAR_MAX_DIMENSION.
+
+    Returns ``(ContentFile, extension)``.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        img.verify()
+
+    size = settings.AVATAR_MAX_DIMENSION
+    with Image.open(path) as img:
+        fmt = img.format
+        # JPEG: ให้ decoder ถอดรหัสที่ความละเอียดต่ำกว่าได้เลย ประหยัด RAM มาก
+        img.draft("RGB", (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+
+        if fmt not in KEPT_FORMATS:
+            fmt = "PNG"
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = BytesIO()
+        img.save(out, format=fmt, **({"quality": 85, "optimize": True} if fmt == "JPEG" else {}))
+    return ContentFile(out.getvalue()), KEPT_FORMATS[fmt]
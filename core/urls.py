@@ -10,15 +10,25 @@ urlpatterns = [
     path('change_password/', views.PasswordChangeView.as_view(), name='change_password'),
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
     path('doctor_dashboard/', views.DoctorDashboardView.as_view(), name='doctor_dashboard'),
+    path('doctor_dashboard/analytics/', views.DoctorAnalyticsView.as_view(), name='doctor_analytics'),
+    path('doctor_dashboard/analytics/data/', views.DoctorAnalyticsDataView.as_view(), name='doctor_analytics_data'),
     path('create_pet/', views.CreatePetView.as_view(), name='create_pet'),
+    path('uploads/', views.ChunkedUploadView.as_view(), name='chunked_upload'),
+    path('uploads/<uuid:token>/', views.ChunkedUploadPartView.as_view(), name='chunked_upload_part'),
     path('pet/<str:qr_slug>/card/', views.PetCardView.as_view(), name='pet_card'),
+    path('found/', views.FoundAnimalView.as_view(), name='found_animal'),
     path('pet/<uuid:pet_id>/generate-qr/', views.GenerateQRCodeView.as_view(), name='generate_qr'),
     path('pet/<uuid:pet_id>/grant-access/', views.GrantAccessView.as_view(), name='grant_access'),
+    path('pets/access/', views.BulkAccessView.as_view(), name='bulk_access'),
+    path('pets/search/', views.PetSearchView.as_view(), name='pet_search'),
+    path('doctors/search/', views.DoctorSearchView.as_view(), name='doctor_search'),
     path('pet/<uuid:pet_id>/medical-record/', views.ViewMedicalRecordView.as_view(), name='view_medical_record'),
+    path('pet/<uuid:pet_id>/medical-record/pdf/', views.MedicalHistoryPDFView.as_view(), name='medical_history_pdf'),
     path('pet/<uuid:pet_id>/add-medical-record/', views.AddMedicalRecordView.as_view(), name='add_medical_record'),
     path('pet/<uuid:pet_id>/toggle-lost/', views.ToggleLostStatusView.as_view(), name='toggle_lost_status'),
     path('pet/<uuid:pet_id>/send-location-alert/', views.SendLocationAlertView.as_view(), name='send_location_alert'),
     path('pet/<uuid:pet_id>/send-manual-location-alert/', views.SendManualLocationAlertView.as_view(), name='send_manual_location_alert'),
+    path('events/sightings/', views.SightingStreamView.as_view(), name='sighting_stream'),
     path('profile/edit/', views.EditUserProfileView.as_view(), name='edit_user_profile'),
     path('pet/<uuid:pet_id>/edit/', views.EditPetView.as_view(), name='edit_pet'),
     path('medical-record/<int:record_id>/edit/', views.EditMedicalRecordView.as_view(), name='edit_medical_record'),
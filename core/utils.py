@@ -1,13 +1,24 @@
-import qrcode
+import hashlib
 from io import BytesIO
-from django.http import HttpResponse
-from PIL import Image, ImageDraw, ImageFont
 from decouple import config
 
-def generate_qr_image(qr_slug):
+# qrcode/Pillow import ช้า (~20 ms) จึง import ในฟังก์ชันที่ใช้จริงเท่านั้น
+# ไม่ให้ทุก worker ต้องโหลดตอน boot (ดู manage.py profile_imports)
+
+def pet_card_url(qr_slug):
     # สร้าง URL เต็มสำหรับ Pet Card โดยใช้ SERVER_IP จาก .env
     ngrok_domain = config('NGROK_DOMAIN', default='http://localhost:8000')
-    full_url = f"{ngrok_domain}/core/pet/{qr_slug}/card/"
+    return f"{ngrok_domain}/core/pet/{qr_slug}/card/"
+
+def qr_asset_name(qr_slug):
+    # ใส่ hash ของ URL ไว้ในชื่อไฟล์ เปลี่ยน NGROK_DOMAIN แล้วจะได้ QR ใหม่
+    digest = hashlib.sha1(pet_card_url(qr_slug).encode()).hexdigest()[:8]
+    return f"qr/{qr_slug}-{digest}.png"
+
+def generate_qr_image(qr_slug):
+    import qrcode
+
+    full_url = pet_card_url(qr_slug)
     
     # สร้าง QR Code
     qr = qrcode.QRCode(
@@ -27,6 +38,8 @@ def generate_qr_image(qr_slug):
     return buf
 
 # def generate_card_image(pet):
+#     import qrcode
+#     from PIL import Image, ImageDraw, ImageFont
 #     bg = Image.open("static/card_template.png").convert("RGBA")
 #     draw = ImageDraw.Draw(bg)
 #     font = ImageFont.truetype("static/fonts/Roboto-Regular.ttf", 22)
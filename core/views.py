@@ -1,23 +1,38 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from .models import Pet, Doctor, MedicalRecord
-from .forms import PetForm, MedicalRecordForm, RegistrationForm, UserProfileForm, PetEditForm
+from .models import Pet, Doctor, MedicalRecord, User, ChunkedUpload
+from django.db.models import Count, Q
+from .forms import PetForm, MedicalRecordForm, RegistrationForm, UserProfileForm, PetEditForm, FoundAnimalForm
 from django.views import View
-from django.http import HttpResponseForbidden, JsonResponse
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.models import Group
-from django.http import FileResponse, Http404, HttpResponse
-from .utils import generate_qr_image
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.core.files import File
+from .utils import generate_qr_image, qr_asset_name
+from .sightings import hub, publish_event
+from .access import bulk_update_access, doctor_has_access
+from .facets import FACETS, queryset_facet_counts, summary_facet_counts
+from .analytics import doctor_analytics, total_visits
+from .models import normalize_facet
+from .audit import record_access
+from .backends import sync_role_group
+from .storage import asset_storage, is_blob_name
+from .uploads import UploadOffsetMismatch, write_part
+from .pdf import history_pdf_name, medical_history_pdf, save_while_streaming
 from django.core.mail import send_mail
 from django.conf import settings
 import os
 import mimetypes
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.utils.http import content_disposition_header
 from django.contrib.auth.forms import PasswordChangeForm
+from django.db import transaction
 import uuid
 import json
+import asyncio
 
 class RegisterView(View):
     def get(self, request):
@@ -41,26 +56,11 @@ class LoginView(View):
         user = authenticate(request, username=email, password=password)
         if user is not None:
             login(request, user)
+            sync_role_group(user)
             # check user role and redirect accordingly
             if user.role == 'OWNER':
-                user.groups.clear()
-                try:
-                    owner_group = Group.objects.get(name='Owner')
-                    user.groups.add(owner_group)
-                except Group.DoesNotExist:
-                    # Create Owner group if it doesn't exist
-                    owner_group = Group.objects.create(name='Owner')
-                    user.groups.add(owner_group)
                 return redirect('dashboard')
             elif user.role == 'DOCTOR':
-                user.groups.clear()
-                try:
-                    doctor_group = Group.objects.get(name='Doctor')
-                    user.groups.add(doctor_group)
-                except Group.DoesNotExist:
-                    # Create Doctor group if it doesn't exist
-                    doctor_group = Group.objects.create(name='Doctor')
-                    user.groups.add(doctor_group)
                 return redirect('doctor_dashboard')
         return render(request, 'login.html', {'error': 'Invalid credentials'})
 
@@ -89,10 +89,13 @@ class DashboardView(LoginRequiredMixin, PermissionRequiredMixin, View):
             return redirect('doctor_dashboard')
         if request.user.role != 'OWNER':
             return HttpResponseForbidden("You are not authorized to view this page.")
-        pets = Pet.objects.filter(owner=request.user)
+        pets = Pet.objects.filter(owner=request.user).annotate(doctor_count=Count('doctors'))
         if (not pets.exists()):
             return redirect('create_pet')
-        return render(request, 'owner_dashboard.html', {'pets': pets})
+        return render(request, 'owner_dashboard.html', {
+            'pets': pets,
+            'card_cache_timeout': settings.PET_CARD_CACHE_TIMEOUT,
+        })
     
 class DoctorDashboardView(LoginRequiredMixin, PermissionRequiredMixin, View):
     login_url = '/core/login/'
@@ -104,9 +107,46 @@ class DoctorDashboardView(LoginRequiredMixin, PermissionRequiredMixin, View):
 
         # สร้าง Doctor record หากยังไม่มี
         doctor, created = Doctor.objects.get_or_create(user=request.user)
-        pets = doctor.pets.all()
-        total_records = MedicalRecord.objects.filter(doctor=doctor).count()
-        return render(request, 'doctor_dashboard.html', {'pets': pets, 'total_records': total_records})
+        pets = doctor.pets.select_related('owner')
+        # อ่านจากตาราง rollup (core.analytics) แทน COUNT ทั้งตาราง medical record
+        total_records = total_visits(doctor)
+        return render(request, 'doctor_dashboard.html', {
+            'pets': pets,
+            'total_records': total_records,
+            'card_cache_timeout': settings.PET_CARD_CACHE_TIMEOUT,
+        })
+
+class DoctorAnalyticsView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Visits per month, top diagnoses and patients per species, from the rollups in core.analytics."""
+    login_url = '/core/login/'
+    permission_required = ['core.view_medicalrecord', 'core.view_pet']
+
+    def get(self, request):
+        if request.user.role != 'DOCTOR':
+            return HttpResponseForbidden("You are not authorized to view this page.")
+        doctor = get_object_or_404(Doctor, user=request.user)
+        analytics = doctor_analytics(doctor)
+
+        # ความยาวแท่งกราฟเป็น % ของค่าสูงสุด
+        busiest = max((row['visits'] for row in analytics['visits_per_month']), default=0) or 1
+        for row in analytics['visits_per_month']:
+            row['percent'] = round(100 * row['visits'] / busiest)
+        return render(request, 'doctor_analytics.html', {'analytics': analytics})
+
+class DoctorAnalyticsDataView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """The analytics of DoctorAnalyticsView as JSON."""
+    permission_required = ['core.view_medicalrecord', 'core.view_pet']
+    max_months = 60
+
+    def get(self, request):
+        if request.user.role != 'DOCTOR':
+            return HttpResponseForbidden("You are not authorized to view this page.")
+        doctor = get_object_or_404(Doctor, user=request.user)
+        try:
+            months = min(max(int(request.GET.get('months', 12)), 1), self.max_months)
+        except ValueError:
+            months = 12
+        return JsonResponse(doctor_analytics(doctor, months=months))
 
 class CreatePetView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = ['core.add_pet']
@@ -120,20 +160,109 @@ class CreatePetView(LoginRequiredMixin, PermissionRequiredMixin, View):
     def post(self, request):
         if request.user.role != 'OWNER':
             return HttpResponseForbidden("You are not authorized to perform this action.")
-        form = PetForm(request.POST, request.FILES)
+        form = PetForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             pet = form.save(commit=False)
             pet.owner = request.user
             pet.qr_slug = str(uuid.uuid4()).replace("-", "")
-            pet.save()
+            with transaction.atomic():
+                pet.save()
             return redirect('dashboard')
         return render(request, 'create_pet.html', {'form': form})
 
+class ChunkedUploadView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Start a resumable avatar upload; the file itself is sent to ChunkedUploadPartView."""
+    permission_required = ['core.add_pet']
+
+    def post(self, request):
+        if request.user.role != 'OWNER':
+            return HttpResponseForbidden("You are not authorized to perform this action.")
+        try:
+            data = json.loads(request.body)
+            filename = str(data['filename'])[:255]
+            size = int(data['size'])
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'success': False, 'error': 'filename and size are required'}, status=400)
+        if size <= 0 or size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            limit = settings.CHUNKED_UPLOAD_MAX_SIZE // (1024 * 1024)
+            return JsonResponse({'success': False, 'error': f'File must be at most {limit} MB'}, status=400)
+
+        upload = ChunkedUpload.objects.create(user=request.user, filename=filename, total_size=size)
+        return JsonResponse({
+            'success': True,
+            'token': str(upload.token),
+            'offset': 0,
+            'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+        }, status=201)
+
+class ChunkedUploadPartView(LoginRequiredMixin, View):
+    def get(self, request, token):
+        upload = get_object_or_404(ChunkedUpload, token=token, user=request.user)
+        return JsonResponse({
+            'token': str(upload.token),
+            'offset': upload.offset,
+            'size': upload.total_size,
+            'status': upload.status,
+            'error': upload.error,
+            'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+        })
+
+    def put(self, request, token):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return JsonResponse({'success': False, 'error': 'Upload-Offset header is required'}, status=400)
+
+        with transaction.atomic():
+            # ล็อกแถวไว้ตลอดการเขียน กัน request ซ้อนของ token เดียวกันเขียนทับกัน
+            upload = get_object_or_404(
+                ChunkedUpload.objects.select_for_update(), token=token, user=request.user
+            )
+            if upload.status != 'UPLOADING':
+                return JsonResponse({'success': False, 'offset': upload.offset, 'status': upload.status}, status=409)
+            try:
+                new_offset = write_part(upload, offset, request, length)
+            except UploadOffsetMismatch as e:
+                return JsonResponse({'success': False, 'offset': e.offset, 'status': upload.status}, status=409)
+        return JsonResponse({'success': True, 'offset': new_offset, 'status': upload.status})
+
 class PetCardView(View):
     def get(self, request, qr_slug):
         pet = get_object_or_404(Pet, qr_slug=qr_slug)
         return render(request, 'pet_card.html', {'pet': pet})
 
+class FoundAnimalView(View):
+    """Match a finder's photo against the avatars of lost pets (core.phash)."""
+
+    def get(self, request):
+        return render(request, 'found_animal.html', {'form': FoundAnimalForm()})
+
+    def post(self, request):
+        form = FoundAnimalForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return render(request, 'found_animal.html', {'form': form})
+
+        # numpy โหลดเฉพาะเมื่อมีการค้นหา ไม่ให้เพิ่มเวลา boot ของ worker
+        from .phash import HASH_BITS, find_lost_pets
+
+        photo = form.cleaned_data['photo']
+        photo.seek(0)
+        try:
+            matches = find_lost_pets(photo)
+        except (OSError, ValueError) as e:
+            print(f"Error matching found animal photo: {e}")
+            form.add_error('photo', "Could not read this photo, please try another one")
+            return render(request, 'found_animal.html', {'form': form})
+
+        # index อาจเก่ากว่าข้อมูลเล็กน้อย: กรอง is_lost ซ้ำอีกครั้ง
+        pets = Pet.objects.filter(is_lost=True).in_bulk([pet_id for pet_id, _ in matches])
+        results = [
+            {'pet': pets[pet_id], 'similarity': round(100 * (1 - distance / HASH_BITS))}
+            for pet_id, distance in matches if pet_id in pets
+        ]
+        return render(request, 'found_animal.html', {'form': FoundAnimalForm(), 'results': results, 'searched': True})
+
 class GenerateQRCodeView(LoginRequiredMixin, View):
     login_url = '/core/login/'
 
@@ -142,11 +271,16 @@ class GenerateQRCodeView(LoginRequiredMixin, View):
             return HttpResponseForbidden("You are not authorized to perform this action.")
         
         pet = get_object_or_404(Pet, id=pet_id, owner=request.user)
-        qr_image = generate_qr_image(pet.qr_slug)
-        
-        response = FileResponse(qr_image, content_type='image/png')
-        response['Content-Disposition'] = f'attachment; filename="{pet.name}_qr_code.png"'
-        return response
+        storage = asset_storage()
+        name = qr_asset_name(pet.qr_slug)
+        if not storage.exists(name):
+            storage.save(name, File(generate_qr_image(pet.qr_slug), name=name))
+
+        filename = f"{pet.name}_qr_code.png"
+        if hasattr(storage, 'download_url'):
+            # object storage: ให้ browser โหลดจาก bucket โดยตรงผ่าน signed URL
+            return redirect(storage.download_url(name, filename))
+        return FileResponse(storage.open(name), as_attachment=True, filename=filename, content_type='image/png')
 
 class GrantAccessView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = ['core.change_pet', 'core.view_doctor']
@@ -156,8 +290,9 @@ class GrantAccessView(LoginRequiredMixin, PermissionRequiredMixin, View):
             return HttpResponseForbidden("You are not authorized to perform this action.")
         
         pet = get_object_or_404(Pet, id=pet_id, owner=request.user)
-        doctors = Doctor.objects.all()
-        return render(request, 'grant_access.html', {'pet': pet, 'doctors': doctors})
+        # รายชื่อหมอค้นหาผ่าน DoctorSearchView แทนการโหลดหมอทั้งหมด
+        granted_doctors = pet.doctors.select_related('user')
+        return render(request, 'grant_access.html', {'pet': pet, 'granted_doctors': granted_doctors})
     
     def post(self, request, pet_id):
         if request.user.role != 'OWNER':
@@ -168,14 +303,173 @@ class GrantAccessView(LoginRequiredMixin, PermissionRequiredMixin, View):
         
         if doctor_id:
             doctor = get_object_or_404(Doctor, id=doctor_id)
-            pet.doctors.add(doctor)
-            pet.save()
+            bulk_update_access([pet.id], grant=[doctor.id])
         
         return redirect('dashboard')
 
+class BulkAccessView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Grant or revoke many doctors on many of the owner's pets at once."""
+    permission_required = ['core.change_pet', 'core.view_doctor']
+
+    def get(self, request):
+        if request.user.role != 'OWNER':
+            return HttpResponseForbidden("You are not authorized to perform this action.")
+        pets = Pet.objects.filter(owner=request.user).order_by('name')
+        return render(request, 'bulk_access.html', {'pets': pets})
+
+    def post(self, request):
+        if request.user.role != 'OWNER':
+            return HttpResponseForbidden("You are not authorized to perform this action.")
+
+        action = request.POST.get('action')
+        if action not in ('grant', 'revoke'):
+            return HttpResponseBadRequest("Unknown action.")
+
+        # กรองเฉพาะสัตว์เลี้ยงของผู้ใช้และหมอที่มีอยู่จริง
+        pet_ids = list(
+            Pet.objects.filter(owner=request.user, id__in=self._uuids(request.POST.getlist('pet_ids')))
+            .values_list('id', flat=True)
+        )
+        doctor_ids = list(
+            Doctor.objects.filter(id__in=[d for d in request.POST.getlist('doctor_ids') if d.isdigit()])
+            .values_list('id', flat=True)
+        )
+        if not pet_ids or not doctor_ids:
+            pets = Pet.objects.filter(owner=request.user).order_by('name')
+            return render(request, 'bulk_access.html', {
+                'pets': pets,
+                'error': 'Select at least one pet and one doctor.',
+            })
+
+        if action == 'grant':
+            bulk_update_access(pet_ids, grant=doctor_ids)
+        else:
+            bulk_update_access(pet_ids, revoke=doctor_ids)
+        return redirect('dashboard')
+
+    @staticmethod
+    def _uuids(values):
+        result = []
+        for value in values:
+            try:
+                result.append(uuid.UUID(value))
+            except ValueError:
+                continue
+        return result
+
+class DoctorSearchView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Autocomplete for the grant-access form: doctors by name, email or clinic."""
+    permission_required = ['core.view_doctor']
+    min_query_length = 2
+    max_results = 10
+
+    def get(self, request):
+        if request.user.role != 'OWNER':
+            return HttpResponseForbidden("You are not authorized to perform this action.")
+
+        query = request.GET.get('q', '').strip()
+        if len(query) < self.min_query_length:
+            return JsonResponse({'results': []})
+
+        doctors = (
+            Doctor.objects.select_related('user')
+            .search(query)
+            .order_by('user__first_name', 'user__last_name', 'id')[:self.max_results]
+        )
+        return JsonResponse({'results': [
+            {
+                'id': doctor.id,
+                'name': str(doctor),
+                'email': doctor.user.email,
+                'clinic': doctor.clinic,
+            }
+            for doctor in doctors
+        ]})
+
+class PetSearchView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Search pets by name and filter by species/breed/color, with facet counts.
+
+    Staff search every pet, owners their own pets and doctors the pets they
+    have been granted. Facet counts over all pets come from PetFacetCount
+    (core.facets); smaller scopes are counted directly.
+    """
+    permission_required = ['core.view_pet']
+    page_size = 20
+    facet_limit = 20
+
+    def get(self, request):
+        user = request.user
+        if user.is_staff:
+            pets = Pet.objects.all()
+        elif user.role == 'OWNER':
+            pets = Pet.objects.filter(owner=user)
+        elif user.role == 'DOCTOR':
+            pets = Pet.objects.filter(doctors__user=user)
+        else:
+            return HttpResponseForbidden("You are not authorized to perform this action.")
+
+        filters = {}
+        for facet in FACETS:
+            value = normalize_facet(request.GET.get(facet))
+            if value:
+                filters[facet] = value
+        query = request.GET.get('q', '').strip()
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+
+        if query:
+            # ทุกคำต้องตรงกับชื่อหรือสายพันธุ์ (trigram index ของ UPPER(name), UPPER(breed_normalized))
+            for term in query.split()[:3]:
+                pets = pets.filter(Q(name__icontains=term) | Q(breed_normalized__icontains=term))
+
+        if user.is_staff and not query:
+            facets = summary_facet_counts(filters, self.facet_limit)
+        else:
+            facets = queryset_facet_counts(pets, filters, self.facet_limit)
+
+        pets = pets.filter(**{f"{facet}_normalized": value for facet, value in filters.items()})
+        # อ่านเกินมาหนึ่งแถวเพื่อรู้ว่ามีหน้าถัดไป แทนการ COUNT ทั้งชุด
+        start = (page - 1) * self.page_size
+        results = list(
+            pets.order_by('name', 'id')
+            .only('id', 'name', 'species', 'breed', 'color', 'is_lost', 'qr_slug')[start:start + self.page_size + 1]
+        )
+        return JsonResponse({
+            'results': [
+                {
+                    'id': str(pet.id),
+                    'name': pet.name,
+                    'species': pet.species,
+                    'breed': pet.breed,
+                    'color': pet.color,
+                    'is_lost': pet.is_lost,
+                    'card_url': reverse('pet_card', args=[pet.qr_slug]),
+                }
+                for pet in results[:self.page_size]
+            ],
+            'page': page,
+            'has_next': len(results) > self.page_size,
+            'filters': filters,
+            'facets': facets,
+        })
+
 class ViewMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """The pet's visits of the last year; ``?older=1`` lists the ones before that.
+
+    The default page only reads the current yearly partitions of MedicalRecord.
+    Records in partitions detached by ``manage_partitions --detach-before`` are
+    no longer part of the table and show up in neither list (nor in the PDF).
+    """
     permission_required = ['core.view_medicalrecord', 'core.view_pet']
 
+    @staticmethod
+    def _records(pet, older=False):
+        records = MedicalRecord.objects.filter(pet=pet)
+        records = records.older() if older else records.recent()
+        return records.select_related('doctor__user').order_by('-date')
+
     def get(self, request, pet_id):
         pet = get_object_or_404(Pet, id=pet_id)
         
@@ -184,12 +478,16 @@ class ViewMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
             return HttpResponseForbidden("You are not authorized to view this page.")
         elif request.user.role == 'DOCTOR':
             doctor = get_object_or_404(Doctor, user=request.user)
-            if pet not in doctor.pets.all():
+            if not doctor_has_access(doctor, pet.id):
                 return HttpResponseForbidden("You are not authorized to view this page.")
         
-        medical_records = MedicalRecord.objects.filter(pet=pet).order_by('-date')
+        older = request.GET.get('older') == '1'
+        medical_records = self._records(pet, older)
+        record_access(request.user, pet.id, 'VIEW')
         form = MedicalRecordForm()
-        return render(request, 'medical_record.html', {'pet': pet, 'medical_records': medical_records, 'form': form})
+        return render(request, 'medical_record.html', {
+            'pet': pet, 'medical_records': medical_records, 'form': form, 'older': older,
+        })
     
     def post(self, request, pet_id):
         if request.user.role != 'DOCTOR':
@@ -198,7 +496,7 @@ class ViewMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
         pet = get_object_or_404(Pet, id=pet_id)
         doctor = get_object_or_404(Doctor, user=request.user)
         
-        if pet not in doctor.pets.all():
+        if not doctor_has_access(doctor, pet.id):
             return HttpResponseForbidden("You are not authorized to perform this action.")
         
         form = MedicalRecordForm(request.POST)
@@ -206,12 +504,50 @@ class ViewMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
             medical_record = form.save(commit=False)
             medical_record.pet = pet
             medical_record.doctor = doctor
-            medical_record.save()
+            with transaction.atomic():
+                medical_record.save()
+            record_access(request.user, pet.id, 'CREATE', medical_record.id)
             return redirect('view_medical_record', pet_id=pet.id)
         
-        medical_records = MedicalRecord.objects.filter(pet=pet).order_by('-date')
+        medical_records = self._records(pet)
         return render(request, 'medical_record.html', {'pet': pet, 'medical_records': medical_records, 'form': form})
 
+class MedicalHistoryPDFView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """The pet's whole medical history as a PDF (core.pdf), for the owner and doctors with access.
+
+    Unlike the records page this reads every attached partition; detached
+    (archived) partitions are not included.
+    """
+    permission_required = ['core.view_medicalrecord', 'core.view_pet']
+
+    def get(self, request, pet_id):
+        pet = get_object_or_404(Pet.objects.select_related('owner'), id=pet_id)
+
+        if request.user.role == 'OWNER' and pet.owner != request.user:
+            return HttpResponseForbidden("You are not authorized to view this page.")
+        elif request.user.role == 'DOCTOR':
+            doctor = get_object_or_404(Doctor, user=request.user)
+            if not doctor_has_access(doctor, pet.id):
+                return HttpResponseForbidden("You are not authorized to view this page.")
+
+        record_access(request.user, pet.id, 'EXPORT')
+        storage = asset_storage()
+        name = history_pdf_name(pet)
+        filename = f"{pet.name}_medical_history.pdf"
+        if storage.exists(name):
+            if hasattr(storage, 'download_url'):
+                return redirect(storage.download_url(name, filename))
+            return FileResponse(storage.open(name), as_attachment=True, filename=filename, content_type='application/pdf')
+
+        # ยังไม่มีฉบับล่าสุด: ส่งให้ผู้ใช้ทีละหน้าระหว่างสร้าง แล้วเก็บลง storage เมื่อเสร็จ
+        records = MedicalRecord.objects.filter(pet=pet).select_related('doctor__user').order_by('-date', '-id')
+        response = StreamingHttpResponse(
+            save_while_streaming(medical_history_pdf(pet, records), storage, name),
+            content_type='application/pdf',
+        )
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        return response
+
 class AddMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = ['core.add_medicalrecord', 'core.view_pet']
 
@@ -222,7 +558,7 @@ class AddMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
         pet = get_object_or_404(Pet, id=pet_id)
         doctor = get_object_or_404(Doctor, user=request.user)
         
-        if pet not in doctor.pets.all():
+        if not doctor_has_access(doctor, pet.id):
             return HttpResponseForbidden("You are not authorized to perform this action.")
         
         form = MedicalRecordForm()
@@ -235,7 +571,7 @@ class AddMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
         pet = get_object_or_404(Pet, id=pet_id)
         doctor = get_object_or_404(Doctor, user=request.user)
         
-        if pet not in doctor.pets.all():
+        if not doctor_has_access(doctor, pet.id):
             return HttpResponseForbidden("You are not authorized to perform this action.")
         
         form = MedicalRecordForm(request.POST)
@@ -243,7 +579,9 @@ class AddMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
             medical_record = form.save(commit=False)
             medical_record.pet = pet
             medical_record.doctor = doctor
-            medical_record.save()
+            with transaction.atomic():
+                medical_record.save()
+            record_access(request.user, pet.id, 'CREATE', medical_record.id)
             return redirect('view_medical_record', pet_id=pet.id)
         
         return render(request, 'add_medical_record.html', {'pet': pet, 'form': form})
@@ -257,9 +595,19 @@ class ToggleLostStatusView(LoginRequiredMixin, PermissionRequiredMixin, View):
         
         pet = get_object_or_404(Pet, id=pet_id, owner=request.user)
         
-        # Toggle lost status
+        # Toggle lost status (event ใน outbox ต้อง commit พร้อมกัน)
         pet.is_lost = not pet.is_lost
-        pet.save()
+        with transaction.atomic():
+            pet.save()
+
+        try:
+            publish_event(pet.owner_id, 'alert', {
+                'pet_id': str(pet.id),
+                'pet_name': pet.name,
+                'is_lost': pet.is_lost,
+            })
+        except Exception as e:
+            print(f"Sighting publish error: {e}")
         
         return redirect('dashboard')
 
@@ -281,6 +629,20 @@ class SendLocationAlertView(View):
             
             # Create Google Maps link
             maps_link = f"https://www.google.com/maps?q={latitude},{longitude}"
+
+            # แจ้งเจ้าของแบบ real-time ผ่าน SSE ก่อนส่ง email
+            try:
+                publish_event(pet.owner_id, 'sighting', {
+                    'pet_id': str(pet.id),
+                    'pet_name': pet.name,
+                    'kind': 'gps',
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'maps_link': maps_link,
+                    'timestamp': timestamp,
+                })
+            except Exception as e:
+                print(f"Sighting publish error: {e}")
             
             # Prepare email content
             subject = f"🚨 URGENT: Your pet {pet.name} has been found!"
@@ -340,6 +702,19 @@ class SendManualLocationAlertView(View):
             
             if not location_description:
                 return JsonResponse({'success': False, 'error': 'Location description is required'})
+
+            # แจ้งเจ้าของแบบ real-time ผ่าน SSE ก่อนส่ง email
+            try:
+                publish_event(pet.owner_id, 'sighting', {
+                    'pet_id': str(pet.id),
+                    'pet_name': pet.name,
+                    'kind': 'manual',
+                    'location_description': location_description,
+                    'contact_info': contact_info,
+                    'timestamp': timestamp,
+                })
+            except Exception as e:
+                print(f"Sighting publish error: {e}")
             
             # Prepare email content
             subject = f"🔍 Location Report for {pet.name}"
@@ -395,6 +770,44 @@ PetID Team
             print(f"Manual location alert error: {e}")
             return JsonResponse({'success': False, 'error': 'Server error occurred'})
 
+class SightingStreamView(View):
+    """Server-Sent Events stream of sightings and alerts for the owner's pets.
+
+    Must be served by the ASGI application (PetID/asgi.py) so each idle
+    connection is a coroutine rather than a gunicorn thread.
+    """
+
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return HttpResponseForbidden("Authentication required.")
+        if user.role != 'OWNER':
+            return HttpResponseForbidden("You are not authorized to view this page.")
+
+        try:
+            last_event_id = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_event_id = None
+
+        queue = await hub.subscribe(user.pk, last_event_id)
+        response = StreamingHttpResponse(self._stream(user.pk, queue), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # ปิด buffering ของ nginx
+        return response
+
+    async def _stream(self, owner_id, queue):
+        try:
+            yield f"retry: {settings.SIGHTING_RETRY_MS}\n\n"
+            while True:
+                try:
+                    seq, event = await asyncio.wait_for(queue.get(), timeout=settings.SIGHTING_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {seq}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            hub.unsubscribe(owner_id, queue)
+
 class EditUserProfileView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = ['core.change_user', 'core.view_user']
 
@@ -422,9 +835,10 @@ class EditPetView(LoginRequiredMixin, PermissionRequiredMixin, View):
     
     def post(self, request, pet_id):
         pet = get_object_or_404(Pet, id=pet_id, owner=request.user)
-        form = PetEditForm(request.POST, request.FILES, instance=pet)
+        form = PetEditForm(request.POST, request.FILES, instance=pet, user=request.user)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
             return redirect('dashboard')
         return render(request, 'edit_pet.html', {'form': form, 'pet': pet})
 
@@ -439,9 +853,10 @@ class EditMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
         
         # Check if doctor has access to this pet
         doctor = get_object_or_404(Doctor, user=request.user)
-        if record.pet not in doctor.pets.all():
+        if not doctor_has_access(doctor, record.pet_id):
             return HttpResponseForbidden("You don't have access to this pet's medical records.")
         
+        record_access(request.user, record.pet_id, 'VIEW', record.id)
         form = MedicalRecordForm(instance=record)
         return render(request, 'edit_medical_record.html', {'form': form, 'record': record, 'pet': record.pet})
     
@@ -453,12 +868,14 @@ class EditMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View):
         
         # Check if doctor has access to this pet
         doctor = get_object_or_404(Doctor, user=request.user)
-        if record.pet not in doctor.pets.all():
+        if not doctor_has_access(doctor, record.pet_id):
             return HttpResponseForbidden("You don't have access to this pet's medical records.")
         
         form = MedicalRecordForm(request.POST, instance=record)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+            record_access(request.user, record.pet_id, 'UPDATE', record.id)
             return redirect('view_medical_record', pet_id=record.pet.id)
         return render(request, 'edit_medical_record.html', {'form': form, 'record': record, 'pet': record.pet})
 
@@ -473,10 +890,11 @@ class DeleteMedicalRecordView(LoginRequiredMixin, PermissionRequiredMixin, View)
         
         # Check if doctor has access to this pet
         doctor = get_object_or_404(Doctor, user=request.user)
-        if record.pet not in doctor.pets.all():
+        if not doctor_has_access(doctor, record.pet_id):
             return HttpResponseForbidden("You don't have access to this pet's medical records.")
         
         pet_id = record.pet.id
+        record_access(request.user, pet_id, 'DELETE', record.id)
         record.delete()
         return redirect('view_medical_record', pet_id=pet_id)
 
@@ -507,7 +925,11 @@ class ServeMediaView(View):
                 response = HttpResponse(f.read(), content_type=content_type)
                 
                 # เพิ่ม headers เพื่อแก้ปัญหาการ cache และ CORS (รองรับ ngrok)
-                response['Cache-Control'] = 'public, max-age=86400'  # Cache 1 วัน
+                if is_blob_name(path):
+                    # blob ตั้งชื่อตาม hash ของเนื้อหา ไม่มีวันเปลี่ยน
+                    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+                else:
+                    response['Cache-Control'] = 'public, max-age=86400'  # Cache 1 วัน
                 response['Access-Control-Allow-Origin'] = '*'
                 response['Access-Control-Allow-Methods'] = 'GET'
                 response['Access-Control-Allow-Headers'] = 'Content-Type, ngrok-skip-browser-warning'
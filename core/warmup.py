@@ -0,0 +1,57 @@
+"""
+Per-worker warm-up, run from gunicorn's ``post_worker_init`` hook (gunicorn.conf.py).
+
+A fresh worker otherwise pays for building the URL resolver, compiling the
+project's templates and opening its first database connection on the first
+requests it serves. Only core's templates and ``TEMPLATES['DIRS']`` are
+compiled; third-party ones such as the admin's compile on first use. ``warm_up`` does that work after the worker has loaded the app and
+before it accepts traffic. Set ``WARMUP_ON_START=False`` to skip it.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+
+def _template_names():
+    # เฉพาะ template ของโปรเจกต์: ของ django.contrib.admin มีหลายร้อยไฟล์และไม่ได้ใช้ทุก request
+    dirs = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")]
+    for engine in settings.TEMPLATES:
+        dirs.extend(engine.get("DIRS", []))
+    for directory in dirs:
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if filename.endswith(".html"):
+                    yield os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, "/")
+
+
+def warm_up():
+    """Prime URL resolvers, compiled templates and DB connections. Returns timings in ms."""
+    timings = {}
+
+    start = time.perf_counter()
+    # _populate() สร้าง reverse dict / namespace ของทุก pattern ล่วงหน้า
+    get_resolver()._populate()
+    timings["urls"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for name in set(_template_names()):
+        try:
+            # cached loader เก็บ template ที่ compile แล้วไว้ใน process นี้
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+            print(f"Warm-up: could not load template {name}: {e}")
+    timings["templates"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except Exception as e:
+            print(f"Warm-up: database {alias} unavailable: {e}")
+    timings["db"] = (time.perf_counter() - start) * 1000
+    return timings
@@ -0,0 +1,20 @@
+# gunicorn reads this file automatically from the working directory (/app).
+# Command-line flags in docker-compose.yml / the Dockerfile still take precedence.
+import os
+
+# GUNICORN_PRELOAD=True: import the app once in the master and fork workers
+# from it, so respawned workers start without re-importing Django and core.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "False").lower() in ("1", "true", "yes")
+
+
+def post_worker_init(worker):
+    from django.conf import settings
+
+    if not settings.WARMUP_ON_START:
+        return
+    from core.warmup import warm_up
+
+    timings = warm_up()
+    worker.log.info(
+        "Worker %s warmed up: %s", worker.pid, ", ".join(f"{k} {v:.1f} ms" for k, v in timings.items())
+    )
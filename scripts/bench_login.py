@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Benchmark email login on a development database.
+
+Prints the plan and latency of the ``email__iexact`` lookup, and
+``authenticate()`` timings for existing and unknown emails. Synthetic users
+are created inside a transaction that is rolled back. Refuses to run unless
+``DEBUG`` is on, so it is never pointed at production by accident.
+
+    python scripts/bench_login.py --users 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "PetID.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import authenticate  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+
+from core.models import User  # noqa: E402
+
+PASSWORD = "bench-password-1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000, help="Synthetic users to add (default: 10000)")
+    parser.add_argument("--iterations", type=int, default=20, help="Logins timed per case (default: 20)")
+    options = vars(parser.parse_args())
+    if options["users"] < 1 or options["iterations"] < 1:
+        parser.error("--users and --iterations must be >= 1")
+    if not settings.DEBUG:
+        parser.error("refusing to run with DEBUG=False; use a development database")
+    iterations, users = options["iterations"], options["users"]
+
+    with transaction.atomic():
+        # hash ครั้งเดียวแล้วใช้ซ้ำทุก user ไม่อย่างนั้นการสร้างข้อมูลจะช้ากว่าตัว benchmark
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            [User(email=f"bench-{i}@example.com", password=password, role="OWNER") for i in range(users)],
+            batch_size=1000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE core_user")
+
+        probe = "BENCH-1@Example.com"
+        print("Lookup plan:")
+        for line in User.objects.filter(email__iexact=probe).explain().splitlines():
+            print(f"  {line}")
+
+        start = time.perf_counter()
+        for i in range(iterations * 10):
+            User.objects.filter(email__iexact=f"Bench-{i % users}@example.com").first()
+        _report("email lookup", start, iterations * 10)
+
+        cases = [
+            ("authenticate, correct password", lambda i: f"Bench-{i % users}@Example.com", PASSWORD),
+            ("authenticate, wrong password", lambda i: f"bench-{i % users}@example.com", "wrong-password"),
+            ("authenticate, unknown email", lambda i: f"nobody-{i}@example.com", PASSWORD),
+        ]
+        for label, email, secret in cases:
+            start = time.perf_counter()
+            for i in range(iterations):
+                authenticate(None, username=email(i), password=secret)
+            _report(label, start, iterations)
+
+        transaction.set_rollback(True)
+
+
+def _report(label, start, count):
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed / count * 1000:8.2f} ms/op {count / elapsed:10.1f} ops/s")
+
+
+if __name__ == "__main__":
+    main()